@@ -23,7 +23,7 @@ import model.make_tf_structure as make_tf
 from tensorflow._api.v1.keras.utils import to_categorical
 import settings.constants as c
 
-weights_filename = "data/tf_weights/big_model_training_weights.hdf5"
+weights_filename = os.path.join(c.DATA_FOLDER, "tf_weights/big_model_training_weights.hdf5")
 
 config = tf.ConfigProto()
 config.gpu_options.allow_growth = True  # dynamically grow the memory used on the GPU
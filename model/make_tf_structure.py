@@ -4,8 +4,10 @@ from tensorflow._api.v1.keras.preprocessing.sequence import pad_sequences
 from tensorflow._api.v1.keras.utils import to_categorical
 
 import settings.constants as c
-import settings.music_info_pb2 as music_info
+from music_utils.proto_columns import read_melody_list
 from music_utils.vanilla_stream import VanillaStream
+from preprocessing.context import context
+from preprocessing.manifest import TF_SKYLINE_ARTIFACT
 
 
 def make_tf_data(settings=c.music_settings):
@@ -24,29 +26,27 @@ def make_tf_data(settings=c.music_settings):
 
     min_sequence_length = c.sequence_length + 1  # number of min beats per melody
 
-    while not c.melody_work_queue.empty():
+    while not context.melody_work_queue.empty():
     # how many of the songs created do you want to use for training?
     # all is too much for my computer :D
     # for i in range(100):
 
-        melody = c.melody_work_queue.get()
+        melody = context.melody_work_queue.get()
 
         # that's the kind of melody we want to see
         if not melody.endswith('_tf_skyline.melody_pb'):
             continue
 
-        with open(melody, 'rb') as fp:
-            melody_list = music_info.MelodyList()
-            melody_list.ParseFromString(fp.read())
+        melody_list = read_melody_list(context.read_artifact(melody, TF_SKYLINE_ARTIFACT))
 
         for m in melody_list.melodies:
             if len(m.lengths) < min_sequence_length:
                 continue
 
-            # append one-hot encoding/binary encoding of offset
-            pitches = [to_categorical([pitch_to_int(p, settings)], num_classes=37) for p in m.pitches]
-            lengths = [to_categorical([length_to_int(l)], num_classes=16) for l in m.lengths]
-            offsets = [offset_to_binary_array(o) for o in m.offsets]
+            # append one-hot encoding/binary encoding of offset, one entry of shape (1, classes) per note
+            pitches = list(to_categorical(pitches_to_ints(m.pitches, settings), num_classes=37)[:, None, :])
+            lengths = list(to_categorical(lengths_to_ints(m.lengths), num_classes=16)[:, None, :])
+            offsets = list(offsets_to_binary_arrays(m.offsets))
 
             for time_step in range(len(m.lengths) - 2):
                 pitches_input.append(pitches[max(0, time_step - c.sequence_length + 1): time_step + 1])
@@ -84,6 +84,18 @@ def pitch_to_int(pitch, settings=c.music_settings):
     return int((pitch - settings.min_pitch + 1) % (200 - settings.min_pitch + 1))
 
 
+def pitches_to_ints(pitches: np.ndarray, settings=c.music_settings) -> np.ndarray:
+    """
+    pitch_to_int for a whole array of pitches
+    :param pitches:
+    :param settings:
+    :return:
+    """
+    pitches = np.asarray(pitches, dtype=np.float64)
+    assert (((settings.min_pitch <= pitches) & (pitches <= settings.max_pitch)) | (pitches == 200)).all()
+    return ((pitches - settings.min_pitch + 1) % (200 - settings.min_pitch + 1)).astype(np.int64)
+
+
 def int_to_pitch(int_pitch, settings=c.music_settings):
     """
     turns an index in a one hot vector to the corresponding note pitch
@@ -107,6 +119,17 @@ def length_to_int(length):
     return int(length * 4) - 1
 
 
+def lengths_to_ints(lengths: np.ndarray) -> np.ndarray:
+    """
+    length_to_int for a whole array of lengths
+    :param lengths:
+    :return:
+    """
+    lengths = np.asarray(lengths, dtype=np.float64)
+    assert ((0.25 <= lengths) & (lengths <= 4.0)).all()
+    return (lengths * 4).astype(np.int64) - 1
+
+
 def int_to_length(int_length):
     """
     turns an integer index value into a note length
@@ -127,6 +150,16 @@ def offset_to_binary_array(offset):
     return np.asarray([int(x) for x in format(int((offset % 4) * 4), '04b')[:]], dtype='float32')
 
 
+def offsets_to_binary_arrays(offsets: np.ndarray) -> np.ndarray:
+    """
+    offset_to_binary_array for a whole array of offsets
+    :param offsets:
+    :return: shape (offsets, 4)
+    """
+    positions = ((np.asarray(offsets, dtype=np.float64) % 4) * 4).astype(np.int64)
+    return ((positions[:, None] >> np.arange(3, -1, -1)) & 1).astype('float32')
+
+
 def tf_model_output_to_musescore(music_info_list):
     """
     turns a music info list as saved in generate_tf_model into a VanillaStream and shows it in Musescore
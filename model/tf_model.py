@@ -1,3 +1,5 @@
+import os
+
 import tensorflow as tf
 from tensorflow._api.v1.keras.backend import set_session
 from tensorflow._api.v1.keras.layers import Input, LSTM, Dense, concatenate, Masking
@@ -48,7 +50,7 @@ model.compile(loss={'pitch_output': 'categorical_crossentropy',
 print(model.summary(90))
 
 # save the best results automatically in files
-filepath = "data/tf_weights/weights-improvement-tf-project-{epoch:02d}-{loss:.4f}.hdf5"
+filepath = os.path.join(c.DATA_FOLDER, "tf_weights/weights-improvement-tf-project-{epoch:02d}-{loss:.4f}.hdf5")
 checkpoint = tf.keras.callbacks.ModelCheckpoint(filepath, monitor='loss', verbose=1, save_best_only=True, mode='min')
 
 callbacks_list = [checkpoint]
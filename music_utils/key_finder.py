@@ -0,0 +1,199 @@
+import music21 as m21
+import numpy as np
+
+# analyze('key') of music21 uses the Krumhansl-Schmuckler algorithm with the Aarden-Essen weights
+KEY_ANALYSIS = m21.analysis.discrete.AardenEssen
+MODES = ('major', 'minor')
+WEIGHTS = np.array([KEY_ANALYSIS().getWeights(mode) for mode in MODES])
+
+# the tonic names music21 gives to the pitch classes of each mode
+TONIC_NAMES = [[KEY_ANALYSIS()._bestKeyEnharmonic(m21.pitch.Pitch(pitch_class), mode).name
+                for pitch_class in range(12)] for mode in MODES]
+
+# PROFILES[mode, i, j] is the weight of pitch class j in the key with tonic i
+PROFILES = np.array([[[weights[(j - i) % 12] for j in range(12)] for i in range(12)] for weights in WEIGHTS])
+
+PROFILE_AVERAGES = np.array([float(sum(weights)) / len(weights) for weights in WEIGHTS.tolist()])
+
+
+def _profile_deviations():
+    bottom_right = np.zeros((2, 12))
+    for j in range(12):
+        bottom_right = bottom_right + (PROFILES[:, :, j] - PROFILE_AVERAGES[:, None]) ** 2
+    return bottom_right
+
+
+# the sum of the squared deviations of every profile from its average
+PROFILE_DEVIATIONS = _profile_deviations()
+
+
+class KeyCorrelation:
+    """
+    the result of find_key, with the attributes of a m21.key.Key that the preprocessing uses.
+    Much cheaper to make than a Key, which matters because every result has 23 alternate interpretations
+    """
+
+    def __init__(self, tonic_name: str, mode: str, correlation: float, tonic_pitch_class: int = None):
+        self.tonic_name = tonic_name
+        self.tonic_pitch_class = tonic_pitch_class
+        self.mode = mode
+        self.correlationCoefficient = correlation
+        self.alternateInterpretations = []
+
+    @property
+    def name(self) -> str:
+        return self.tonic_name + ' ' + self.mode
+
+    @property
+    def type(self) -> str:
+        return self.mode
+
+    @property
+    def tonic(self) -> m21.pitch.Pitch:
+        return m21.pitch.Pitch(self.tonic_name)
+
+    def to_key(self) -> m21.key.Key:
+        """
+        :return: the music21 key, as analyze('key') would return it
+        """
+        key = m21.key.Key(tonic=self.tonic_name, mode=self.mode)
+        key.correlationCoefficient = self.correlationCoefficient
+        key.alternateInterpretations = []
+        for k in self.alternateInterpretations:
+            alternate = m21.key.Key(tonic=k.tonic_name, mode=k.mode)
+            alternate.correlationCoefficient = k.correlationCoefficient
+            key.alternateInterpretations.append(alternate)
+        return key
+
+    def __repr__(self):
+        return '<KeyCorrelation {n} {c}>'.format(n=self.name, c=self.correlationCoefficient)
+
+
+def pitch_class_histogram(notes) -> np.ndarray:
+    """
+    the pitch class distribution music21 analyses keys with: every pitch class weighted by
+    the quarter length of its notes
+    :param notes: notes and chords, e.g. the notes of a flat stream
+    :return: an array of 12 floats, None if there are no notes
+    """
+    pitch_classes = []
+    lengths = []
+    for n in notes:
+        length = float(n.quarterLength)
+        for p in n.pitches:
+            pitch_classes.append(p.pitchClass)
+            lengths.append(length)
+
+    if not pitch_classes:
+        return None
+
+    return np.bincount(pitch_classes, weights=lengths, minlength=12)
+
+
+def sum_histograms(histograms: list) -> np.ndarray:
+    """
+    the histogram of the notes of several streams together, e.g. of a score from the ones of its parts
+    :param histograms: histograms of pitch_class_histogram, None for no notes
+    :return: None if there are no notes at all
+    """
+    histograms = [h for h in histograms if h is not None]
+    if not histograms:
+        return None
+    return np.sum(histograms, axis=0)
+
+
+def correlations(histograms: np.ndarray) -> (np.ndarray, np.ndarray):
+    """
+    correlates pitch class histograms with the profiles of all 24 keys at once. The sums are made in the same order
+    as music21 makes them, so that the results are exactly the same
+    :param histograms: shape (parts, 12)
+    :return: the key results (the convolution music21 ranks the tonics with) and the correlation coefficients,
+             both with shape (parts, 2, 12) for the modes and tonics
+    """
+    histograms = np.asarray(histograms, dtype=np.float64)
+    number = len(histograms)
+
+    histogram_averages = np.zeros(number)
+    for j in range(12):
+        histogram_averages = histogram_averages + histograms[:, j]
+    histogram_averages = histogram_averages / 12
+
+    key_results = np.zeros((number, 2, 12))
+    top = np.zeros((number, 2, 12))
+    bottom_left = np.zeros(number)
+
+    for j in range(12):
+        column = histograms[:, j][:, None, None]
+        deviation = histograms[:, j] - histogram_averages
+
+        key_results = key_results + PROFILES[None, :, :, j] * column
+        top = top + (PROFILES[None, :, :, j] - PROFILE_AVERAGES[None, :, None]) * deviation[:, None, None]
+        bottom_left = bottom_left + deviation ** 2
+
+    denominators = PROFILE_DEVIATIONS[None, :, :] * bottom_left[:, None, None]
+    # numpy's square root isn't always the same as the one of python's power operator, which music21 uses
+    roots = np.array([d ** 0.5 for d in denominators.ravel().tolist()]).reshape(denominators.shape)
+
+    coefficients = np.zeros((number, 2, 12))
+    np.divide(top, roots, out=coefficients, where=denominators != 0)
+
+    return key_results, coefficients
+
+
+def _ranking(key_results: np.ndarray, coefficients: np.ndarray) -> (np.ndarray, np.ndarray, np.ndarray):
+    """
+    orders the 24 keys of every histogram the way music21 does: the tonics of each mode by their key result,
+    where equal results all get the first tonic with this result, then all of them by correlation coefficient,
+    pitch class and mode, the highest first
+    :return: coefficients, pitch classes and modes, with shape (parts, 24)
+    """
+    number = len(key_results)
+
+    descending = -np.sort(-key_results, axis=2)
+    pitch_classes = (key_results[:, :, None, :] == descending[:, :, :, None]).argmax(axis=3)
+    ranked_coefficients = np.take_along_axis(coefficients, pitch_classes, axis=2)
+
+    pitch_classes = pitch_classes.reshape(number, 24)
+    ranked_coefficients = ranked_coefficients.reshape(number, 24)
+    modes = np.repeat(np.arange(2), 12)[None, :].repeat(number, axis=0)
+
+    order = np.lexsort((modes, pitch_classes, ranked_coefficients), axis=1)[:, ::-1]
+
+    return (np.take_along_axis(ranked_coefficients, order, axis=1),
+            np.take_along_axis(pitch_classes, order, axis=1),
+            np.take_along_axis(modes, order, axis=1))
+
+
+def find_keys(histograms) -> list:
+    """
+    the key of every pitch class histogram, exactly like analyze('key') of music21 would find it
+    for the corresponding notes, including the alternate interpretations
+    :param histograms: a list of histograms of pitch_class_histogram, None for no notes
+    :return: a KeyCorrelation for every histogram, None if it was None
+    """
+    keys = [None] * len(histograms)
+    indices = [i for i, h in enumerate(histograms) if h is not None]
+    if not indices:
+        return keys
+
+    key_results, coefficients = correlations(np.array([histograms[i] for i in indices]))
+    ranked_coefficients, pitch_classes, modes = _ranking(key_results, coefficients)
+
+    for i, part_coefficients, part_pitch_classes, part_modes in zip(indices, ranked_coefficients.tolist(),
+                                                                    pitch_classes.tolist(), modes.tolist()):
+        ranked = [KeyCorrelation(TONIC_NAMES[mode][pitch_class], MODES[mode], coefficient, pitch_class)
+                  for coefficient, pitch_class, mode in zip(part_coefficients, part_pitch_classes, part_modes)]
+        ranked[0].alternateInterpretations = ranked[1:]
+        keys[i] = ranked[0]
+
+    return keys
+
+
+def find_key(histogram: np.ndarray) -> KeyCorrelation:
+    """
+    :param histogram: a histogram of pitch_class_histogram
+    :return: the key, like analyze('key') of music21 would find it
+    """
+    if histogram is None:
+        raise m21.analysis.discrete.DiscreteAnalysisException('failed to get likely keys for Stream component')
+    return find_keys([histogram])[0]
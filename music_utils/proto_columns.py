@@ -0,0 +1,437 @@
+#!/usr/bin/env python3
+import numpy as np
+
+import settings.constants as c
+import settings.music_info_pb2 as music_info
+from preprocessing.helper import decode_varint
+
+WIRE_VARINT = 0
+WIRE_FIXED64 = 1
+WIRE_LENGTH_DELIMITED = 2
+WIRE_FIXED32 = 5
+
+# field number -> (name, numpy type) of the repeated fields that are read as arrays
+VANILLA_PART_COLUMNS = {2: ('offsets', '<f4'), 3: ('lengths', '<f4'), 4: ('pitches', '<i4'), 5: ('volumes', '<i4')}
+MELODY_PART_COLUMNS = {2: ('offsets', '<f4'), 3: ('lengths', '<f4'), 4: ('pitches', '<i4')}
+# the same for the parts of version 2, whose offsets (zigzag encoded differences) and lengths are in quarter beats
+VANILLA_PART_V2_COLUMNS = {2: ('offset_deltas', '<i8'), 3: ('lengths', '<i8'), 4: ('pitches', '<i4'),
+                           5: ('volumes', '<i4')}
+MELODY_PART_V2_COLUMNS = {2: ('offset_deltas', '<i8'), 3: ('lengths', '<i8'), 4: ('pitches', '<i4')}
+
+
+def decode_varints(data: np.ndarray) -> np.ndarray:
+    """
+    decodes varints that follow each other directly, all at once
+    :param data: uint8 array of complete varints
+    :return: int64 array of the values. Negative int32 values are encoded with 10 bytes, so they come out right
+    """
+    if not len(data) or data.max() < 0x80:
+        # every value fits into one byte, e.g. velocities
+        return data.astype(np.int64)
+
+    ends = np.flatnonzero(data < 0x80)
+    starts = np.concatenate(([0], ends[:-1] + 1))
+    shifts = 7 * (np.arange(len(data)) - np.repeat(starts, ends - starts + 1))
+
+    groups = (data & 0x7f).astype(np.uint64) << shifts.astype(np.uint64)
+    return np.bitwise_or.reduceat(groups, starts).view(np.int64)
+
+
+def _leading(mask: np.ndarray) -> int:
+    """
+    :return: the number of True values at the start of mask
+    """
+    return len(mask) if mask.all() else int(np.argmin(mask))
+
+
+def _varint_run(raw: np.ndarray, position: int, end: int, tag: int) -> (np.ndarray, int):
+    """
+    reads the values of a repeated varint field that isn't packed: the (one byte) tag followed by a varint,
+    again and again
+    :param raw: the buffer as uint8 array
+    :param position: position of the first tag
+    :param end: end of the message
+    :param tag:
+    :return: the values and the position after the run
+    """
+    region = raw[position:end]
+    unit_ends = np.flatnonzero(region < 0x80)
+    unit_starts = np.concatenate(([0], unit_ends[:-1] + 1))
+
+    # every varint is a unit ending with a byte below 0x80. They alternate between tag and value,
+    # until a unit at the place of a tag isn't this tag anymore
+    is_tag = (unit_ends[0::2] == unit_starts[0::2]) & (region[unit_starts[0::2]] == tag)
+    number = min(_leading(is_tag), len(unit_ends) // 2)
+    if not number:
+        return np.zeros(0, dtype=np.int64), position
+
+    run_end = int(unit_ends[2 * number - 1]) + 1
+    unit_indices = np.repeat(np.arange(2 * number), unit_ends[:2 * number] - unit_starts[:2 * number] + 1)
+    return decode_varints(region[:run_end][unit_indices % 2 == 1]), position + run_end
+
+
+def read_message(buffer, columns: dict = None) -> (dict, dict):
+    """
+    reads one message of the wire format without the protobuf library. The repeated fields in columns
+    become numpy arrays that point into buffer where possible: packed floats with np.frombuffer,
+    floats that aren't packed as a strided view over their tags. Varints (packed or not) are decoded
+    all at once with decode_varints
+    :param buffer: the serialized message, bytes or a memoryview (e.g. of a message inside another one)
+    :param columns: field number -> (name, numpy type) of the repeated fields that should become arrays.
+                    Their field numbers have to be below 16, i.e. have a tag of one byte
+    :return: all other fields (field number -> list of the varint values, or memoryviews of the values
+             of the other wire types) and the arrays (name -> array, empty for missing fields)
+    """
+    buffer = memoryview(buffer)
+    end = len(buffer)
+    columns = columns or {}
+
+    raw = np.frombuffer(buffer, dtype=np.uint8)
+    fields = {}
+    chunks = {number: [] for number in columns}
+
+    position = 0
+    while position < end:
+        tag_start = position
+        key, position = decode_varint(buffer, position)
+        number = key >> 3
+        wire_type = key & 7
+
+        if number in columns:
+            dtype = np.dtype(columns[number][1])
+
+            if wire_type == WIRE_LENGTH_DELIMITED:
+                # packed
+                length, position = decode_varint(buffer, position)
+                if dtype.kind == 'f':
+                    chunks[number].append(np.frombuffer(buffer, dtype=dtype, count=length // dtype.itemsize,
+                                                        offset=position))
+                else:
+                    chunks[number].append(decode_varints(raw[position:position + length]).astype(dtype))
+                position += length
+
+            elif wire_type == WIRE_FIXED32:
+                # tag and value, 5 bytes each, until the tag changes
+                number_of_values = _leading(raw[tag_start:end - 4:5] == key)
+                chunks[number].append(np.ndarray(shape=(number_of_values,), dtype=dtype, buffer=buffer,
+                                                 offset=position, strides=(5,)))
+                position = tag_start + 5 * number_of_values
+
+            elif wire_type == WIRE_VARINT:
+                values, position = _varint_run(raw, tag_start, end, key)
+                chunks[number].append(values.astype(dtype))
+
+            else:
+                raise ValueError("unexpected wire type {w} of field {n}".format(w=wire_type, n=number))
+            continue
+
+        if wire_type == WIRE_VARINT:
+            value, position = decode_varint(buffer, position)
+        elif wire_type == WIRE_FIXED64:
+            value = buffer[position:position + 8]
+            position += 8
+        elif wire_type == WIRE_LENGTH_DELIMITED:
+            length, position = decode_varint(buffer, position)
+            value = buffer[position:position + length]
+            position += length
+        elif wire_type == WIRE_FIXED32:
+            value = buffer[position:position + 4]
+            position += 4
+        else:
+            raise ValueError("unsupported wire type {w} of field {n}".format(w=wire_type, n=number))
+
+        fields.setdefault(number, []).append(value)
+
+    if position > end:
+        raise ValueError("truncated message")
+
+    arrays = {}
+    for number, (name, dtype) in columns.items():
+        if not chunks[number]:
+            arrays[name] = np.zeros(0, dtype=dtype)
+        elif len(chunks[number]) == 1:
+            arrays[name] = chunks[number][0]
+        else:
+            arrays[name] = np.concatenate(chunks[number])
+
+    return fields, arrays
+
+
+class PartColumns:
+    """
+    a VanillaPartPB with numpy arrays instead of repeated fields, i.e. without a Python object per note.
+    The arrays can point into the serialized buffer, so they are read-only
+    """
+
+    def __init__(self, name: str, offsets: np.ndarray, lengths: np.ndarray, pitches: np.ndarray,
+                 volumes: np.ndarray):
+        self.name = name
+        self.offsets = offsets
+        self.lengths = lengths
+        self.pitches = pitches
+        self.volumes = volumes
+
+    def __len__(self):
+        return len(self.offsets)
+
+
+class VanillaStreamColumns:
+    """
+    a VanillaStreamPB with PartColumns instead of VanillaPartPBs. The PieceOfMusic info is small,
+    so it is parsed with the protobuf library
+    """
+
+    def __init__(self, filepath: str, parts: [PartColumns], info: music_info.PieceOfMusic, version: int = 1):
+        self.filepath = filepath
+        self.parts = parts
+        self.info = info
+        self.version = version
+
+
+class MelodyColumns:
+    """
+    a MelodyPartPB with numpy arrays instead of repeated fields
+    """
+
+    def __init__(self, actual_start: float, offsets: np.ndarray, lengths: np.ndarray, pitches: np.ndarray):
+        self.actual_start = actual_start
+        self.offsets = offsets
+        self.lengths = lengths
+        self.pitches = pitches
+
+    def __len__(self):
+        return len(self.offsets)
+
+
+class MelodyListColumns:
+    """
+    a MelodyList with MelodyColumns instead of MelodyPartPBs
+    """
+
+    def __init__(self, filepath: str, extra_info: str, algorithm: int, melodies: [MelodyColumns],
+                 version: int = 1):
+        self.filepath = filepath
+        self.extra_info = extra_info
+        self.algorithm = algorithm
+        self.melodies = melodies
+        self.version = version
+
+
+def _string(fields: dict, number: int, default: str = '') -> str:
+    values = fields.get(number)
+    return bytes(values[-1]).decode('utf-8') if values else default
+
+
+def _float(fields: dict, number: int, default: float = 0.0) -> float:
+    values = fields.get(number)
+    return float(np.frombuffer(values[-1], dtype='<f4')[0]) if values else default
+
+
+def _int(fields: dict, number: int, default: int = 0) -> int:
+    values = fields.get(number)
+    return values[-1] if values else default
+
+
+def _from_quarters(arrays: dict) -> dict:
+    """
+    turns the columns of a part of version 2 into the ones of version 1
+    :param arrays: offset_deltas and lengths in quarter beats, the other columns
+    :return: offsets and lengths as float32 beats, the other columns
+    """
+    deltas = arrays.pop('offset_deltas')
+    offsets = np.cumsum((deltas >> 1) ^ -(deltas & 1))
+    arrays['offsets'] = (offsets / 4).astype(np.float32)
+    arrays['lengths'] = (arrays['lengths'] / 4).astype(np.float32)
+    return arrays
+
+
+def _read_parts(values: list, columns: dict, version: int) -> [(dict, dict)]:
+    """
+    :param values: the serialized parts (or melodies)
+    :param columns: the columns of version 1
+    :param version:
+    :return: the other fields and the columns of version 1 of every part
+    """
+    parts = []
+    for value in values:
+        if version == 2:
+            part_fields, arrays = read_message(value, columns)
+            parts.append((part_fields, _from_quarters(arrays)))
+        else:
+            parts.append(read_message(value, columns))
+    return parts
+
+
+def read_vanilla_stream(serialized: bytes) -> VanillaStreamColumns:
+    """
+    reads a serialized VanillaStreamPB of either version with the columns of its parts as numpy arrays
+    :param serialized:
+    :return:
+    """
+    fields, _ = read_message(serialized)
+
+    version = _int(fields, 4, 1)
+    if version == 1:
+        parts = _read_parts(fields.get(2, []), VANILLA_PART_COLUMNS, version)
+    elif version == 2:
+        parts = _read_parts(fields.get(5, []), VANILLA_PART_V2_COLUMNS, version)
+    else:
+        raise ValueError("unknown version {v} of the VanillaStreamPB".format(v=version))
+
+    info = music_info.PieceOfMusic()
+    for value in fields.get(3, []):
+        info.MergeFromString(bytes(value))
+
+    return VanillaStreamColumns(_string(fields, 1), [PartColumns(_string(part_fields, 1), **arrays)
+                                                     for part_fields, arrays in parts], info, version)
+
+
+def read_melody_list(serialized: bytes) -> MelodyListColumns:
+    """
+    reads a serialized MelodyList of either version with the columns of its melodies as numpy arrays
+    :param serialized:
+    :return:
+    """
+    fields, _ = read_message(serialized)
+
+    version = _int(fields, 5, 1)
+    if version == 1:
+        melodies = _read_parts(fields.get(4, []), MELODY_PART_COLUMNS, version)
+    elif version == 2:
+        melodies = _read_parts(fields.get(6, []), MELODY_PART_V2_COLUMNS, version)
+    else:
+        raise ValueError("unknown version {v} of the MelodyList".format(v=version))
+
+    return MelodyListColumns(_string(fields, 1), _string(fields, 2), _int(fields, 3),
+                             [MelodyColumns(_float(melody_fields, 1), **arrays) for melody_fields, arrays in melodies],
+                             version)
+
+
+def _integers(values, factor: int = 1) -> np.ndarray:
+    """
+    :return: values * factor as int64, None if they aren't all integers that fit into an int32
+    """
+    scaled = np.asarray(values, dtype=np.float64) * factor
+    if not np.all(np.abs(scaled) < 2 ** 31) or (scaled != np.round(scaled)).any():
+        return None
+    return scaled.astype(np.int64)
+
+
+def quarter_columns(offsets, lengths, pitches, volumes=None) -> dict:
+    """
+    the columns of a part of version 2
+    :param offsets: in beats
+    :param lengths: in beats
+    :param pitches:
+    :param volumes: left out if None, e.g. for melodies
+    :return: offset_deltas and lengths in quarter beats, pitches and volumes, all as int64 arrays.
+             None if a value can't be kept exactly, e.g. an offset that isn't a multiple of 0.25
+    """
+    columns = {'offset_deltas': _integers(offsets, 4), 'lengths': _integers(lengths, 4),
+               'pitches': _integers(pitches)}
+    if volumes is not None:
+        columns['volumes'] = _integers(volumes)
+
+    if any(values is None for values in columns.values()):
+        return None
+
+    columns['offset_deltas'] = _integers(np.diff(columns['offset_deltas'], prepend=0))
+    if columns['offset_deltas'] is None:
+        return None
+
+    return columns
+
+
+def _fill_parts(parts, parts_v2, first_field: str, columns: [tuple], version: int) -> bool:
+    """
+    adds a part (or melody) for every entry of columns
+    :param parts: the repeated field of the parts of version 1
+    :param parts_v2: the repeated field of the parts of version 2
+    :param first_field: name of the field before the columns, name or actual_start
+    :param columns: the value of first_field, offsets, lengths, pitches and optionally volumes
+    :param version: 2 falls back to 1 if a part can't be kept exactly in version 2
+    :return: whether it is version 2
+    """
+    if version not in (1, 2):
+        raise ValueError("unknown version {v}".format(v=version))
+
+    if version == 2:
+        quarters = [quarter_columns(*part[1:]) for part in columns]
+        if all(part_quarters is not None for part_quarters in quarters):
+            for part, part_quarters in zip(columns, quarters):
+                proto_part = parts_v2.add()
+                setattr(proto_part, first_field, part[0])
+                for name, values in part_quarters.items():
+                    getattr(proto_part, name).extend(values.tolist())
+            return True
+
+    for part in columns:
+        proto_part = parts.add()
+        setattr(proto_part, first_field, part[0])
+        for name, values in zip(('offsets', 'lengths', 'pitches', 'volumes'), part[1:]):
+            getattr(proto_part, name).extend(np.asarray(values).tolist())
+    return False
+
+
+def make_vanilla_stream(filepath: str, info: music_info.PieceOfMusic, parts: [tuple],
+                        version: int = c.PROTO_VERSION) -> music_info.VanillaStreamPB:
+    """
+    :param filepath: relative to c.MXL_DATA_FOLDER
+    :param info:
+    :param parts: name, offsets, lengths, pitches and volumes of every part, e.g. from
+                  VanillaPart.columns_with_rests
+    :param version: of the message. Version 1 messages are exactly the ones written before there were versions
+    :return:
+    """
+    proto_buffer = music_info.VanillaStreamPB()
+    proto_buffer.filepath = filepath
+    proto_buffer.info.CopyFrom(info)
+
+    if _fill_parts(proto_buffer.parts, proto_buffer.parts_v2, 'name', parts, version):
+        proto_buffer.version = 2
+
+    return proto_buffer
+
+
+def make_melody_list(filepath: str, extra_info: str, algorithm: int, melodies: [tuple],
+                     version: int = c.PROTO_VERSION) -> music_info.MelodyList:
+    """
+    :param filepath: relative to c.MXL_DATA_FOLDER
+    :param extra_info:
+    :param algorithm: a music_info.MelodyAlgorithm
+    :param melodies: actual start, offsets, lengths and pitches of every melody
+    :param version: of the message. Version 1 messages are exactly the ones written before there were versions
+    :return:
+    """
+    melody_list = music_info.MelodyList()
+    melody_list.extra_info = extra_info
+    melody_list.filepath = filepath
+    melody_list.algorithm = algorithm
+
+    if _fill_parts(melody_list.melodies, melody_list.melodies_v2, 'actual_start', melodies, version):
+        melody_list.version = 2
+
+    return melody_list
+
+
+def convert_vanilla_stream(serialized: bytes, version: int = c.PROTO_VERSION) -> bytes:
+    """
+    :param serialized: a VanillaStreamPB of either version
+    :param version:
+    :return: the same VanillaStreamPB in the given version (if it can be kept exactly in it)
+    """
+    stream = read_vanilla_stream(serialized)
+    parts = [(p.name, p.offsets, p.lengths, p.pitches, p.volumes) for p in stream.parts]
+    return make_vanilla_stream(stream.filepath, stream.info, parts, version).SerializeToString()
+
+
+def convert_melody_list(serialized: bytes, version: int = c.PROTO_VERSION) -> bytes:
+    """
+    :param serialized: a MelodyList of either version
+    :param version:
+    :return: the same MelodyList in the given version (if it can be kept exactly in it)
+    """
+    melody_list = read_melody_list(serialized)
+    melodies = [(m.actual_start, m.offsets, m.lengths, m.pitches) for m in melody_list.melodies]
+    return make_melody_list(melody_list.filepath, melody_list.extra_info, melody_list.algorithm, melodies,
+                            version).SerializeToString()
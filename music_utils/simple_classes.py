@@ -1,29 +1,292 @@
 import os
 from copy import deepcopy
-from operator import attrgetter
 
 import music21 as m21
+import numpy as np
 from numpy import mean
 
 import settings.constants as c
 import settings.music_info_pb2 as music_info
+from music_utils.proto_columns import read_vanilla_stream
 
 
-class NoteList(list):
+# one row per note. Rests have the pitch 200
+NOTE_DTYPE = np.dtype([('offset', np.float64), ('length', np.float64), ('pitch', np.int64), ('volume', np.int64),
+                       ('part', np.int64)])
+
+
+def sort_order(data: np.ndarray) -> np.ndarray:
+    """
+    the order of NoteList.sort in one pass: by offset, then the longer and then the higher notes first, stable.
+    Notes on the grid of quarter beats (all of them, after preprocessing) are sorted by one packed int64 key
+    with numpy's stable sort. It is a timsort, which only merges runs that are already sorted, so k sorted
+    NoteLists one after the other take O(n log k). Any other notes are sorted with np.lexsort
+    :param data: structured array of NOTE_DTYPE
+    :return: indices of the rows
+    """
+    quarter_offsets = data['offset'] * 4
+    quarter_lengths = data['length'] * 4
+    pitches = data['pitch']
+
+    if ((quarter_offsets == np.floor(quarter_offsets)) & (0 <= quarter_offsets) & (quarter_offsets < 2 ** 38) &
+            (quarter_lengths == np.floor(quarter_lengths)) & (0 <= quarter_lengths) & (quarter_lengths < 2 ** 16) &
+            (0 <= pitches) & (pitches < 2 ** 8)).all():
+        key = (quarter_offsets.astype(np.int64) << 24) | ((0xffff - quarter_lengths.astype(np.int64)) << 8) | \
+              (0xff - pitches)
+        return np.argsort(key, kind='stable')
+
+    return np.lexsort((-pitches, -data['length'], data['offset']))
+
+
+class NoteList:
     """
-    a list extension with the upgrades of a predefined sort function and
-    the possibility to create a m21 Stream from it
+    a list of notes, kept as a numpy structured array of NOTE_DTYPE instead of a Note object per note,
+    with the upgrades of a predefined sort function and the possibility to create a m21 Stream from it.
+    Indexing and iterating create Note views of the rows on demand. Slices and copies share the rows
+    (copy on write): they are read-only until one of the NoteLists is changed, which copies its rows first.
+    The columns (offsets, lengths, pitches, volumes, parts) and ends() are arrays for bulk operations,
+    read-only while the rows are shared
     """
 
     def __init__(self, seq=()):
-        super().__init__(seq)
+        self._data = np.zeros(0, dtype=NOTE_DTYPE)
+        self._size = 0
+        self._set_columns()
+
         self._m21_stream = None
+        self._intervals = None
         self.id = float('inf')
 
+        self.extend(seq)
+
+    @classmethod
+    def from_array(cls, data: np.ndarray):
+        """
+        :param data: structured array of NOTE_DTYPE, which is copied
+        :return:
+        """
+        return cls._wrap(np.array(data, dtype=NOTE_DTYPE))
+
+    @classmethod
+    def _wrap(cls, data: np.ndarray):
+        """
+        :param data: structured array of NOTE_DTYPE that isn't used anywhere else, or a read-only one that is shared
+        :return:
+        """
+        notes = cls()
+        notes._data = data
+        notes._size = len(data)
+        notes._set_columns()
+        return notes
+
+    @classmethod
+    def from_columns(cls, offsets, lengths, pitches, volumes, part):
+        """
+        :param offsets:
+        :param lengths:
+        :param pitches:
+        :param volumes:
+        :param part: id of the part of all notes, or an array of them
+        :return:
+        """
+        data = np.zeros(len(offsets), dtype=NOTE_DTYPE)
+        data['offset'] = offsets
+        data['length'] = lengths
+        data['pitch'] = pitches
+        data['volume'] = volumes
+        data['part'] = part
+        return cls.from_array(data)
+
+    @classmethod
+    def concatenate(cls, note_lists: list):
+        """
+        :param note_lists:
+        :return: a new NoteList of the notes of all note_lists, one after the other
+        """
+        return cls._wrap(np.concatenate([np.zeros(0, dtype=NOTE_DTYPE)] + [n.array for n in note_lists]))
+
+    @classmethod
+    def merge(cls, note_lists: list):
+        """
+        like concatenate and sort, but in O(n log k) for k sorted note_lists (see sort_order)
+        :param note_lists:
+        :return: a new sorted NoteList of the notes of all note_lists
+        """
+        data = np.concatenate([np.zeros(0, dtype=NOTE_DTYPE)] + [n.array for n in note_lists])
+        return cls._wrap(data[sort_order(data)])
+
+    def _set_columns(self):
+        # views of the columns of the whole buffer, for the Note views
+        self._offsets = self._data['offset']
+        self._lengths = self._data['length']
+        self._pitches = self._data['pitch']
+        self._volumes = self._data['volume']
+        self._parts = self._data['part']
+
+    def _reserve(self, number: int = 0):
+        """
+        makes room for number more notes, doubling the buffer like a list does.
+        Copies the rows first if they are shared. Every change of the notes goes through here
+        """
+        self._intervals = None
+
+        if self._size + number > len(self._data):
+            data = np.zeros(max(self._size + number, 2 * len(self._data), 16), dtype=NOTE_DTYPE)
+        elif not self._data.flags.writeable:
+            data = np.zeros(len(self._data), dtype=NOTE_DTYPE)
+        else:
+            return
+
+        data[:self._size] = self._data[:self._size]
+        self._data = data
+        self._set_columns()
+
+    def _share(self) -> np.ndarray:
+        """
+        makes the rows read-only, so that they can be shared
+        :return: the rows
+        """
+        if self._data.flags.writeable:
+            self._data = self._data.view()
+            self._data.flags.writeable = False
+            self._set_columns()
+        return self.array
+
+    def copy(self):
+        """
+        :return: a NoteList with the same notes, that shares the rows until one of both is changed
+        """
+        copied = NoteList._wrap(self._share())
+        copied.id = self.id
+        copied._intervals = self._intervals
+        return copied
+
+    def shift(self, offset: float):
+        """
+        adds offset to the offsets of all notes
+        :param offset:
+        :return:
+        """
+        assert (self.offsets + offset >= 0.0).all()
+        self._reserve()
+        self._offsets[:self._size] += offset
+
+    @property
+    def array(self) -> np.ndarray:
+        """
+        :return: the structured array of the notes (a view, changing it changes the notes)
+        """
+        return self._data[:self._size]
+
+    @property
+    def offsets(self) -> np.ndarray:
+        return self._offsets[:self._size]
+
+    @property
+    def lengths(self) -> np.ndarray:
+        return self._lengths[:self._size]
+
+    @property
+    def pitches(self) -> np.ndarray:
+        return self._pitches[:self._size]
+
+    @property
+    def volumes(self) -> np.ndarray:
+        return self._volumes[:self._size]
+
+    @property
+    def parts(self) -> np.ndarray:
+        return self._parts[:self._size]
+
+    def ends(self) -> np.ndarray:
+        """
+        :return: Note.end() of all notes
+        """
+        return self.offsets + self.lengths
+
+    def rests(self) -> np.ndarray:
+        """
+        :return: which notes are rests, i.e. don't have a pitch between 0 and 128
+        """
+        return ~((0 <= self.pitches) & (self.pitches <= 128))
+
+    def without_rests(self):
+        """
+        :return: a new NoteList of the notes that aren't rests
+        """
+        return NoteList._wrap(self.array[~self.rests()])
+
+    def append(self, note):
+        values = note.values
+        self._reserve(1)
+        self._data[self._size] = values
+        self._size += 1
+
+    def extend(self, notes):
+        if isinstance(notes, NoteList):
+            self._reserve(len(notes))
+            self._data[self._size:self._size + len(notes)] = notes.array
+            self._size += len(notes)
+        else:
+            for note in notes:
+                self.append(note)
+
     def sort(self, **kwargs):
-        super().sort(key=attrgetter('pitch'), reverse=True)
-        super().sort(key=attrgetter('length'), reverse=True)
-        return super().sort(key=attrgetter('offset'))
+        """
+        sorts by offset, then the longer and then the higher notes first. Stable, like the list sort
+        """
+        data = self.array
+        self._data = data[sort_order(data)]
+        self._set_columns()
+        self._intervals = None
+
+    def intervals(self) -> 'IntervalIndex':
+        """
+        the IntervalIndex of the notes, made on the first call and kept until the notes are changed
+        (except through the array, which it doesn't notice)
+        :return:
+        """
+        if self._intervals is None:
+            self._intervals = IntervalIndex(self)
+        return self._intervals
+
+    def __len__(self):
+        return self._size
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return NoteList._wrap(self._share()[index])
+
+        if index < 0:
+            index += self._size
+        if not 0 <= index < self._size:
+            raise IndexError("note index out of range")
+        return Note.view(self, index)
+
+    def __setitem__(self, index, note):
+        if index < 0:
+            index += self._size
+        if not 0 <= index < self._size:
+            raise IndexError("note index out of range")
+        values = note.values
+        self._reserve()
+        self._data[index] = values
+
+    def __iter__(self):
+        # like a list, notes appended in the meantime are part of the iteration
+        index = 0
+        while index < self._size:
+            yield Note.view(self, index)
+            index += 1
+
+    def __copy__(self):
+        return self.copy()
+
+    def __deepcopy__(self, memo):
+        return self.copy()
+
+    def __repr__(self):
+        return "NoteList([{n}])".format(n=", ".join(repr(note) for note in self))
 
     @property
     def m21_stream(self):
@@ -34,10 +297,222 @@ class NoteList(list):
         return self._m21_stream
 
 
+class IntervalIndex:
+    """
+    the notes of a NoteList as the intervals [offset, end), for overlap, stabbing and gap queries.
+    The starts are kept sorted, together with the latest end up to every start. For overlap and stabbing queries
+    the notes are grouped by their length, lengths in [2 ** (e - 1), 2 ** e) together, so that a query only looks
+    at the notes of a group that start at most 2 ** e before it: O(log n + k) for the k notes found, as long as a
+    group doesn't have many notes that end shortly before the queried time (which it can't without overlaps).
+    Made once per NoteList by NoteList.intervals(), the results are indices into it
+    """
+
+    def __init__(self, notes: NoteList):
+        offsets = notes.offsets
+        ends = notes.ends()
+
+        if (offsets[1:] >= offsets[:-1]).all():
+            self.order = np.arange(len(offsets))
+        else:
+            self.order = np.argsort(offsets, kind='stable')
+
+        self.starts = offsets[self.order]
+        self.ends = ends[self.order]
+        # the latest end of all notes that start before or with every note
+        self.latest_ends = np.maximum.accumulate(self.ends) if len(self.ends) else self.ends
+
+        self._gaps = None
+        self._groups = None
+
+    def __len__(self):
+        return len(self.starts)
+
+    def has_overlaps(self) -> bool:
+        """
+        :return: if any note starts before another one has ended
+        """
+        return bool((self.starts[1:] < self.latest_ends[:-1]).any())
+
+    def _make_groups(self):
+        self._groups = []
+        lengths = self.ends - self.starts
+        _, exponents = np.frexp(lengths)
+        # zero length notes are a group with a width of 0
+        exponents[lengths <= 0] = np.iinfo(exponents.dtype).min
+
+        for exponent in np.unique(exponents).tolist():
+            members = np.flatnonzero(exponents == exponent)
+            width = 0.0 if exponent == np.iinfo(exponents.dtype).min else 2.0 ** exponent
+            self._groups.append((width, self.starts[members], self.ends[members], self.order[members]))
+
+    def overlapping(self, start: float, end: float) -> np.ndarray:
+        """
+        :param start:
+        :param end:
+        :return: the indices of the notes that sound somewhere in [start, end), i.e. offset < end and
+                 end() > start, ascending
+        """
+        if self._groups is None:
+            self._make_groups()
+
+        found = [np.zeros(0, dtype=np.int64)]
+        for width, starts, ends, indices in self._groups:
+            first = np.searchsorted(starts, start - width, side='right')
+            last = np.searchsorted(starts, end, side='left')
+            found.append(indices[first:last][ends[first:last] > start])
+
+        return np.sort(np.concatenate(found))
+
+    def sounding(self, time: float) -> np.ndarray:
+        """
+        stabbing query
+        :param time:
+        :return: the indices of the notes with offset <= time < end(), ascending
+        """
+        if self._groups is None:
+            self._make_groups()
+
+        found = [np.zeros(0, dtype=np.int64)]
+        for width, starts, ends, indices in self._groups:
+            first = np.searchsorted(starts, time - width, side='right')
+            last = np.searchsorted(starts, time, side='right')
+            found.append(indices[first:last][ends[first:last] > time])
+
+        return np.sort(np.concatenate(found))
+
+    def gaps(self, min_length: float = 0.0) -> (np.ndarray, np.ndarray):
+        """
+        the gaps between notes where nothing sounds, with gap end > gap start + min_length
+        :param min_length:
+        :return: the positions of the notes after the gaps in the order of the starts (the same as the indices
+                 if the NoteList is sorted) and the starts of the gaps, both ascending
+        """
+        if self._gaps is None:
+            after = np.flatnonzero(self.starts[1:] > self.latest_ends[:-1]) + 1
+            lengths = self.starts[after] - self.latest_ends[after - 1]
+            by_length = np.argsort(lengths, kind='stable')
+            self._gaps = lengths[by_length], after[by_length]
+
+        lengths, after = self._gaps
+
+        # the sorted lengths find the candidates, which are then compared like the callers do, end > start + length
+        first = np.searchsorted(lengths, min_length - 1e-9 * max(1.0, abs(min_length)), side='right')
+        candidates = after[first:]
+        candidates = np.sort(candidates[self.starts[candidates] > self.latest_ends[candidates - 1] + min_length])
+
+        return candidates, self.latest_ends[candidates - 1]
+
+
+class PianoRoll:
+    """
+    which of the 128 pitches sound in every time slot of a NoteList, as boolean arrays of shape (slots, 128):
+    active for the sounding notes and onsets for the ones that start in the slot (to tell a held note from a
+    repeated one). A slot is 1 / slots_per_beat beats long. With c.PIANO_ROLL_SLOTS_PER_BEAT = 4 every note
+    starts and ends at a slot border after preprocessing, other notes are rounded to the nearest ones
+    (but take at least one slot). Rests and zero length notes aren't in it.
+    The queries are reductions over the slots, e.g. highest_pitches() is the plain skyline
+    """
+
+    def __init__(self, notes: NoteList, slots_per_beat: int = None):
+        self.slots_per_beat = slots_per_beat or c.PIANO_ROLL_SLOTS_PER_BEAT
+
+        data = notes.array
+        data = data[(0 <= data['pitch']) & (data['pitch'] < 128) & (data['length'] > 0)]
+
+        starts = np.rint(data['offset'] * self.slots_per_beat).astype(np.int64)
+        ends = np.maximum(np.rint((data['offset'] + data['length']) * self.slots_per_beat).astype(np.int64),
+                          starts + 1)
+        pitches = data['pitch']
+        slots = int(ends.max()) if len(data) else 0
+
+        # +1 at the start and -1 at the end of every note, summed up over the slots
+        size = (slots + 1) * 128
+        changes = np.bincount(starts * 128 + pitches, minlength=size) - \
+            np.bincount(ends * 128 + pitches, minlength=size)
+        self.active = np.cumsum(changes.reshape(slots + 1, 128)[:-1], axis=0) > 0
+
+        self.onsets = np.zeros((slots, 128), dtype=bool)
+        self.onsets[starts, pitches] = True
+
+    @classmethod
+    def from_bits(cls, bits: np.ndarray, slots_per_beat: int = None):
+        """
+        :param bits: of to_bits
+        :param slots_per_beat:
+        :return:
+        """
+        roll = cls(NoteList(), slots_per_beat)
+        unpacked = np.unpackbits(bits, axis=1).astype(bool)
+        roll.active = unpacked[:, :128]
+        roll.onsets = unpacked[:, 128:]
+        return roll
+
+    def to_bits(self) -> np.ndarray:
+        """
+        the roll as bitsets, 32 bytes per slot instead of 256
+        :return: uint8 array of shape (slots, 32), active and onsets of every slot
+        """
+        return np.packbits(np.concatenate((self.active, self.onsets), axis=1), axis=1)
+
+    def __len__(self):
+        return len(self.active)
+
+    def slot(self, offset: float) -> int:
+        return int(np.rint(offset * self.slots_per_beat))
+
+    def offset(self, slot: int) -> float:
+        return slot / self.slots_per_beat
+
+    def pitches(self, slot: int) -> np.ndarray:
+        """
+        :param slot:
+        :return: the pitches that sound in the slot, ascending
+        """
+        if not 0 <= slot < len(self):
+            return np.zeros(0, dtype=np.int64)
+        return np.flatnonzero(self.active[slot])
+
+    def polyphony(self) -> np.ndarray:
+        """
+        :return: the number of pitches that sound in every slot
+        """
+        return self.active.sum(axis=1)
+
+    def highest_pitches(self) -> np.ndarray:
+        """
+        :return: the highest pitch that sounds in every slot, -1 in silent slots
+        """
+        return np.where(self.active.any(axis=1), 127 - np.argmax(self.active[:, ::-1], axis=1), -1)
+
+    def lowest_pitches(self) -> np.ndarray:
+        """
+        :return: the lowest pitch that sounds in every slot, -1 in silent slots
+        """
+        return np.where(self.active.any(axis=1), np.argmax(self.active, axis=1), -1)
+
+    def silences(self, min_slots: int = 1) -> (np.ndarray, np.ndarray):
+        """
+        the runs of slots where nothing sounds
+        :param min_slots: shorter runs are left out
+        :return: the first slots and the lengths of the runs, in slots
+        """
+        silent = np.concatenate(([False], ~self.active.any(axis=1), [False]))
+        changes = np.diff(silent.astype(np.int8))
+        starts = np.flatnonzero(changes == 1)
+        lengths = np.flatnonzero(changes == -1) - starts
+
+        long_enough = lengths >= min_slots
+        return starts[long_enough], lengths[long_enough]
+
+    def __repr__(self):
+        return '<PianoRoll {s} slots of 1/{b} beats>'.format(s=len(self), b=self.slots_per_beat)
+
+
 class Part:
     """
     a simple part representation which can be initialised with various values (see type hints)
-    smaller and faster than the m21 Implementation
+    smaller and faster than the m21 Implementation. Instead of a VanillaPartPB, the PartColumns
+    of music_utils.proto_columns can be used
     """
     def __init__(self, id: int, proto_buffer: music_info.VanillaPartPB = None,
                  info: music_info.PieceOfMusic.Part = None,
@@ -58,11 +533,8 @@ class Part:
             self.note_percentage = info.note_percentage
             self.lyrics_percentage = info.lyrics_percentage
 
-            for offset, length, pitch, volume in zip(proto_buffer.offsets,
-                                                     proto_buffer.lengths,
-                                                     proto_buffer.pitches,
-                                                     proto_buffer.volumes):
-                self._notes.append(Note(offset, length, pitch, volume, self.id))
+            self._notes = NoteList.from_columns(proto_buffer.offsets, proto_buffer.lengths, proto_buffer.pitches,
+                                                proto_buffer.volumes, self.id)
 
         elif note_list is not None:
             self.name = name
@@ -75,7 +547,7 @@ class Part:
             self.note_percentage = None
             self.lyrics_percentage = None
 
-            self._notes = deepcopy(note_list)
+            self._notes = note_list.copy()
 
 
         else:
@@ -83,13 +555,23 @@ class Part:
                              "notelists and optionally a name")
 
         self._m21_part = None
+        self._piano_roll = None
 
         self._notes.sort()
 
     def notes(self, exclude_rests=False):
         if exclude_rests:
-            return [note for note in self._notes if 0 <= note.pitch <= 128]
-        return deepcopy(self._notes)
+            return self._notes.without_rests()
+        return self._notes.copy()
+
+    def piano_roll(self) -> PianoRoll:
+        """
+        the PianoRoll of the notes of the part with c.PIANO_ROLL_SLOTS_PER_BEAT, made on the first call
+        :return:
+        """
+        if self._piano_roll is None:
+            self._piano_roll = PianoRoll(self._notes)
+        return self._piano_roll
 
     @property
     def m21_part(self):
@@ -110,61 +592,98 @@ class Part:
                      "\n\t\tKey-Correlation: {key_corr}\n\t\tNumber of notes: {note_nr}\n\t\t" \
                      "Number of rests: {rest_nr}\n".format(name=self.name, avg_p=self.average_pitch,
                                                            avg_v=self.average_volume, key_corr=self.key_correlation,
-                                                           note_nr=len(
-                                                               [1 for note in self._notes if 0 <= note[2] <= 128]),
-                                                           rest_nr=len([0 for note in self._notes if note[2] == 200]))
+                                                           note_nr=int((~self._notes.rests()).sum()),
+                                                           rest_nr=int((self._notes.pitches == 200).sum()))
         return str_result
 
 
 class Note:
-    # works like a list, and has 5 entries that can be called by properties
+    """
+    works like a list, and has 5 entries that can be called by properties.
+    A view of a row of a NoteList, changing it changes the NoteList (and only this one, if the rows are shared).
+    A new Note has a NoteList of its own
+    """
+    __slots__ = ('_notes', '_index', '_m21_note')
+
     def __init__(self, offset, length, pitch: 200, volume: 0, part: 2 ** 32):
-        self._values = [offset, length, pitch, volume, part]
+        self._notes = NoteList()
+        self._notes._reserve(1)
+        self._notes._data[0] = (offset, length, pitch, volume, part)
+        self._notes._size = 1
+        self._index = 0
         self._m21_note = None
 
+    @classmethod
+    def view(cls, notes: NoteList, index: int):
+        """
+        :param notes:
+        :param index: of the row in notes
+        :return:
+        """
+        note = cls.__new__(cls)
+        note._notes = notes
+        note._index = index
+        note._m21_note = None
+        return note
+
+    @property
+    def values(self) -> tuple:
+        return self._notes._data[self._index].item()
+
+    def __getitem__(self, index):
+        return self.values[index]
+
+    def __repr__(self):
+        return "Note(offset={0}, length={1}, pitch={2}, volume={3}, part={4})".format(*self.values)
+
     @property
     def offset(self):
-        return self._values[0]
+        return self._notes._offsets.item(self._index)
 
     @offset.setter
     def offset(self, value):
         assert value >= 0.0
-        self._values[0] = value
+        self._notes._reserve()
+        self._notes._offsets[self._index] = value
 
     @property
     def length(self):
-        return self._values[1]
+        return self._notes._lengths.item(self._index)
 
     @length.setter
     def length(self, value):
         assert value > 0.0
-        self._values[1] = value
+        self._notes._reserve()
+        self._notes._lengths[self._index] = value
 
     @property
     def pitch(self):
-        return self._values[2]
+        return self._notes._pitches.item(self._index)
 
     @pitch.setter
     def pitch(self, value):
         assert value >= 0
-        self._values[2] = value
+        self._notes._reserve()
+        self._notes._pitches[self._index] = value
 
     @property
     def volume(self):
-        return self._values[3]
+        return self._notes._volumes.item(self._index)
 
     @volume.setter
     def volume(self, value):
         assert value >= 0
-        self._values[3] = value
+        self._notes._reserve()
+        self._notes._volumes[self._index] = value
 
     @property
     def part(self):
-        return self._values[4]
+        return self._notes._parts.item(self._index)
 
     @part.setter
     def part(self, value):
-        self._values[4] = value
+        self._notes._reserve()
+        self._notes._parts[self._index] = value
 
     def end(self):
         return self.offset + self.length
@@ -186,7 +705,8 @@ class Note:
 class Song:
     """
     a simple Song representation which can be initialised with various values (see type hints)
-    smaller and faster than the m21 (Stream) Implementation
+    smaller and faster than the m21 (Stream) Implementation. Instead of a VanillaStreamPB,
+    the much faster to read VanillaStreamColumns of music_utils.proto_columns can be used
     """
     def __init__(self, proto_buffer: music_info.VanillaStreamPB = None, list_of_parts_or_note_lists: list = None,
                  name: str = ""):
@@ -195,6 +715,7 @@ class Song:
         self._notes = NoteList()
 
         self._m21_stream = None
+        self._piano_roll = None
 
         if proto_buffer is not None:
             self.name = proto_buffer.filepath
@@ -202,6 +723,7 @@ class Song:
             self.key = proto_buffer.info.key
             self.key_correlation = proto_buffer.info.key_correlation
 
+            part_notes = []
             for i, part in enumerate(proto_buffer.parts):
 
                 found = False
@@ -211,7 +733,7 @@ class Song:
                     if part.name == p.name:
                         new_part = Part(id=i, proto_buffer=part, info=p)
                         self.parts.append(new_part)
-                        self._notes.extend(new_part.notes(exclude_rests=True))
+                        part_notes.append(new_part.notes(exclude_rests=True))
                         found = True
                         break
 
@@ -221,13 +743,15 @@ class Song:
                         if part.name.startswith(p.name):
                             new_part = Part(id=i, proto_buffer=part, info=p)
                             self.parts.append(new_part)
-                            self._notes.extend(new_part.notes(exclude_rests=True))
+                            part_notes.append(new_part.notes(exclude_rests=True))
                             found = True
                             break
 
                 assert found, "Part {p} wasn't found in info file\n{info}".format(p=part.name,
                                                                                   info=proto_buffer.info)
 
+            self._notes = NoteList.merge(part_notes)
+
         elif list_of_parts_or_note_lists is not None:
 
             self.name = name
@@ -245,12 +769,21 @@ class Song:
                 else:
                     raise ValueError("Type must be Part or NoteList, your type was {t}".format(t=type(elem)))
 
-        self._notes.sort()
+            self._notes.sort()
 
     def notes(self, exclude_rests=False):
         if exclude_rests:
-            return [note for note in self._notes if 0 <= note[2] <= 128]
-        return deepcopy(self._notes)
+            return self._notes.without_rests()
+        return self._notes.copy()
+
+    def piano_roll(self) -> PianoRoll:
+        """
+        the PianoRoll of the notes of all parts with c.PIANO_ROLL_SLOTS_PER_BEAT, made on the first call
+        :return:
+        """
+        if self._piano_roll is None:
+            self._piano_roll = PianoRoll(self._notes)
+        return self._piano_roll
 
     def m21_stream(self):
         if not self._m21_stream:
@@ -275,9 +808,7 @@ if __name__ == '__main__':
     proto_buffer_path = os.path.join(c.MXL_DATA_FOLDER, "L/M/Y/TRLMYOF128F931D661/34b1b5457161a6a2509b386147e16177.pb")
 
     with open(proto_buffer_path, 'rb') as fp:
-        proto_buffer = music_info.VanillaStreamPB()
-        proto_buffer.ParseFromString(fp.read())
-        assert proto_buffer.HasField('info')
+        proto_buffer = read_vanilla_stream(fp.read())
 
     simple_song = Song(proto_buffer)
 
@@ -1,25 +1,46 @@
-from statistics import mean
+from array import array
+from fractions import Fraction
+from statistics import StatisticsError
 
 import music21 as m21
+import numpy as np
 
-from preprocessing.helper import round_to_quarter
+import settings.music_info_pb2 as music_info
+from music_utils.key_finder import find_key
+from preprocessing.helper import round_to_quarter, round_to_quarter_array
 
+REST_PITCH = 200
 
-class VanillaPart(m21.stream.Part):
+# the columns of the notes, with the type codes of their buffers
+COLUMNS = (('offsets', 'd'), ('lengths', 'd'), ('pitches', 'd'), ('volumes', 'h'), ('lyrics', 'b'))
+
+
+class VanillaPart:
     """
-    works like a m21.stream.Part, but has some extra information and methods that might be needed/are needed
-    for analysis of musical pieces.
+    the notes of one part with some extra information and methods that might be needed/are needed
+    for analysis of musical pieces. Unlike a m21.stream.Part, the notes are only kept as columns
+    (offsets, lengths, pitch space values, velocities and if they have lyrics) in compact buffers, no music21 objects
+    are made for them. Rests aren't stored at all, they are the gaps between the notes.
+    Averages and percentages are kept as running sums while inserting
     """
 
-    def __init__(self):
-        m21.stream.Part.__init__(self)
-        self._pitch_list = []
-        self._volume_list = []
+    def __init__(self, part_name: str = None):
+        self.partName = part_name
+
+        self._offsets = array('d')
+        self._lengths = array('d')
+        self._pitches = array('d')
+        self._volumes = array('h')
+        self._lyrics = array('b')
+        self._sorted = True
+
+        self._pitch_sum = 0.0
+        self._volume_sum = 0.0
         self._note_number = 0
         self._total_notes_or_chords = 0
         self._total_pitches = 0
         self._lyrics_number = 0
-        self._note_lengths = []
+
         self._key = None
         self._key_correlation = None
         self._changed = False
@@ -43,57 +64,285 @@ class VanillaPart(m21.stream.Part):
         end = start + elem.quarterLength
         if new_duration:
             end = start + new_duration
-        temp_volume = elem.volume.velocity
-        temp_lyrics = elem.lyrics
-        temp_pitch = elem.pitch.ps
 
-        temp_note = self.create_note(start, end, temp_volume, temp_lyrics, temp_pitch)
-
-        if not temp_note:
-            return
-
-        self._pitch_list.append(temp_pitch)
-        self._volume_list.append(temp_volume)
-        self._note_number += 1
-        self._total_notes_or_chords += 1
-        self._total_pitches += 1
-        try:
-            self._note_lengths.append(elem.seconds)
-        except m21.exceptions21.Music21Exception:
-            pass
-
-        if temp_lyrics:
-            self._lyrics_number += 1
-
-        super().insert(temp_note)
+        self.insert_pitches(start, end, elem.volume.velocity, bool(elem.lyrics), [elem.pitch.ps])
 
     def insert_chord(self, elem: m21.chord.Chord, new_duration: float):
         start = elem.offset
         end = start + elem.quarterLength
         if new_duration:
             end = start + new_duration
-        temp_volume = elem.volume.velocity
-        temp_lyrics = elem.lyrics
 
-        for temp_full_pitch in elem.pitches:
-
-            temp_pitch = temp_full_pitch.ps
+        self.insert_pitches(start, end, elem.volume.velocity, bool(elem.lyrics), [p.ps for p in elem.pitches],
+                            chord=True)
+
+    def insert_pitches(self, start, end, temp_volume, temp_lyrics: bool, temp_pitches: list, chord: bool = False):
+        """
+        inserts a note or a chord, given by its values instead of a music21 object
+        :param start: offset in quarters
+        :param end: offset of the end in quarters
+        :param temp_volume: the velocity
+        :param temp_lyrics: if it has lyrics
+        :param temp_pitches: the pitch space values
+        :param chord: if it is a chord, even with a single pitch
+        :return:
+        """
+        self._changed = True
 
-            temp_note = self.create_note(start, end, temp_volume, temp_lyrics, temp_pitch)
+        for temp_pitch in temp_pitches:
 
-            if not temp_note:
+            if not self.add_note(start, end, temp_volume, temp_lyrics, temp_pitch):
                 return
 
-            self._pitch_list.append(temp_pitch)
+            self._pitch_sum += temp_pitch
             self._total_pitches += 1
-            super().insert(temp_note)
 
-        self._volume_list.append(temp_volume)
+        self._volume_sum += temp_volume
         self._total_notes_or_chords += 1
+        if not chord:
+            self._note_number += 1
 
         if temp_lyrics:
             self._lyrics_number += 1
 
+    def insert_events(self, starts: list, ends: list, volumes: list, lyrics: list, pitches: list, sizes: list,
+                      chords: list):
+        """
+        insert_pitches for many notes and chords at once, using create_notes instead of create_note
+        :param starts: offset of every note or chord in quarters
+        :param ends: offset of the end of every note or chord
+        :param volumes: velocity of every note or chord, None if it has none
+        :param lyrics: if each one has lyrics
+        :param pitches: the pitch space values of all notes and chords one after the other
+        :param sizes: the number of pitches of each one
+        :param chords: if each one is a chord
+        :return:
+        """
+        if not sizes:
+            return
+        self._changed = True
+
+        sizes = np.asarray(sizes, dtype=np.int64)
+        firsts = np.cumsum(sizes) - sizes
+        events = np.repeat(np.arange(len(sizes)), sizes)
+        event_list = events.tolist()
+
+        keep, offsets, lengths, pitches, _ = self.create_notes([starts[i] for i in event_list],
+                                                               [ends[i] for i in event_list], pitches)
+
+        # like in insert_pitches, a chord stops at its first dropped note and only counts if none was dropped
+        dropped = np.concatenate(([0], np.cumsum(~keep)))
+        added = (dropped[1:] - dropped[firsts[events]] == 0)[keep]
+        complete = dropped[firsts + sizes] == dropped[firsts]
+
+        volumes = np.array([np.nan if v is None else v for v in volumes], dtype=np.float64)
+        lyrics = np.asarray(lyrics, dtype=bool)
+        kept_events = events[keep][added]
+        if np.isnan(volumes[kept_events]).any():
+            raise m21.volume.VolumeException("value provided for velocity must be a number, not None")
+
+        offsets = offsets[added]
+        if len(offsets) and (np.diff(np.concatenate((self._offsets[-1:], offsets))) < 0).any():
+            self._sorted = False
+
+        self._offsets.frombytes(offsets.tobytes())
+        self._lengths.frombytes(lengths[added].tobytes())
+        self._pitches.frombytes(pitches[added].tobytes())
+        self._volumes.frombytes(volumes[kept_events].astype(np.int16).tobytes())
+        self._lyrics.frombytes(lyrics[kept_events].astype(np.int8).tobytes())
+
+        # summed one after the other, like insert_pitches does
+        self._pitch_sum = sum(pitches[added].tolist(), self._pitch_sum)
+        self._total_pitches += len(offsets)
+        self._volume_sum = sum(volumes[complete].astype(np.int64).tolist(), self._volume_sum)
+        self._total_notes_or_chords += int(complete.sum())
+        self._note_number += int((complete & ~np.asarray(chords, dtype=bool)).sum())
+        self._lyrics_number += int((complete & lyrics).sum())
+
+    def add_note(self, start, end, temp_volume, temp_lyrics: bool, temp_pitch: float) -> bool:
+        """
+        appends a note to the columns, if create_note keeps it
+        :return: if the note was added
+        """
+        span = self.create_note(start, end, temp_pitch)
+        if span is None:
+            return False
+
+        if temp_volume is None:
+            raise m21.volume.VolumeException("value provided for velocity must be a number, not None")
+
+        offset, length = span
+        if self._offsets and offset < self._offsets[-1]:
+            self._sorted = False
+
+        self._offsets.append(offset)
+        self._lengths.append(length)
+        self._pitches.append(temp_pitch)
+        self._volumes.append(int(temp_volume))
+        self._lyrics.append(temp_lyrics)
+        return True
+
+    def _sort(self):
+        """
+        orders the notes by their offset. Notes with the same offset keep the order they were inserted in,
+        like in a m21.stream.Part
+        :return:
+        """
+        if self._sorted:
+            return
+
+        order = np.argsort(np.frombuffer(self._offsets, dtype=np.float64), kind='stable')
+        for column, type_code in COLUMNS:
+            values = np.asarray(getattr(self, '_' + column))[order]
+            setattr(self, '_' + column, array(type_code, values.tobytes()))
+
+        self._sorted = True
+
+    def note_columns(self) -> dict:
+        """
+        :return: copies of the columns of the notes as numpy arrays, ordered by offset
+        """
+        self._sort()
+        return {column: np.array(getattr(self, '_' + column)) for column, _ in COLUMNS}
+
+    def rests(self) -> (np.ndarray, np.ndarray, np.ndarray):
+        """
+        the rests makeRests(fillGaps=True) would insert: one in every gap between the end of all earlier notes
+        and the next note, also before the first note
+        :return: the offsets and lengths of the rests, and the index of the note each one comes before
+        """
+        self._sort()
+        offsets = np.frombuffer(self._offsets, dtype=np.float64)
+        if not len(offsets):
+            return np.zeros(0), np.zeros(0), np.zeros(0, dtype=np.int64)
+
+        # the end of all notes before each note, starting at 0
+        ends = offsets + np.frombuffer(self._lengths, dtype=np.float64)
+        highest_ends = np.maximum.accumulate(np.concatenate(([0.0], ends[:-1])))
+
+        gaps = np.flatnonzero(offsets > highest_ends)
+        return highest_ends[gaps], offsets[gaps] - highest_ends[gaps], gaps
+
+    def columns_with_rests(self) -> (np.ndarray, np.ndarray, np.ndarray, np.ndarray):
+        """
+        :return: offsets, lengths, pitches and volumes of the notes and the rests between them, like the notes
+                 and rests of a m21.stream.Part after makeRests. Rests have the pitch 200 and the volume 0,
+                 pitches are cut to integers
+        """
+        self._sort()
+        rest_offsets, rest_lengths, positions = self.rests()
+
+        offsets = np.insert(np.frombuffer(self._offsets, dtype=np.float64), positions, rest_offsets)
+        lengths = np.insert(np.frombuffer(self._lengths, dtype=np.float64), positions, rest_lengths)
+        pitches = np.insert(np.trunc(np.frombuffer(self._pitches, dtype=np.float64)).astype(np.int64),
+                            positions, REST_PITCH)
+        volumes = np.insert(np.asarray(self._volumes, dtype=np.int64), positions, 0)
+
+        return offsets, lengths, pitches, volumes
+
+    def to_proto_buffer(self, proto_part: music_info.VanillaPartPB = None) -> music_info.VanillaPartPB:
+        """
+        writes the notes and rests of this part into a VanillaPartPB
+        :param proto_part: the message to fill, e.g. a new entry of VanillaStreamPB.parts. A new one if None
+        :return: the message
+        """
+        if proto_part is None:
+            proto_part = music_info.VanillaPartPB()
+
+        proto_part.name = self.partName
+        offsets, lengths, pitches, volumes = self.columns_with_rests()
+
+        proto_part.offsets.extend(offsets.tolist())
+        proto_part.lengths.extend(lengths.tolist())
+        proto_part.pitches.extend(pitches.tolist())
+        proto_part.volumes.extend(volumes.tolist())
+
+        return proto_part
+
+    def to_m21(self) -> m21.stream.Part:
+        """
+        makes a music21 part of the notes and rests, e.g. to show it or to compare it with music21
+        :return:
+        """
+        part = m21.stream.Part()
+        part.partName = self.partName
+
+        for offset, length, pitch, volume in zip(*self.columns_with_rests()):
+            if pitch == REST_PITCH:
+                n = m21.note.Rest()
+            else:
+                n = m21.note.Note()
+                n.pitch.ps = pitch
+                n.volume.velocity = volume
+            n.quarterLength = length
+            part.insert(offset, n)
+
+        return part
+
+    def note_arrays(self) -> dict:
+        """
+        the notes of this part and the counters insert_local keeps, e.g. to cache them.
+        Rests are left out, they are made again from the gaps
+        :return:
+        """
+        arrays = self.note_columns()
+        arrays.update({
+            'pitch_sum': self._pitch_sum,
+            'volume_sum': self._volume_sum,
+            'note_number': self._note_number,
+            'total_notes_or_chords': self._total_notes_or_chords,
+            'total_pitches': self._total_pitches,
+            'lyrics_number': self._lyrics_number
+        })
+        return arrays
+
+    @classmethod
+    def from_note_arrays(cls, part_name, arrays: dict):
+        """
+        makes a new part from the result of note_arrays
+        :param part_name:
+        :param arrays:
+        :return:
+        """
+        part = cls(part_name)
+
+        for column, type_code in COLUMNS:
+            setattr(part, '_' + column, array(type_code, np.asarray(arrays[column]).astype(type_code).tobytes()))
+        part._sorted = False
+        part._sort()
+
+        part._pitch_sum = arrays['pitch_sum']
+        part._volume_sum = arrays['volume_sum']
+        part._note_number = arrays['note_number']
+        part._total_notes_or_chords = arrays['total_notes_or_chords']
+        part._total_pitches = arrays['total_pitches']
+        part._lyrics_number = arrays['lyrics_number']
+        part._changed = True
+
+        return part
+
+    def transpose_pitches(self, semitones: int):
+        """
+        transposes all notes by a number of semitones, as one addition to the pitch column
+        :param semitones:
+        :return:
+        """
+        pitches = np.frombuffer(self._pitches, dtype=np.float64) + semitones
+        self._pitches = array('d', pitches.tobytes())
+        self._changed = True
+
+    def pitch_class_histogram(self) -> np.ndarray:
+        """
+        :return: the pitch classes of this part weighted by their quarter lengths (see key_finder),
+                 None if there are no notes
+        """
+        if not len(self._pitches):
+            return None
+
+        # the pitch class of music21 rounds the pitch space value half to even, like numpy
+        pitch_classes = np.round(np.frombuffer(self._pitches, dtype=np.float64)).astype(np.int64) % 12
+        return np.bincount(pitch_classes, weights=np.frombuffer(self._lengths, dtype=np.float64), minlength=12)
+
     @property
     def key(self):
         if (not self._key) or self._changed:
@@ -101,7 +350,7 @@ class VanillaPart(m21.stream.Part):
 
         return self._key.name
 
-    def key_by_name(self, key_name: str) -> m21.key.Key:
+    def key_by_name(self, key_name: str):
 
         if self.key == key_name:
             return self._key
@@ -165,14 +414,21 @@ class VanillaPart(m21.stream.Part):
             self._note_percentage = 0.0
             self._lyrics_percentage = 0.0
 
-        self._average_pitch = mean(self._pitch_list)
-        self._average_volume = mean(self._volume_list)
-        self._key = self.analyze('key')
+        if not self._total_pitches or not self._total_notes_or_chords:
+            raise StatisticsError('mean requires at least one data point')
+
+        # the sums of pitch space values and velocities are exact, so these are the same as statistics.mean
+        self._average_pitch = self._pitch_sum / self._total_pitches
+        self._average_volume = self._volume_sum / self._total_notes_or_chords
+        self._key = find_key(self.pitch_class_histogram())
 
         self._changed = False
 
     @staticmethod
-    def create_note(start, end, temp_volume: int, temp_lyrics, temp_pitch):
+    def create_note(start, end, temp_pitch):
+        """
+        :return: the quarter rounded offset and length of a note, None if it is too short
+        """
         if end - start < 0.2:
             return None
 
@@ -183,20 +439,57 @@ class VanillaPart(m21.stream.Part):
         if end - start > 4:
             end = start + 4
 
-        temp_note = m21.note.Note()
-
-        temp_note.offset = round_to_quarter(start)
+        offset = round_to_quarter(start)
         new_end = round_to_quarter(end)
-        new_duration = new_end - temp_note.offset
+        new_duration = new_end - offset
         if new_duration < 0.25:
             return None
 
-        temp_note.quarterLength = new_duration
+        return offset, new_duration
 
-        temp_note.volume.velocity = temp_volume
-        if temp_lyrics:
-            temp_note.lyrics = temp_lyrics
+    @staticmethod
+    def create_notes(starts, ends, pitches, volumes=None) -> (np.ndarray, np.ndarray, np.ndarray, np.ndarray,
+                                                              np.ndarray):
+        """
+        create_note for whole arrays of notes at once. Floats give exactly the same results as create_note.
+        Fractions (e.g. offsets in tuplets) aren't compared exactly anymore once they are floats,
+        so the notes with a Fraction go through create_note
+        :param starts: offsets in quarters
+        :param ends: offsets of the ends in quarters
+        :param pitches: pitch space values
+        :param volumes: optionally the velocities
+        :return: which notes are kept, then the offsets, lengths, pitches and volumes (None if not given)
+                 of only the kept notes
+        """
+        exact = []
+        if not isinstance(starts, np.ndarray) or not isinstance(ends, np.ndarray):
+            exact = [(i, start, end) for i, (start, end) in enumerate(zip(starts, ends))
+                     if type(start) == Fraction or type(end) == Fraction]
+
+        starts = np.asarray(starts, dtype=np.float64)
+        ends = np.asarray(ends, dtype=np.float64)
+        pitches = np.asarray(pitches, dtype=np.float64)
+
+        lengths = ends - starts
+        keep = ~(lengths < 0.2)
+
+        # the same comparison as in create_note
+        keep &= ~((0 > pitches) & (pitches > 128))
+
+        # maximum note length is 4
+        ends = np.where(lengths > 4, starts + 4, ends)
+
+        offsets = round_to_quarter_array(starts)
+        new_durations = round_to_quarter_array(ends) - offsets
+        keep &= ~(new_durations < 0.25)
+
+        for i, start, end in exact:
+            span = VanillaPart.create_note(start, end, pitches[i])
+            keep[i] = span is not None
+            if span is not None:
+                offsets[i], new_durations[i] = span
 
-        temp_note.pitch.ps = temp_pitch
+        if volumes is not None:
+            volumes = np.asarray(volumes)[keep]
 
-        return temp_note
+        return keep, offsets[keep], new_durations[keep], pitches[keep], volumes
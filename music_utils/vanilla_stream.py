@@ -4,13 +4,15 @@ import music21 as m21
 class VanillaStream(m21.stream.Score):
     """
     works like a m21.stream.Score, but has some extra methods that might be needed/are needed
-    for analysis of musical pieces.
+    for analysis of musical pieces. The VanillaParts are no music21 objects, so they are kept next to
+    the score elements (time signatures and metronome marks) and parts returns them instead of m21 parts.
     """
 
     def __init__(self, filename=None):
         m21.stream.Stream.__init__(self)
         if filename:
             self.id = filename
+        self._vanilla_parts = []
         self.time_signature = None
         self.min_metronome = None
         self.max_metronome = None
@@ -43,3 +45,33 @@ class VanillaStream(m21.stream.Score):
                 self.max_metronome = elem.number
             elif elem.number < self.max_metronome:
                 self.min_metronome = elem.number
+
+    @property
+    def parts(self) -> list:
+        """
+        :return: the VanillaParts, in the order they were inserted
+        """
+        return list(self._vanilla_parts)
+
+    def insert_part(self, part):
+        """
+        :param part: a VanillaPart
+        :return:
+        """
+        self._vanilla_parts.append(part)
+
+    def remove_part(self, part):
+        """
+        :param part: a VanillaPart of this stream
+        :return:
+        """
+        self._vanilla_parts.remove(part)
+
+    def transpose_pitches(self, semitones: int):
+        """
+        transposes all parts by a number of semitones, see VanillaPart.transpose_pitches
+        :param semitones:
+        :return:
+        """
+        for p in self.parts:
+            p.transpose_pitches(semitones)
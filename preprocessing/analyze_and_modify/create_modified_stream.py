@@ -1,10 +1,17 @@
+import xml.etree.ElementTree as ElementTree
+import zipfile
 from copy import deepcopy
 
 import music21 as m21
+import numpy as np
 
 import settings.constants as c
+from music_utils.key_finder import find_key, find_keys, sum_histograms
 from music_utils.vanilla_part import VanillaPart
 from music_utils.vanilla_stream import VanillaStream
+from preprocessing.analyze_and_modify.musicxml_arrays import read_parts
+from preprocessing.analyze_and_modify.prefilter import prefilter, read_header
+from preprocessing.context import context
 from preprocessing.helper import FileNotFittingSettingsError
 from preprocessing.helper import round_to_quarter
 
@@ -24,6 +31,30 @@ def make_file_container(m21_file: m21.stream.Score, m21_stream: VanillaStream):
         m21_stream.insert_local(elem)
 
 
+def make_file_container_from_header(m21_stream: VanillaStream) -> bool:
+    """
+    does the same as make_file_container, but with the time signatures and metronome marks read by read_header
+    instead of a music21 Score
+    :param m21_stream: the VanillaStream built from the original file
+    :return: False if the header couldn't be interpreted, then nothing was put into the VanillaStream
+    """
+    try:
+        time_signatures, metronome_numbers, unclear = read_header(m21_stream.id)
+    except (zipfile.BadZipFile, ElementTree.ParseError, IndexError, KeyError, OSError):
+        return False
+
+    if unclear:
+        return False
+
+    for time_signature in time_signatures:
+        m21_stream.insert_time_signature(m21.meter.TimeSignature(time_signature))
+
+    for number in metronome_numbers:
+        m21_stream.insert_metronome_mark(m21.tempo.MetronomeMark(number=number))
+
+    return True
+
+
 def process_file(m21_file: m21.stream.Score, m21_stream: VanillaStream):
 
     part_name_list = []
@@ -59,14 +90,11 @@ def process_file(m21_file: m21.stream.Score, m21_stream: VanillaStream):
             part_name_list.append(part.partName)
             temp_part.partName = part.partName
 
-        # insert all elements into the part.
+        # insert all elements into the part. Rests are the gaps between them
         for elem in part.flat.getElementsByClass(('Note', 'Chord')):
             insert_elem_to_part(elem, temp_part)
 
-        # make rests in places where there are no notes
-        temp_part.makeRests(fillGaps=True, inPlace=True)
-
-        m21_stream.insert(temp_part)
+        m21_stream.insert_part(temp_part)
 
 
 def insert_elem_to_part(elem: m21.chord.Chord, temp_part: VanillaPart):
@@ -91,28 +119,33 @@ def pitch_set(elem: m21.note.GeneralNote) -> set:
     return return_set
 
 
-def transpose_key(mxl_file: m21.stream.Score) -> bool:
+def transpose_key(mxl_file: VanillaStream, histogram: np.ndarray = None) -> int:
     """
     transpose the key to C major or A minor by applying the Krumhansl-Schmuckler-algorithm
-    already implemented in music21
+    (see music_utils.key_finder). Only the pitches are moved, they aren't spelled in the new key
     :param mxl_file:
-    :return:
+    :param histogram: the pitch class histogram of the file, if it is already known
+    :return: the number of semitones the file was transposed by, None if its key is neither major nor minor
     """
+    if histogram is None:
+        histogram = sum_histograms([p.pitch_class_histogram() for p in mxl_file.parts])
+
     try:
-        key = mxl_file.analyze('key')
+        key = find_key(histogram)
     except m21.analysis.discrete.DiscreteAnalysisException:
         raise FileNotFittingSettingsError("INVALID_KEY")
 
     if key.mode != 'major' and key.mode != 'minor':
-        return False
+        return None
 
+    # the same as the interval from the tonic to C4 or A4, like music21 would transpose
     if key.type == "major":
-        interval_ = m21.interval.Interval(key.tonic, m21.pitch.Pitch('C'))
-        mxl_file.transpose(interval_, inPlace=True)
+        semitones = 0 - key.tonic_pitch_class
     else:
-        interval_ = m21.interval.Interval(key.tonic, m21.pitch.Pitch('A'))
-        mxl_file.transpose(interval_, inPlace=True)
-    return True
+        semitones = 9 - key.tonic_pitch_class
+
+    mxl_file.transpose_pitches(semitones)
+    return semitones
 
 
 def check_valid_time(m21_stream: VanillaStream):
@@ -159,7 +192,18 @@ def process_data(thread_id, m21_stream):
     """
 
     # print("%s processing %s" % (thread_id, m21_stream.id))
-    m21_file = m21.converter.parse(m21_stream.id)
+    if c.PREFILTER:
+        with context.metrics.time('prefilter'):
+            prefilter(m21_stream)
+
+    if c.INGESTION_ENGINE == 'arrays' and make_file_container_from_header(m21_stream):
+        return process_data_with_arrays(m21_stream)
+
+    if c.PARSE_CACHE:
+        return process_data_with_cache(m21_stream)
+
+    with context.metrics.time('parse'):
+        m21_file = m21.converter.parse(m21_stream.id)
 
     make_file_container(m21_file=m21_file, m21_stream=m21_stream)
 
@@ -167,7 +211,73 @@ def process_data(thread_id, m21_stream):
 
     check_valid_bpm(m21_stream)
 
-    process_file(m21_file, m21_stream)
+    with context.metrics.time('process_file'):
+        process_file(m21_file, m21_stream)
+
+    return m21_stream
+
+
+def process_data_with_arrays(m21_stream: VanillaStream):
+    """
+    does the same as process_data after make_file_container_from_header, but reads the parts with
+    musicxml_arrays.read_parts instead of parsing the file with music21
+    :param m21_stream: a VanillaStream with its time signatures and metronome marks
+    :return:
+    """
+    check_valid_time(m21_stream)
+
+    check_valid_bpm(m21_stream)
+
+    with context.metrics.time('read_parts'):
+        for part in read_parts(m21_stream.id):
+            m21_stream.insert_part(part)
+
+    return m21_stream
+
+
+def process_data_with_cache(m21_stream: VanillaStream):
+    """
+    does the same as process_data, but takes the parsed parts from the parse cache if the file was parsed before.
+    Otherwise the file is parsed and processed like in process_data and only stored in the cache
+    if it passed the checks of the settings
+    :param m21_stream:
+    :return:
+    """
+    parse_cache = context.parse_cache
+    with context.metrics.time('parse_cache_load'):
+        key = parse_cache.key(m21_stream.id)
+        cached_score = parse_cache.load(key)
+
+    if cached_score is not None:
+        context.metrics.count('parse_cache_hits')
+
+        cached_score.restore_file_container(m21_stream)
+
+        check_valid_time(m21_stream)
+
+        check_valid_bpm(m21_stream)
+
+        with context.metrics.time('parse_cache_restore'):
+            cached_score.restore_parts(m21_stream)
+
+        return m21_stream
+
+    context.metrics.count('parse_cache_misses')
+
+    with context.metrics.time('parse'):
+        m21_file = m21.converter.parse(m21_stream.id)
+
+    make_file_container(m21_file=m21_file, m21_stream=m21_stream)
+
+    check_valid_time(m21_stream)
+
+    check_valid_bpm(m21_stream)
+
+    with context.metrics.time('process_file'):
+        process_file(m21_file, m21_stream)
+
+    with context.metrics.time('parse_cache_store'):
+        parse_cache.store(key, m21_stream)
 
     return m21_stream
 
@@ -177,25 +287,38 @@ def make_key_and_correlations(m21_stream: VanillaStream):
     make all the preprocessing from a fully specified VanillaStream to a Stream where
     either a error is raised if the key doesn't fit the settings or
     all the insignificant parts are deleted and only the ones with the best
-    correlation coefficient are kept
+    correlation coefficient are kept.
+    The pitch class histograms of the parts are only made once, the keys of the stream are found with their sums
     :param m21_stream:
     :return:
     """
-    if not transpose_key(m21_stream):
+    parts = list(m21_stream.parts)
+
+    # None for parts without notes
+    histograms = [p.pitch_class_histogram() for p in parts]
+
+    with context.metrics.time('transpose'):
+        semitones = transpose_key(m21_stream, sum_histograms(histograms))
+
+    if semitones is None:
         raise FileNotFittingSettingsError("INVALID_KEY")
 
+    # the pitch classes move by the same number of semitones, so the histograms are just rotated
+    histograms = [np.roll(h, semitones) if h is not None else None for h in histograms]
+
     try:
-        stream_key = m21_stream.analyze('key')
+        stream_key = find_key(sum_histograms(histograms))
     except m21.analysis.discrete.DiscreteAnalysisException:
         raise FileNotFittingSettingsError("INVALID_KEY")
 
     if stream_key.name != c.music_settings.accepted_key:
         raise FileNotFittingSettingsError("WRONG_KEY")
 
-    for p in list(m21_stream.parts):
-        try:
-            part_key = p.analyze('key')
-        except m21.analysis.discrete.DiscreteAnalysisException:
+    kept_histograms = []
+
+    # all parts are correlated with all keys at once
+    for p, histogram, part_key in zip(parts, histograms, find_keys(histograms)):
+        if part_key is None:
             part_key = deepcopy(stream_key)
             part_key.correlationCoefficient = -1.0
 
@@ -210,7 +333,9 @@ def make_key_and_correlations(m21_stream: VanillaStream):
             part_key.correlationCoefficient = -1.0
 
         if part_key.correlationCoefficient < c.music_settings.delete_part_threshold:
-            m21_stream.remove(p, recurse=True)
+            m21_stream.remove_part(p)
+        else:
+            kept_histograms.append(histogram)
 
     if len(m21_stream.parts) == 0:
         m21_stream.key = "invalid"
@@ -218,7 +343,7 @@ def make_key_and_correlations(m21_stream: VanillaStream):
         raise FileNotFittingSettingsError("NO_PARTS")
 
     try:
-        new_stream_key = m21_stream.analyze('key')
+        new_stream_key = find_key(sum_histograms(kept_histograms))
     except m21.analysis.discrete.DiscreteAnalysisException:
         raise FileNotFittingSettingsError("INVALID_KEY")
 
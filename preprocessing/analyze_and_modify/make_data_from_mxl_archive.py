@@ -1,20 +1,129 @@
 #!/usr/bin/env python3
+import argparse
+import concurrent.futures
 import os
 import random
 import sys
 import threading
 import time
 import traceback
+from concurrent.futures.process import BrokenProcessPool
 
 import music21 as m21
 
 import settings.constants as c
+import settings.music_info_pb2 as music_info
 from music_utils.vanilla_stream import VanillaStream
 from preprocessing.analyze_and_modify.create_modified_stream import make_key_and_correlations
 from preprocessing.analyze_and_modify.create_modified_stream import process_data
-from preprocessing.analyze_and_modify.make_info import proto_buffer_entry_exists, save_vanilla_stream_pb
-from preprocessing.analyze_and_modify.make_info import put_in_protocol_buffer, make_invalid_in_protocol_buffer
-from preprocessing.helper import FileNotFittingSettingsError
+from preprocessing.analyze_and_modify.make_info import make_piece_of_music_pb, make_vanilla_stream_proto_buffer
+from preprocessing.analyze_and_modify.make_info import proto_buffer_entry_exists, write_vanilla_stream_pb
+from preprocessing.analyze_and_modify.make_info import put_piece_of_music_in_protocol_buffer
+from preprocessing.analyze_and_modify.make_info import make_invalid_in_protocol_buffer
+from preprocessing.context import context
+from preprocessing.file_limits import FileLimits, limit_address_space
+from preprocessing.helper import FileLimitExceededError, FileNotFittingSettingsError
+from preprocessing.manifest import PB_ARTIFACT
+
+
+def analyze_and_create_data(filename: str, thread_id=0) -> (bytes, bytes, str):
+    """
+    1. loads a file and creates a corresponding VanillaStream.
+    2. makes the file information for the global protocol buffer
+    3. makes the local pb file that is saved at the same place where the original
+       file was located, with .pb ending
+    Doesn't touch any global state, so that it can run in a separate process.
+    :param filename: name of the (complete) filepath of the .mxl file
+    :param thread_id:
+    :return: the serialized PieceOfMusic, the serialized VanillaStreamPB (None if the file is invalid)
+             and the error message (None if the file is valid)
+    """
+    m21_stream = VanillaStream(filename)
+
+    try:
+        process_data(thread_id, m21_stream)
+
+        with context.metrics.time('key_analysis'):
+            make_key_and_correlations(m21_stream)
+        m21_stream.valid = True
+
+        with context.metrics.time('make_proto'):
+            piece_of_music_pb = make_piece_of_music_pb(m21_stream, "")
+            vanilla_stream_pb = make_vanilla_stream_proto_buffer(m21_stream, piece_of_music_pb)
+
+        context.metrics.count('valid_files')
+        return piece_of_music_pb.SerializeToString(), vanilla_stream_pb.SerializeToString(), None
+
+    except FileNotFittingSettingsError:
+        error_message = str(sys.exc_info()[1])
+
+    except m21.duration.DurationException:
+        error_message = 'INVALID_FILE'
+
+    except MemoryError:
+        error_message = 'MEMORY_LIMIT'
+
+    context.metrics.count('error_' + error_message)
+    return make_piece_of_music_pb(m21_stream, error_message).SerializeToString(), None, error_message
+
+
+def save_data(filename: str, exists: bool, valid: bool, serialized_piece_of_music: bytes,
+              serialized_vanilla_stream: bytes, error_message: str):
+    """
+    saves the results of analyze_and_create_data in the global protocol buffer,
+    the local pb file and the manifest
+    :param filename: name of the (complete) filepath of the .mxl file
+    :param exists: if the file already had an entry in the protocol buffer
+    :param valid: if this entry was valid
+    :param serialized_piece_of_music:
+    :param serialized_vanilla_stream:
+    :param error_message:
+    :return:
+    """
+    if error_message:
+        if valid:
+            make_invalid_in_protocol_buffer(filename, error_message)
+            print(error_message)
+            return
+
+    with context.metrics.time('proto_write'):
+        if c.UPDATE and not exists:
+            piece_of_music_pb = music_info.PieceOfMusic()
+            piece_of_music_pb.ParseFromString(serialized_piece_of_music)
+            put_piece_of_music_in_protocol_buffer(piece_of_music_pb)
+
+        if serialized_vanilla_stream is not None and not context.manifest.has_artifact(filename, PB_ARTIFACT):
+            write_vanilla_stream_pb(filename, serialized_vanilla_stream)
+
+
+def is_done(filename: str) -> (bool, bool, bool):
+    """
+    tests if a file has to be processed at all
+    :param filename: name of the (complete) filepath of the .mxl file
+    :return: if the file is done, if it exists in the protocol buffer and if it is valid there
+    """
+    exists, valid = proto_buffer_entry_exists(filename)
+    if exists and not valid:
+        return True, exists, valid
+
+    if exists and context.manifest.has_artifact(filename, PB_ARTIFACT):
+        return True, exists, valid
+
+    return False, exists, valid
+
+
+def update_progress(no_update: bool):
+    """
+    counts a processed (or skipped) file and prints the progress from time to time
+    :param no_update: if the file was already done before
+    :return:
+    """
+    if no_update:
+        context.metrics.count('mxl_files_skipped')
+    else:
+        context.metrics.finished('mxl_files')
+
+    context.metrics.report('mxl_files', context.mxl_files_to_do - context.metrics.counters['mxl_files_skipped'])
 
 
 class MakeDataThread(threading.Thread):
@@ -26,7 +135,7 @@ class MakeDataThread(threading.Thread):
     def __init__(self, thread_id=random.randint(100000, 999999)):
         threading.Thread.__init__(self)
         self.threadID = thread_id
-        self.work_queue = c.mxl_work_queue
+        self.work_queue = context.mxl_work_queue
         self.exit_flag = 0
 
     def run(self):
@@ -46,10 +155,7 @@ class MakeDataThread(threading.Thread):
 
     def run_analyze_and_create_data(self):
         """
-        1. loads a file and creates a corresponding VanillaStream.
-        2. saves the file information in the global protocol buffer
-        3. saves a local pb file at the same place where the original
-           file was located, with .pb ending
+        processes files from the work queue with analyze_and_create_data and saves the results
         :return:
         """
         while not self.work_queue.empty() and not self.exit_flag:
@@ -60,116 +166,240 @@ class MakeDataThread(threading.Thread):
 
             no_update = False
 
-            valid = False
-            exists = False
-            m21_stream = None
-
             try:
 
-                exists, valid = proto_buffer_entry_exists(filename)
-                if exists and not valid:
-                    no_update = True
+                no_update, exists, valid = is_done(filename)
+                if no_update:
                     continue
 
-                if exists and os.path.exists(filename.replace('.mxl', '.pb')):
-                    no_update = True
-                    continue
+                with context.metrics.time('analyze'):
+                    results = analyze_and_create_data(filename, self.threadID)
 
-                m21_stream = VanillaStream(filename)
+                save_data(filename, exists, valid, *results)
 
-                process_data(self.threadID, m21_stream)
-                make_key_and_correlations(m21_stream)
-                m21_stream.valid = True
+            except:
+                print("\n\n\n", filename, "\n\n", sys.exc_info()[1], "\n\n", traceback.print_exc())
 
-                piece_of_music_pb = None
-                if c.UPDATE and not exists:
-                    piece_of_music_pb = put_in_protocol_buffer(m21_stream)
+            finally:
+                update_progress(no_update)
 
-                save_vanilla_stream_pb(m21_stream, piece_of_music_pb)
 
-            except FileNotFittingSettingsError:
-                if valid:
-                    make_invalid_in_protocol_buffer(filename, str(sys.exc_info()[1]))
-                    print(sys.exc_info()[1])
-                    continue
-                if c.UPDATE and not exists:
-                    put_in_protocol_buffer(m21_stream, error_message=str(sys.exc_info()[1]))
+def limit_exceeded_results(filename: str, error_message: str) -> (bytes, bytes, str):
+    """
+    the results of analyze_and_create_data for a file that was given up
+    :param filename: name of the (complete) filepath of the .mxl file
+    :param error_message: "TIMEOUT" or "MEMORY_LIMIT"
+    :return:
+    """
+    context.metrics.count('error_' + error_message)
+    return make_piece_of_music_pb(VanillaStream(filename), error_message).SerializeToString(), None, error_message
 
-            except m21.duration.DurationException:
-                if valid:
-                    make_invalid_in_protocol_buffer(filename, error='INVALID_FILE')
-                    print(sys.exc_info()[1])
-                    continue
-                if c.UPDATE and not exists:
-                    put_in_protocol_buffer(m21_stream, error_message='INVALID_FILE')
 
-            except:
-                print("\n\n\n", filename, "\n\n", sys.exc_info()[1], "\n\n", traceback.print_exc())
+def _analyze_and_create_data_in_process(filename: str) -> (bytes, bytes, str, str, dict):
+    """
+    runs analyze_and_create_data in a worker process, with the time and memory limits of FileLimits.
+    Exceptions are sent back as text, since not all music21 exceptions can be pickled
+    :param filename:
+    :return: the results of analyze_and_create_data, the formatted exception, if there was one,
+             and the metrics snapshot of this file
+    """
+    context.metrics.reset()
 
-            finally:
-                c.melody_lock.acquire()
+    try:
+        with context.metrics.time('analyze'), FileLimits():
+            results = analyze_and_create_data(filename, os.getpid()) + (None,)
+    except FileLimitExceededError:
+        # the limit was hit outside of the analysis itself
+        results = limit_exceeded_results(filename, str(sys.exc_info()[1])) + (None,)
+    except:
+        results = None, None, None, traceback.format_exc()
+
+    return results + (context.metrics.snapshot(),)
+
+
+def _finish_job(future: concurrent.futures.Future, filename: str, exists: bool, valid: bool):
+    """
+    saves the results of a job of run_in_processes
+    :param future: a finished future of _analyze_and_create_data_in_process
+    :param filename:
+    :param exists:
+    :param valid:
+    :return:
+    """
+    try:
+        serialized_piece_of_music, serialized_vanilla_stream, error_message, exception, metrics = future.result()
+
+        context.metrics.merge(metrics)
+
+        if exception:
+            print("\n\n\n", filename, "\n\n", exception)
+        else:
+            save_data(filename, exists, valid, serialized_piece_of_music, serialized_vanilla_stream, error_message)
+    except:
+        print("\n\n\n", filename, "\n\n", sys.exc_info()[1], "\n\n", traceback.print_exc())
+
+    finally:
+        update_progress(False)
+
+
+def _kill_pool(executor: concurrent.futures.ProcessPoolExecutor):
+    """
+    kills the worker processes of a pool, also the ones that hang in C code, and shuts it down
+    :param executor:
+    :return:
+    """
+    for process in list((executor._processes or {}).values()):
+        process.kill()
+    executor.shutdown(wait=True, cancel_futures=True)
+
+
+def run_in_processes(process_number: int):
+    """
+    analyzes all files from the work queue in a pool of worker processes. The workers only return
+    the serialized results, which are saved by this (single) process, so the global protocol buffer
+    and the manifest are never touched concurrently.
+    The limits of a file are enforced here as well, since the workers can't interrupt C code:
+    a file that isn't done FILE_KILL_DELAY seconds after its time limit is marked as TIMEOUT and the pool is
+    restarted. A worker that dies (e.g. killed by the kernel for its memory) breaks the pool, then the files it
+    might have been working on are run again one at a time, and the one that breaks it again is marked as
+    MEMORY_LIMIT
+    :param process_number: number of worker processes
+    :return:
+    """
+    work_queue = context.mxl_work_queue
+    # future -> filename, exists, valid, deadline and if it runs alone
+    jobs = {}
+    # the files that were in flight when the pool broke
+    suspects = []
+
+    executor = concurrent.futures.ProcessPoolExecutor(max_workers=process_number, initializer=limit_address_space)
+
+    try:
+        while jobs or suspects or not work_queue.empty():
+
+            # one job per process, so that every job starts right away and its deadline can be counted from here.
+            # The suspects run alone
+            while len(jobs) < process_number and not any(alone for *_, alone in jobs.values()):
+                if suspects:
+                    if jobs:
+                        break
+                    filename, exists, valid = suspects.pop()
+                    alone = True
+
+                elif not work_queue.empty():
+                    filename = work_queue.get()
+
+                    no_update, exists, valid = is_done(filename)
+                    if no_update:
+                        update_progress(no_update)
+                        continue
+                    alone = False
 
-                if no_update:
-                    c.mxl_files_to_do -= 1
-                    if c.mxl_files_done == 0:
-                        c.mxl_start_time = time.time()
                 else:
-                    c.mxl_files_done += 1
+                    break
 
-                    current_time = time.time()
+                deadline = None
+                if c.FILE_TIME_LIMIT is not None:
+                    deadline = time.monotonic() + c.FILE_TIME_LIMIT + c.FILE_KILL_DELAY
+                jobs[executor.submit(_analyze_and_create_data_in_process, filename)] = \
+                    (filename, exists, valid, deadline, alone)
 
-                    full_seconds_left = (((current_time - c.mxl_start_time) / (c.mxl_files_done + 0.001)) *
-                                         (c.mxl_files_to_do - c.mxl_files_done))
+            if not jobs:
+                continue
 
-                    days_left = str(round(full_seconds_left // 86400))
+            deadlines = [deadline for _, _, _, deadline, _ in jobs.values() if deadline is not None]
+            timeout = max(0.0, min(deadlines) - time.monotonic()) if deadlines else None
+            finished, _ = concurrent.futures.wait(jobs, timeout=timeout,
+                                                  return_when=concurrent.futures.FIRST_COMPLETED)
 
-                    hours_left = str(round((full_seconds_left % 86400) // 3600))
+            broken = any(isinstance(future.exception(), BrokenProcessPool)
+                         for future in finished)
+            now = time.monotonic()
+            timed_out = [future for future, (_, _, _, deadline, _) in jobs.items()
+                         if future not in finished and deadline is not None and now > deadline]
 
-                    minutes_left = str(round((full_seconds_left % 3600) // 60))
+            for future in finished:
+                if not isinstance(future.exception(), BrokenProcessPool):
+                    _finish_job(future, *jobs.pop(future)[:3])
 
-                    seconds_left = str(round(full_seconds_left % 60))
+            if not broken and not timed_out:
+                continue
+
+            _kill_pool(executor)
+
+            for future in timed_out:
+                filename, exists, valid, _, _ = jobs.pop(future)
+                save_data(filename, exists, valid, *limit_exceeded_results(filename, "TIMEOUT"))
+                update_progress(False)
+
+            # the other files in flight are run again, unless they were done just before the pool was stopped.
+            # If the pool broke, one of them might have broken it
+            for future, (filename, exists, valid, _, alone) in jobs.items():
+                if future.done() and not future.cancelled() and future.exception() is None:
+                    _finish_job(future, filename, exists, valid)
+                elif broken and alone:
+                    save_data(filename, exists, valid, *limit_exceeded_results(filename, "MEMORY_LIMIT"))
+                    update_progress(False)
+                elif broken:
+                    suspects.append((filename, exists, valid))
+                else:
+                    work_queue.put(filename)
+            jobs = {}
 
-                    # print information about the probable time left until every file is processed
-                    # highly annoying since its not actually decreasing a lot, as one can easily imagine :D
-                    # I've seen 4d for a while now so I'm really thinking about deleting the feature again :P
-                    print("\rFinished {do:>5}/{todo}, {p:>7.3f} percent of the files, Time left: {d:>2}d, {h:>2}h, "
-                          "{m:>2}min, {s:>2}s     ".format(
-                        do=str(c.mxl_files_done), todo=str(c.mxl_files_to_do),
-                        p=(round(c.mxl_files_done / c.mxl_files_to_do, 5)) * 100,
-                        d=days_left, h=hours_left, m=minutes_left, s=seconds_left),
-                        file=sys.stdout, flush=True, end='')
+            executor = concurrent.futures.ProcessPoolExecutor(max_workers=process_number,
+                                                              initializer=limit_address_space)
 
-                c.melody_lock.release()
+    finally:
+        executor.shutdown(wait=True)
 
 
 if __name__ == "__main__":
-    thread_number = 8
-    threads = []
+    parser = argparse.ArgumentParser(description="preprocesses all .mxl files of the corpus")
+    parser.add_argument('--processes', type=int, default=0,
+                        help="number of worker processes. With 0 (default), threads are used instead. "
+                             "The time and memory limit of a file only apply with processes")
+    parser.add_argument('--threads', type=int, default=8,
+                        help="number of worker threads, if no processes are used")
+    parser.add_argument('--metrics', default=None,
+                        help="file the stage timings and counters are written to, as JSON if it ends with .json, "
+                             "otherwise in the Prometheus text format")
+    arguments = parser.parse_args()
+
+    context.metrics.export_file = arguments.metrics
+
+    if arguments.processes > 0:
+        print("Starting {n} Processes\n\n\n".format(n=arguments.processes), flush=True)
+
+        run_in_processes(arguments.processes)
+
+        print("\n\n\nExiting all {n} Processes".format(n=arguments.processes))
+
+    else:
+        thread_number = arguments.threads
+        threads = []
 
-    for tName in range(thread_number):
-        thread = MakeDataThread(tName + 1)
-        threads.append(thread)
+        for tName in range(thread_number):
+            thread = MakeDataThread(tName + 1)
+            threads.append(thread)
 
-    print("Starting all {n} Threads\n\n\n".format(n=thread_number), flush=True)
+        print("Starting all {n} Threads\n\n\n".format(n=thread_number), flush=True)
 
-    c.mxl_start_time = time.time()
+        for t in threads:
+            t.start()
 
-    for t in threads:
-        t.start()
+        for t in threads:
+            t.join()
 
-    for t in threads:
-        t.join()
+        print("\n\n\nExiting all {n} Threads".format(n=thread_number))
 
-    print("\n\n\nExiting all {n} Threads".format(n=thread_number))
+    context.close_shards()
 
-    c.music_protocol_buffer.counter = 0
-    serialized_byte_stream = c.music_protocol_buffer.SerializeToString()
+    context.metrics.report('mxl_files', context.mxl_files_to_do - context.metrics.counters['mxl_files_skipped'],
+                           force=True)
+    print("\n\n" + context.metrics.summary())
 
-    c.music_info_file_lock.acquire()
     print("\rcurrently writing protocol buffer\t\t\t\t\t", file=sys.stderr, end='', flush=True)
-    with open(c.PROTOCOL_BUFFER_LOCATION, 'wb') as fp:
-        fp.write(serialized_byte_stream)
+    context.music_list_store.compact()
     print("\rfinished writing protocol buffer \t\t\t\t\t", file=sys.stderr, end='', flush=True)
-    c.music_info_file_lock.release()
 
     sys.exit(0)
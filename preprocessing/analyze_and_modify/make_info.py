@@ -1,17 +1,19 @@
 import os
-import sys
 import traceback
 
 import settings.constants as c
 import settings.music_info_pb2 as music_info
+from music_utils.proto_columns import make_vanilla_stream
 from music_utils.vanilla_part import VanillaPart
 from music_utils.vanilla_stream import VanillaStream
+from preprocessing.context import context
+from preprocessing.manifest import PB_ARTIFACT
 
 
-def make_piece_of_music_pb(m21_stream: VanillaStream, error_message: str, update_pb=True):
+def make_piece_of_music_pb(m21_stream: VanillaStream, error_message: str):
     """
-    makes a new protocol buffer entry to the protocol buffer specified in settings.constants,
-    based on the m21_stream file
+    makes a new protocol buffer entry for the protocol buffer specified in settings.constants,
+    based on the m21_stream file. It is not added to it, see put_piece_of_music_in_protocol_buffer
     :param m21_stream: Music piece that should be saved
     :param error_message: an optional message specifying why this file is not valid for the current settings
     :return:
@@ -45,10 +47,6 @@ def make_piece_of_music_pb(m21_stream: VanillaStream, error_message: str, update
             temp_part.note_percentage = p.note_percentage
             temp_part.lyrics_percentage = p.lyrics_percentage
 
-    if update_pb:
-        c.music_protocol_buffer.counter = c.music_protocol_buffer.counter + 1
-        c.music_protocol_buffer.music_data.add().CopyFrom(music_file)
-
     return music_file
 
 
@@ -60,30 +58,37 @@ def put_in_protocol_buffer(m21_stream: VanillaStream, error_message: str = None)
     :param error_message: an optional message saying why the stream is invalid with the current settings
     :return:
     """
-    c.music_info_dict_lock.acquire()
     try:
-        if proto_buffer_entry_exists(m21_stream.id)[0]:
-            c.music_info_dict_lock.release()
-            return
-
         piece_of_music_pb = make_piece_of_music_pb(m21_stream, error_message)
-        c.existing_files[m21_stream.id] = m21_stream.valid
+    except:
+        traceback.print_exc()
+        return
+
+    return put_piece_of_music_in_protocol_buffer(piece_of_music_pb)
 
-        if c.music_protocol_buffer.counter >= c.UPDATE_FREQUENCY:
 
-            c.music_protocol_buffer.counter = 0
-            serialized_byte_stream = c.music_protocol_buffer.SerializeToString()
+def put_piece_of_music_in_protocol_buffer(piece_of_music_pb: music_info.PieceOfMusic):
+    """
+    adds an already made entry to the protocol buffer specified by the current settings,
+    if there is no entry for its file yet
+    :param piece_of_music_pb:
+    :return: the entry, or None if it wasn't added
+    """
+    c.music_info_dict_lock.acquire()
+    try:
+        if piece_of_music_pb.filepath in context.music_data_index:
             c.music_info_dict_lock.release()
+            return
 
-            c.music_info_file_lock.acquire()
-            print("\rcurrently writing protocol buffer\t\t\t\t\t", file=sys.stderr, end='', flush=True)
-            with open(c.PROTOCOL_BUFFER_LOCATION, 'wb') as fp:
-                fp.write(serialized_byte_stream)
-            print("\rfinished writing protocol buffer \t\t\t\t\t", file=sys.stderr, end='', flush=True)
-            c.music_info_file_lock.release()
+        entry = context.music_protocol_buffer.music_data.add()
+        entry.CopyFrom(piece_of_music_pb)
+        context.music_data_index[piece_of_music_pb.filepath] = entry
+        c.music_info_dict_lock.release()
 
-        else:
-            c.music_info_dict_lock.release()
+        # only the new entry is appended to the journal, the whole list is written when compacting
+        context.music_list_store.append(piece_of_music_pb)
+        if not piece_of_music_pb.valid:
+            context.manifest.add_invalid([piece_of_music_pb.filepath])
 
         return piece_of_music_pb
 
@@ -93,27 +98,29 @@ def put_in_protocol_buffer(m21_stream: VanillaStream, error_message: str = None)
             c.music_info_dict_lock.release()
         except RuntimeError:
             pass
-        try:
-            c.music_info_file_lock.release()
-        except RuntimeError:
-            pass
 
 
 def make_invalid_in_protocol_buffer(filename, error):
+    relative_filename = os.path.relpath(filename, c.MXL_DATA_FOLDER)
+    changed_file = None
     try:
         c.music_info_dict_lock.acquire()
-        for file in c.music_protocol_buffer.music_data:
-            if filename == os.path.join(c.MXL_DATA_FOLDER, file.filepath):
-                file.valid = False
-                file.ClearField('key')
-                file.ClearField('key_correlation')
-                file.ClearField('parts')
-                file.error = getattr(music_info, error)
-                break
+        file = context.music_data_index.get(relative_filename)
+        if file is not None:
+            file.valid = False
+            file.ClearField('key')
+            file.ClearField('key_correlation')
+            file.ClearField('parts')
+            file.error = getattr(music_info, error)
+            changed_file = file
 
     finally:
         c.music_info_dict_lock.release()
 
+    if changed_file is not None:
+        context.music_list_store.append(changed_file)
+        context.manifest.add_invalid([relative_filename])
+
 
 def proto_buffer_entry_exists(filename: str) -> (bool, bool):
     """
@@ -124,66 +131,48 @@ def proto_buffer_entry_exists(filename: str) -> (bool, bool):
 
     relative_filename = os.path.relpath(filename, c.MXL_DATA_FOLDER)
     valid = False
-    exists = relative_filename in c.existing_files
+    file = context.music_data_index.get(relative_filename)
+    exists = file is not None
     if exists:
-        valid = c.existing_files[relative_filename]
+        valid = file.valid
 
     return exists, valid
 
 
 def save_vanilla_stream_pb(m21_stream: VanillaStream, info: music_info.PieceOfMusic):
-    new_file_path = m21_stream.id.replace('.mxl', '.pb')
-
     # if in some other program or place this was already created
-    if os.path.exists(new_file_path):
+    if context.manifest.has_artifact(m21_stream.id, PB_ARTIFACT):
         return
 
     if not info:
-        info = make_piece_of_music_pb(m21_stream, "", update_pb=False)
+        info = make_piece_of_music_pb(m21_stream, "")
 
-    proto_buffer = _make_vanilla_stream_proto_buffer(m21_stream, info)
+    proto_buffer = make_vanilla_stream_proto_buffer(m21_stream, info)
 
-    with open(new_file_path, 'xb') as fp:
-        fp.write(proto_buffer.SerializeToString())
+    write_vanilla_stream_pb(m21_stream.id, proto_buffer.SerializeToString())
 
 
-def _make_vanilla_stream_proto_buffer(m21_stream: VanillaStream,
-                                      temp_info: music_info.PieceOfMusic) -> music_info.VanillaStreamPB:
+def write_vanilla_stream_pb(filename: str, serialized_vanilla_stream: bytes):
+    """
+    writes a serialized VanillaStreamPB into the shards (or next to its .mxl file) and records it in the manifest
+    :param filename: name of the (complete) filepath of the .mxl file
+    :param serialized_vanilla_stream:
+    :return:
+    """
+    context.write_artifact(filename, PB_ARTIFACT, serialized_vanilla_stream)
+
+
+def make_vanilla_stream_proto_buffer(m21_stream: VanillaStream,
+                                     temp_info: music_info.PieceOfMusic) -> music_info.VanillaStreamPB:
     """
     makes a proto buffer file from a vanilla stream, that is small and fast :D
     :param m21_stream:
     :param temp_info:
     :return:
     """
-    proto_buffer = music_info.VanillaStreamPB()
-    proto_buffer.filepath = os.path.relpath(m21_stream.id, c.MXL_DATA_FOLDER)
-
-    proto_buffer.info.CopyFrom(temp_info)
-
+    parts = []
     for p in m21_stream.parts:
+        p: VanillaPart
+        parts.append((p.partName,) + p.columns_with_rests())
 
-        proto_part = proto_buffer.parts.add(name=p.partName)
-
-        offsets = []
-        lengths = []
-        pitches = []
-        volumes = []
-
-        for note in p.flat.getElementsByClass(('Note', 'Rest')):
-            offsets.append(note.offset)
-            lengths.append(note.quarterLength)
-            if note.isNote:
-                pitches.append(int(note.pitch.ps))
-                volumes.append(int(note.volume.velocity))
-            elif note.isRest:
-                pitches.append(200)
-                volumes.append(0)
-
-        assert len(offsets) == len(lengths) == len(pitches) == len(volumes)
-
-        proto_part.offsets.extend(offsets)
-        proto_part.lengths.extend(lengths)
-        proto_part.pitches.extend(pitches)
-        proto_part.volumes.extend(volumes)
-
-    return proto_buffer
+    return make_vanilla_stream(os.path.relpath(m21_stream.id, c.MXL_DATA_FOLDER), temp_info, parts)
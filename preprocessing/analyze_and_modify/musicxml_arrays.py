@@ -0,0 +1,480 @@
+#!/usr/bin/env python3
+import os
+import xml.etree.ElementTree as ElementTree
+from fractions import Fraction
+
+import settings.constants as c
+import settings.music_info_pb2 as music_info
+from music_utils.proto_columns import make_vanilla_stream
+from music_utils.vanilla_part import VanillaPart
+from preprocessing.analyze_and_modify.prefilter import open_musicxml
+
+# quarter lengths of the MusicXML note types, like in music21.duration
+TYPE_QUARTER_LENGTHS = {
+    'maxima': Fraction(32), 'long': Fraction(16), 'longa': Fraction(16), 'breve': Fraction(8),
+    'whole': Fraction(4), 'half': Fraction(2), 'quarter': Fraction(1), 'eighth': Fraction(1, 2),
+    '16th': Fraction(1, 4), '32nd': Fraction(1, 8), '32th': Fraction(1, 8), '64th': Fraction(1, 16),
+    '128th': Fraction(1, 32), '256th': Fraction(1, 64), '512th': Fraction(1, 128),
+    '1024th': Fraction(1, 256), '2048th': Fraction(1, 512)
+}
+
+STEP_PITCHES = {'C': 0, 'D': 2, 'E': 4, 'F': 5, 'G': 7, 'A': 9, 'B': 11}
+
+# music21 uses C4 for notes without a <pitch>, e.g. unpitched percussion
+DEFAULT_PITCH = 60.0
+
+
+class _MeasureEvent:
+    """
+    a note, chord or rest of a measure, before it is put into the part
+    """
+    __slots__ = ('offset', 'length', 'pitches', 'volume', 'lyrics', 'voice', 'staff', 'index', 'is_rest',
+                 'is_whole')
+
+    def __init__(self, offset, length, pitches, volume, lyrics, voice, staff, index, is_rest=False, is_whole=False):
+        self.offset = offset
+        self.length = length
+        self.pitches = pitches
+        self.volume = volume
+        self.lyrics = lyrics
+        self.voice = voice
+        self.staff = staff
+        self.index = index
+        self.is_rest = is_rest
+        self.is_whole = is_whole
+
+
+def _op_frac(value: Fraction):
+    """
+    music21 keeps offsets and lengths as floats if they can be represented exactly and as Fractions otherwise.
+    Since create_note compares lengths made from these with floats, they have to be the same here
+    :param value:
+    :return: a float or a Fraction, like music21.common.opFrac
+    """
+    if value.denominator & (value.denominator - 1) == 0:
+        return float(value)
+    return value
+
+
+def _text(elem, tag: str):
+    """
+    :return: the stripped text of the child tag, or None if there is none
+    """
+    child = elem.find(tag)
+    if child is None or child.text is None or not child.text.strip():
+        return None
+    return child.text.strip()
+
+
+def _clean(text):
+    if text is None:
+        return None
+    return text.strip().replace('\n', ' ')
+
+
+def _pitch(note_elem) -> float:
+    """
+    :return: the written pitch space value of a <note>, like music21's Pitch.ps
+    """
+    pitch_elem = note_elem.find('pitch')
+    if pitch_elem is None:
+        return DEFAULT_PITCH
+
+    step = _text(pitch_elem, 'step')
+    octave = _text(pitch_elem, 'octave')
+    alter = _text(pitch_elem, 'alter')
+
+    pitch = STEP_PITCHES[step if step else 'C'] + 12 * ((int(octave) if octave else 4) + 1)
+    if alter:
+        pitch += float(alter)
+    return float(pitch)
+
+
+def _velocity(note_elem):
+    """
+    converts the dynamics attribute of a <note> to a velocity, the same way music21 does
+    (90 percent of a forte is velocity 90)
+    :return: the velocity or None if the note has no dynamics attribute
+    """
+    dynamics = note_elem.get('dynamics')
+    if dynamics is None:
+        return None
+
+    scalar = float(dynamics) * (90 / 12700)
+    scalar = min(max(scalar, 0), 1)
+    return round(scalar * 127)
+
+
+def _quarter_length(note_elem, divisions: Fraction) -> (Fraction, bool):
+    """
+    calculates the quarter length of a <note> like music21: from its type, dots and
+    time modification if there is a type, else from the duration
+    :return: the quarter length and if it is a whole or breve without dots or tuplets
+    """
+    if note_elem.find('grace') is not None:
+        return Fraction(0), False
+
+    note_type = _text(note_elem, 'type')
+
+    if note_type is None:
+        duration = _text(note_elem, 'duration')
+        quarter_length = Fraction(duration) / divisions if duration else Fraction(0)
+        return quarter_length, quarter_length in (4, 8)
+
+    quarter_length = TYPE_QUARTER_LENGTHS[note_type]
+    dots = len(note_elem.findall('dot'))
+    if dots:
+        quarter_length *= 2 - Fraction(1, 2 ** dots)
+
+    time_modification = note_elem.find('time-modification')
+    if time_modification is not None:
+        actual = _text(time_modification, 'actual-notes')
+        normal = _text(time_modification, 'normal-notes')
+        quarter_length *= Fraction(int(normal) if normal else 1, int(actual) if actual else 1)
+        return quarter_length, False
+
+    return quarter_length, note_type in ('whole', 'breve') and not dots
+
+
+def _bar_length(time_elem):
+    """
+    :return: the length of a bar of a <time> in quarters, or None if it has no beats
+    """
+    beats = time_elem.findall('beats')
+    beat_types = time_elem.findall('beat-type')
+    if not beats or len(beats) != len(beat_types):
+        return None
+
+    bar_length = Fraction(0)
+    for b, bt in zip(beats, beat_types):
+        bar_length += Fraction(4 * sum(int(x) for x in b.text.strip().split('+')), int(bt.text.strip()))
+    return bar_length
+
+
+class _PartReader:
+    """
+    reads the measures of one <part> one after the other and keeps the state that music21's
+    PartParser keeps between them (divisions, transposition, measure offset and time signature)
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.staves = 1
+        self.staff_numbers = set()
+        self.divisions = Fraction(10080)
+        self.transposition = 0
+        self.measure_offset = Fraction(0)
+        self.bar_length = Fraction(4)
+        self.measure_number = 0
+        # (absolute offset, measure number, voice rank, offset in measure, position in measure, event)
+        self.events = []
+
+    def read_measure(self, measure):
+        elements = list(measure)
+
+        voices = set()
+        for elem in elements:
+            if elem.tag == 'note':
+                voice = _text(elem, 'voice')
+                if voice is not None:
+                    voices.add(voice)
+        voice_ranks = {}
+        if len(voices) > 1:
+            voice_ranks = {v: i for i, v in enumerate(sorted(voices))}
+
+        cursor = Fraction(0)
+        highest_time = Fraction(0)
+        chord_notes = []
+        chord_voice = None
+        events = []
+        rests = []
+        note_count = 0
+        full_measure_rest = False
+        measure_time = None
+        measure_transposition = None
+
+        for i, elem in enumerate(elements):
+            tag = elem.tag
+
+            if tag == 'note':
+                next_is_chord = (i + 1 < len(elements) and elements[i + 1].tag == 'note' and
+                                 elements[i + 1].find('chord') is not None)
+                is_rest = elem.find('rest') is not None
+                is_chord = elem.find('chord') is not None or next_is_chord
+
+                if next_is_chord and _text(elem, 'voice') is not None:
+                    chord_voice = _text(elem, 'voice')
+
+                increment = Fraction(0)
+
+                if is_chord:
+                    chord_notes.append(elem)
+                else:
+                    length, is_whole = _quarter_length(elem, self.divisions)
+                    voice = self._voice(elem, voice_ranks, chord_voice)
+
+                    if is_rest:
+                        rest_tag = elem.find('rest')
+                        if rest_tag.get('measure') == 'yes':
+                            full_measure_rest = True
+                        event = _MeasureEvent(cursor, length, None, None, False, voice, self._staff(elem), i,
+                                              True, is_whole)
+                        rests.append(event)
+                    else:
+                        note_count += 1
+                        event = _MeasureEvent(cursor, length, [_pitch(elem)], _velocity(elem),
+                                              self._has_lyrics([elem]), voice, self._staff(elem), i)
+                    events.append(event)
+                    increment = length
+
+                if chord_notes and not next_is_chord:
+                    length, _ = _quarter_length(chord_notes[0], self.divisions)
+                    velocities = [_velocity(n) for n in chord_notes]
+                    if all(v is None for v in velocities):
+                        volume = None
+                    else:
+                        # like music21, this fails if only some of the notes have a velocity
+                        volume = int(round(sum(velocities) / float(len(velocities))))
+
+                    for n in chord_notes:
+                        if _text(n, 'voice') is not None:
+                            voice = self._voice(n, voice_ranks, chord_voice)
+                            break
+                    else:
+                        voice = self._voice(elem, voice_ranks, chord_voice)
+
+                    events.append(_MeasureEvent(cursor, length, [_pitch(n) for n in chord_notes], volume,
+                                                self._has_lyrics(chord_notes), voice, self._staff(chord_notes[0]),
+                                                i))
+                    chord_notes = []
+                    increment = length
+
+                cursor += increment
+
+            elif tag == 'backup':
+                duration = _text(elem, 'duration')
+                if duration is not None:
+                    cursor -= Fraction(duration) / self.divisions
+
+            elif tag == 'forward':
+                cursor += Fraction(_text(elem, 'duration')) / self.divisions
+                self._staff(elem)
+
+            elif tag == 'attributes':
+                divisions = _text(elem, 'divisions')
+                if divisions is not None:
+                    self.divisions = Fraction(divisions)
+
+                staves = _text(elem, 'staves')
+                if staves is not None:
+                    self.staves = max(self.staves, int(staves))
+
+                for child in elem:
+                    if child.tag in ('clef', 'key', 'time', 'staff-details') and child.get('number') is not None:
+                        self.staff_numbers.add(child.get('number'))
+
+                for transpose in elem.findall('transpose'):
+                    chromatic = _text(transpose, 'chromatic')
+                    octave_change = _text(transpose, 'octave-change')
+                    measure_transposition = ((int(chromatic) if chromatic else 0) +
+                                             12 * (int(octave_change) if octave_change else 0))
+
+                for time_elem in elem.findall('time'):
+                    if cursor == 0 and measure_time is None:
+                        measure_time = _bar_length(time_elem)
+
+                if elem.find('clef') is not None or elem.find('key') is not None or elem.find('time') is not None:
+                    highest_time = max(highest_time, cursor)
+
+            elif tag in ('direction', 'harmony'):
+                offset = _text(elem, 'offset')
+                direction_offset = cursor + (Fraction(offset) / self.divisions if offset else 0)
+                highest_time = max(highest_time, direction_offset)
+                self._staff(elem)
+
+        if measure_transposition is not None:
+            self.transposition = measure_transposition
+
+        if measure_time is not None:
+            self.bar_length = measure_time
+
+        if (len(rests) == 1 and note_count == 0) or full_measure_rest:
+            rest = rests[0]
+            if rest.is_whole and rest.length != self.bar_length:
+                rest.length = self.bar_length
+
+        for event in events:
+            highest_time = max(highest_time, event.offset + event.length)
+
+            if event.is_rest:
+                continue
+
+            pitches = [p + self.transposition for p in event.pitches]
+            event.pitches = pitches
+            offset_in_measure = event.offset
+            event.offset += self.measure_offset
+            self.events.append((event.offset, self.measure_number, event.voice, offset_in_measure, event.index,
+                                event))
+
+        # empty measures are filled with a rest as long as the time signature says
+        if highest_time == 0 and not events:
+            highest_time = self.bar_length
+
+        self.measure_offset += highest_time
+        self.measure_number += 1
+
+    @staticmethod
+    def _voice(note_elem, voice_ranks: dict, chord_voice) -> int:
+        """
+        :return: the position of the voice of this note in the measure. Notes that aren't in any voice come last
+        """
+        if not voice_ranks:
+            return 0
+
+        voice = _text(note_elem, 'voice')
+        if voice is None:
+            voice = chord_voice if chord_voice is not None else '1'
+        return voice_ranks.get(voice, len(voice_ranks))
+
+    def _staff(self, elem):
+        """
+        :return: the staff number of a <note>, <forward>, <direction> or <harmony>, or None if it has none
+        """
+        staff = _text(elem, 'staff')
+        if staff is not None:
+            self.staff_numbers.add(staff)
+        return staff
+
+    @staticmethod
+    def _has_lyrics(note_elems) -> bool:
+        for n in note_elems:
+            for lyric in n.findall('lyric'):
+                if lyric.find('text') is not None and lyric.find('text').text is not None:
+                    return True
+        return False
+
+    def finish(self) -> [VanillaPart]:
+        """
+        puts all notes and chords read so far into VanillaParts. Like music21, a part with more than one staff
+        is split into one part per staff, and elements without a staff belong to all of them
+        :return:
+        """
+        # ordered like part.flat, the VanillaPart orders them (stable) by the rounded offsets
+        self.events.sort(key=lambda e: e[:5])
+
+        if self.staves == 1:
+            return [self._make_part([e[-1] for e in self.events])]
+
+        return [self._make_part([e[-1] for e in self.events
+                                 if e[-1].staff is None or int(e[-1].staff) == int(staff)])
+                for staff in sorted(self.staff_numbers)]
+
+    def _make_part(self, events: [_MeasureEvent]) -> VanillaPart:
+        """
+        inserts the events into a new VanillaPart, in the order music21 inserts them in process_file
+        :param events: note and chord events with their absolute offsets
+        :return:
+        """
+        part = VanillaPart(self.name)
+
+        starts = [_op_frac(event.offset) for event in events]
+        ends = [start + _op_frac(event.length) for start, event in zip(starts, events)]
+        part.insert_events(starts, ends, [event.volume for event in events], [event.lyrics for event in events],
+                           [pitch for event in events for pitch in event.pitches],
+                           [len(event.pitches) for event in events],
+                           [len(event.pitches) != 1 for event in events])
+
+        return part
+
+
+def _midi_channels(elem) -> [int]:
+    """
+    :return: the channels (counted from 0 like in music21) of all midi-instrument elements in elem,
+    channels that aren't numbers are left out
+    """
+    channels = []
+    for midi_instrument in elem.iter('midi-instrument'):
+        try:
+            channels.append(int(_text(midi_instrument, 'midi-channel')) - 1)
+        except (TypeError, ValueError):
+            continue
+    return channels
+
+
+def _score_part_info(score_part) -> (str, bool):
+    """
+    :return: the part name music21 would give this part, and if one of its instruments is a drum instrument
+    that process_file would delete
+    """
+    part_name = _clean(_text(score_part, 'part-name'))
+    part_abbreviation = _clean(_text(score_part, 'part-abbreviation'))
+
+    instrument_names = [(_clean(_text(score_instrument, 'instrument-name')),
+                         _clean(_text(score_instrument, 'instrument-abbreviation')))
+                        for score_instrument in score_part.iterfind('score-instrument')] or [(None, None)]
+
+    best_names = [next((n for n in (part_name, part_abbreviation, instrument_name, instrument_abbreviation)
+                        if n is not None), None)
+                  for instrument_name, instrument_abbreviation in instrument_names]
+
+    # delete drum channel (9) and parts with "drum" in their name
+    drums = 9 in _midi_channels(score_part) or any(best_name is not None and "drum" in best_name.lower()
+                                                   for best_name in best_names)
+
+    return part_name if part_name is not None else instrument_names[0][0], drums
+
+
+def read_parts(filename: str) -> [VanillaPart]:
+    """
+    reads the notes of all parts of a MusicXML file into VanillaParts, without music21. The result is the same
+    as running process_file on the music21 Score and reading offsets, lengths, pitches and volumes of the notes
+    and rests of each VanillaPart, like make_vanilla_stream_proto_buffer does: parts with any drum instrument
+    are left out, part names are made unique, parts are at sounding pitch and notes are quarter rounded
+    and at most 4 beats long
+    :param filename: name of the (complete) filepath
+    :return: a VanillaPart for every part that isn't a drum part
+    """
+    part_name_list = []
+    number = 2
+    parts = []
+
+    with open_musicxml(filename) as fp:
+        score = ElementTree.parse(fp).getroot()
+
+    score_parts = {}
+    for score_part in score.iter('score-part'):
+        score_parts[score_part.get('id')] = _score_part_info(score_part)
+
+    for part_elem in score.iterfind('part'):
+        part_name, drums = score_parts[part_elem.get('id')]
+        # instrument changes in the measures can switch to the drum channel as well
+        if drums or 9 in _midi_channels(part_elem):
+            continue
+
+        reader = _PartReader(part_name)
+        for measure in part_elem.iterfind('measure'):
+            reader.read_measure(measure)
+
+        for part in reader.finish():
+            # force unique names
+            if part.partName in part_name_list:
+                part.partName = part.partName + "_" + str(number)
+                number += 1
+            else:
+                part_name_list.append(part.partName)
+            parts.append(part)
+
+    return parts
+
+
+def make_vanilla_stream_proto_buffer_from_parts(filename: str, parts: [VanillaPart],
+                                                temp_info: music_info.PieceOfMusic) -> music_info.VanillaStreamPB:
+    """
+    the same as make_vanilla_stream_proto_buffer, but for parts read with read_parts
+    :param filename: name of the (complete) filepath
+    :param parts:
+    :param temp_info:
+    :return:
+    """
+    return make_vanilla_stream(os.path.relpath(filename, c.MXL_DATA_FOLDER), temp_info,
+                               [(p.partName,) + p.columns_with_rests() for p in parts])
@@ -0,0 +1,108 @@
+import posixpath
+import xml.etree.ElementTree as ElementTree
+import zipfile
+
+import settings.constants as c
+from music_utils.vanilla_stream import VanillaStream
+from preprocessing.helper import FileNotFittingSettingsError
+
+
+def open_musicxml(filename: str):
+    """
+    opens the MusicXML document of a .mxl archive (or of an uncompressed MusicXML file)
+    :param filename: name of the (complete) filepath
+    :return: a binary file object, which has to be closed by the caller
+    """
+    if not zipfile.is_zipfile(filename):
+        return open(filename, 'rb')
+
+    archive = zipfile.ZipFile(filename)
+    try:
+        root_file = None
+        if 'META-INF/container.xml' in archive.namelist():
+            container = ElementTree.fromstring(archive.read('META-INF/container.xml'))
+            for elem in container.iter('rootfile'):
+                root_file = elem.get('full-path')
+                break
+
+        if root_file is None:
+            root_file = [name for name in archive.namelist()
+                         if not name.startswith('META-INF/') and posixpath.splitext(name)[1] == '.xml'][0]
+
+        fp = archive.open(root_file)
+    finally:
+        # the opened member keeps its own reference to the archive file
+        archive.close()
+    return fp
+
+
+def read_header(filename: str) -> (set, list, bool):
+    """
+    reads only the time signatures and metronome marks of a MusicXML file, without building a music21 Score.
+    Only metronome marks and time signatures that music21 reads the same way are returned,
+    everything else is reported as unclear
+    :param filename: name of the (complete) filepath
+    :return: the set of time signatures as ratio strings (e.g. "4/4"), the list of metronome numbers
+             and whether there were elements that couldn't be interpreted
+    """
+    time_signatures = set()
+    metronome_numbers = []
+    unclear = False
+
+    with open_musicxml(filename) as fp:
+        for _, elem in ElementTree.iterparse(fp):
+            tag = elem.tag
+
+            if tag == 'time':
+                beats = elem.findall('beats')
+                beat_types = elem.findall('beat-type')
+                if len(beats) == 1 and len(beat_types) == 1:
+                    time_signatures.add(beats[0].text.strip() + "/" + beat_types[0].text.strip())
+                elif elem.find('senza-misura') is None:
+                    unclear = True
+
+            elif tag == 'metronome':
+                # music21 makes a MetricModulation out of metronomes with two beat units, not a MetronomeMark
+                if len(elem.findall('beat-unit')) < 2:
+                    try:
+                        metronome_numbers.append(float(elem.find('per-minute').text))
+                    except (AttributeError, TypeError, ValueError):
+                        unclear = True
+
+            elif tag == 'measure':
+                # nothing outside of the measures is needed anymore, so keep the memory small
+                elem.clear()
+
+    return time_signatures, metronome_numbers, unclear
+
+
+def prefilter(m21_stream: VanillaStream):
+    """
+    rejects files that can't fit the settings because of their time signature or their beats per minute,
+    before the expensive music21 parse. Raises the same FileNotFittingSettingsError as check_valid_time
+    and check_valid_bpm, but only if these checks would certainly fail. The key can only be found by
+    analysing all notes, so it is left to make_key_and_correlations.
+    The metronome numbers of the header aren't set on the stream: music21 doesn't keep all of them, so they
+    aren't the ones a full parse records in the MusicList. The entries of rejected files have none
+    :param m21_stream: a VanillaStream with the filename as id
+    :return:
+    """
+    try:
+        time_signatures, metronome_numbers, unclear = read_header(m21_stream.id)
+    except (zipfile.BadZipFile, ElementTree.ParseError, IndexError, KeyError, OSError):
+        # let music21 decide what to do with this file
+        return
+
+    if unclear:
+        return
+
+    if len(time_signatures) > 1:
+        raise FileNotFittingSettingsError("WRONG_TIME_SIGNATURE")
+
+    if time_signatures and time_signatures.pop().replace("/", "_") != c.music_settings.valid_time:
+        raise FileNotFittingSettingsError("WRONG_TIME_SIGNATURE")
+
+    # VanillaStream only keeps the maximum exact, so the lower bound is only checked against it
+    if metronome_numbers and (max(metronome_numbers) > c.music_settings.max_bpm or
+                              max(metronome_numbers) < c.music_settings.min_bpm):
+        raise FileNotFittingSettingsError("WRONG_BPM")
@@ -0,0 +1,249 @@
+import queue
+import threading
+
+import settings.constants as c
+import settings.music_info_pb2 as music_info
+from preprocessing.manifest import Manifest, MELODY_ARTIFACTS, PB_ARTIFACT, TF_SKYLINE_ARTIFACT
+from preprocessing.metrics import Metrics
+from preprocessing.music_list_store import MusicListStore
+from preprocessing.parse_cache import ParseCache
+from preprocessing.shards import ShardReader, ShardWriter, shard_folder
+
+
+class Context:
+    """
+    holds everything a pipeline stage needs besides the plain settings in settings.constants:
+    the MusicList for the current settings with an index of the files already known in it, the corpus manifest,
+    the parse cache, the shards of the derived files, the work queues and the metrics. Nothing is loaded on construction - the MusicList is parsed
+    when it is first used and the work queues are filled from the manifest when they are first asked for.
+    """
+
+    def __init__(self):
+        self._setup_lock = threading.RLock()
+
+        self._manifest = None
+        self._parse_cache = None
+        self._shard_writers = {}
+        self._shard_readers = {}
+
+        self._music_list_store = None
+        self._music_protocol_buffer = None
+        self._music_data_index = None
+
+        self._mxl_work_queue = None
+        self._proto_buffer_work_queue = None
+        self._melody_work_queue = None
+
+        # progress and stage timings of this process, see preprocessing.metrics
+        self.metrics = Metrics()
+
+        # the melody algorithms the songs of the proto buffer work queue are missing MelodyLists of,
+        # has to be set before the work queues are filled
+        self.melody_algorithms = list(c.MELODY_ALGORITHMS)
+
+        self.mxl_files_to_do = 0
+        self.proto_buffers_to_do = 0
+        self.melodies_to_do = 0
+
+    @property
+    def manifest(self) -> Manifest:
+        if self._manifest is None:
+            with self._setup_lock:
+                if self._manifest is None:
+                    c.make_folders()
+                    self._manifest = Manifest()
+        return self._manifest
+
+    @property
+    def parse_cache(self) -> ParseCache:
+        if self._parse_cache is None:
+            with self._setup_lock:
+                if self._parse_cache is None:
+                    self._parse_cache = ParseCache()
+        return self._parse_cache
+
+    def shard_writer(self, kind: str) -> ShardWriter:
+        """
+        the single writer of the shards of a kind of derived files in this process.
+        Every written record is added to the manifest
+        :param kind: one of the *_ARTIFACT suffixes of preprocessing.manifest
+        :return:
+        """
+        with self._setup_lock:
+            if kind not in self._shard_writers:
+                self._shard_writers[kind] = ShardWriter(
+                    shard_folder(kind), on_written=lambda key: self.manifest.add_artifact(key, kind))
+            return self._shard_writers[kind]
+
+    def shard_reader(self, kind: str) -> ShardReader:
+        with self._setup_lock:
+            if kind not in self._shard_readers:
+                self._shard_readers[kind] = ShardReader(shard_folder(kind))
+            return self._shard_readers[kind]
+
+    def close_shards(self):
+        """
+        writes the remaining records and finishes the shards. Has to be called at the end of a stage
+        :return:
+        """
+        with self._setup_lock:
+            for writer in self._shard_writers.values():
+                writer.close()
+            self._shard_writers = {}
+
+    def write_artifact(self, filename: str, kind: str, serialized: bytes):
+        """
+        saves a derived file into the shards, or as a file next to its .mxl file if c.SHARDS is off,
+        and records it in the manifest
+        :param filename: name of the (complete) filepath of the source or a derived file
+        :param kind: one of the *_ARTIFACT suffixes of preprocessing.manifest
+        :param serialized:
+        :return:
+        """
+        if c.SHARDS:
+            self.shard_writer(kind).append(self.manifest.source_path(filename), serialized)
+            return
+
+        # a file that is already there was made from an older version of the source or with other settings
+        with open(self.manifest.artifact_path(filename, kind), 'wb') as fp:
+            fp.write(serialized)
+
+        self.manifest.add_artifact(filename, kind)
+
+    def read_artifact(self, filename: str, kind: str) -> bytes:
+        """
+        reads a derived file from the shards, or from the file next to its .mxl file,
+        e.g. if it was written before the shards were used
+        :param filename: name of the (complete) filepath of the source or a derived file
+        :param kind:
+        :return:
+        """
+        if c.SHARDS:
+            serialized = self.shard_reader(kind).get(self.manifest.source_path(filename))
+            if serialized is not None:
+                return serialized
+
+        with open(self.manifest.artifact_path(filename, kind), 'rb') as fp:
+            return fp.read()
+
+    @property
+    def music_protocol_buffer(self) -> music_info.MusicList:
+        if self._music_protocol_buffer is None:
+            self._load_music_list()
+        return self._music_protocol_buffer
+
+    @property
+    def music_list_store(self) -> MusicListStore:
+        if self._music_list_store is None:
+            self._load_music_list()
+        return self._music_list_store
+
+    @property
+    def music_data_index(self) -> dict:
+        """
+        maps the relative filepath of every piece in the MusicList to its PieceOfMusic entry
+        :return:
+        """
+        if self._music_data_index is None:
+            self._load_music_list()
+        return self._music_data_index
+
+    @property
+    def mxl_work_queue(self) -> queue.Queue:
+        if self._mxl_work_queue is None:
+            self._scan_corpus()
+        return self._mxl_work_queue
+
+    @property
+    def proto_buffer_work_queue(self) -> queue.Queue:
+        if self._proto_buffer_work_queue is None:
+            self._scan_corpus()
+        return self._proto_buffer_work_queue
+
+    @property
+    def melody_work_queue(self) -> queue.Queue:
+        if self._melody_work_queue is None:
+            self._scan_corpus()
+        return self._melody_work_queue
+
+    def _load_music_list(self):
+        """
+        loads the MusicList of the current settings from its store, or creates an empty one if it doesn't exist yet
+        :return:
+        """
+        with self._setup_lock:
+            if self._music_protocol_buffer is not None:
+                return
+
+            c.make_folders()
+
+            self._music_list_store = MusicListStore()
+            music_protocol_buffer = self._music_list_store.load()
+
+            music_data_index = {}
+            for f in music_protocol_buffer.music_data:
+                music_data_index[f.filepath] = f
+
+            self._music_data_index = music_data_index
+            self._music_protocol_buffer = music_protocol_buffer
+
+    def _forget_pieces(self, filepaths: [str]):
+        """
+        deletes the entries of some files from the MusicList of the current settings and writes it
+        :param filepaths: relative filepaths
+        :return:
+        """
+        filepaths = [f for f in filepaths if f in self.music_data_index]
+        if not filepaths:
+            return
+
+        with c.music_info_dict_lock:
+            for f in filepaths:
+                self.music_protocol_buffer.music_data.remove(self.music_data_index.pop(f))
+
+        # the journal can only add and replace entries
+        self.music_list_store.compact()
+
+    def _scan_corpus(self):
+        """
+        fills all three work queues from the manifest, after adding new and changed files to it (only their
+        modification times are compared, see Manifest.update). The MusicList entries of source files whose content
+        changed are deleted. The derived files of the files that are valid in the MusicList of the current settings
+        are recorded as made with them, the invalid ones as invalid, so that they aren't pending anymore
+        :return:
+        """
+        with self._setup_lock:
+            if self._mxl_work_queue is not None:
+                return
+
+            self._forget_pieces(self.manifest.update())
+
+            music_data = self.music_protocol_buffer.music_data
+            self.manifest.adopt_artifacts([piece.filepath for piece in music_data if piece.valid])
+            self.manifest.add_invalid([piece.filepath for piece in music_data if not piece.valid])
+
+            mxl_work_queue = queue.Queue(0)
+            proto_buffer_work_queue = queue.Queue(0)
+            melody_work_queue = queue.Queue(0)
+
+            for filename in self.manifest.pending(PB_ARTIFACT):
+                mxl_work_queue.put(filename)
+
+            for filename in self.manifest.pending([MELODY_ARTIFACTS[a] for a in self.melody_algorithms],
+                                                  requires=PB_ARTIFACT):
+                proto_buffer_work_queue.put(filename)
+
+            # take for every song only one version into account!
+            for filename in self.manifest.done_per_song(TF_SKYLINE_ARTIFACT):
+                melody_work_queue.put(filename)
+
+            self.mxl_files_to_do = mxl_work_queue.qsize()
+            self.proto_buffers_to_do = proto_buffer_work_queue.qsize()
+            self.melodies_to_do = melody_work_queue.qsize()
+
+            self._proto_buffer_work_queue = proto_buffer_work_queue
+            self._melody_work_queue = melody_work_queue
+            self._mxl_work_queue = mxl_work_queue
+
+
+context = Context()
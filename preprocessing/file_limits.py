@@ -0,0 +1,90 @@
+import os
+import resource
+import signal
+import time
+
+import settings.constants as c
+from preprocessing.helper import FileLimitExceededError
+
+
+def resident_memory() -> int:
+    """
+    :return: the current resident set size of this process in bytes
+    """
+    try:
+        with open('/proc/self/statm') as fp:
+            return int(fp.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        # no procfs, the peak is the best there is (kilobytes on linux, bytes on macOS)
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def limit_address_space(memory_limit: int = c.FILE_MEMORY_LIMIT):
+    """
+    lets the allocations of this process fail (with a MemoryError in Python) once its address space has grown by
+    more than memory_limit bytes. Unlike FileLimits, this also stops memory that is allocated in C code.
+    Meant as initializer of the worker processes of make_data_from_mxl_archive
+    :param memory_limit: bytes, None for no limit
+    :return:
+    """
+    if memory_limit is None:
+        return
+
+    try:
+        with open('/proc/self/statm') as fp:
+            address_space = int(fp.read().split()[0]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        # without procfs the growth can't be measured, so leave the address space alone
+        return
+
+    _, hard_limit = resource.getrlimit(resource.RLIMIT_AS)
+    soft_limit = address_space + memory_limit
+    if hard_limit != resource.RLIM_INFINITY:
+        soft_limit = min(soft_limit, hard_limit)
+    resource.setrlimit(resource.RLIMIT_AS, (soft_limit, hard_limit))
+
+
+class FileLimits:
+    """
+    a watchdog for a single file. While it is entered, a timer checks the wall clock time and the growth of the
+    resident memory every interval seconds, and raises a FileLimitExceededError in the code that is running,
+    once one of the limits is exceeded. It works with signals, so it can only be used in the main thread
+    of a process, i.e. in the worker processes of make_data_from_mxl_archive.
+    The exception is raised again every interval until the file is given up, in case some code swallows it.
+    It can't interrupt C code, so the parent of the workers enforces the limits as well
+    (see limit_address_space and make_data_from_mxl_archive.run_in_processes)
+    """
+
+    def __init__(self, time_limit: float = c.FILE_TIME_LIMIT, memory_limit: int = c.FILE_MEMORY_LIMIT,
+                 interval: float = 0.5):
+        """
+        :param time_limit: seconds, None for no limit
+        :param memory_limit: bytes the resident memory may grow by, None for no limit
+        :param interval: seconds between two checks
+        """
+        self.time_limit = time_limit
+        self.memory_limit = memory_limit
+        self.interval = interval
+
+        self._start_time = None
+        self._start_memory = None
+        self._old_handler = None
+
+    def __enter__(self):
+        self._start_time = time.monotonic()
+        self._start_memory = resident_memory()
+        self._old_handler = signal.signal(signal.SIGALRM, self._check)
+        signal.setitimer(signal.ITIMER_REAL, self.interval, self.interval)
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, self._old_handler)
+        return False
+
+    def _check(self, signum, frame):
+        if self.time_limit is not None and time.monotonic() - self._start_time > self.time_limit:
+            raise FileLimitExceededError("TIMEOUT")
+
+        if self.memory_limit is not None and resident_memory() - self._start_memory > self.memory_limit:
+            raise FileLimitExceededError("MEMORY_LIMIT")
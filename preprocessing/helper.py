@@ -1,3 +1,6 @@
+import numpy as np
+
+
 def round_to_quarter(value):
     """
     rounds, for example offsets, lengths of notes
@@ -7,9 +10,79 @@ def round_to_quarter(value):
     return round(value * 4) / 4
 
 
+def round_to_quarter_array(values) -> np.ndarray:
+    """
+    round_to_quarter for a whole array of floats. numpy rounds half to even like python's round,
+    so every value is exactly the same
+    :param values:
+    :return:
+    """
+    return np.round(np.asarray(values, dtype=np.float64) * 4) / 4
+
+
 class FileNotFittingSettingsError(BaseException):
     """
     utility class for error logging and information gain
     """
     def __init__(self, *args):
         super().__init__(*args)
+
+
+class FileLimitExceededError(FileNotFittingSettingsError):
+    """
+    raised when a single file takes too long or too much memory, with "TIMEOUT" or "MEMORY_LIMIT" as message.
+    It is a BaseException like its parent, so that it isn't swallowed by the "except Exception" inside music21
+    """
+    pass
+
+
+def encode_varint(value: int) -> bytes:
+    """
+    encodes a non-negative integer the way protocol buffers do (base 128, least significant group first)
+    :param value:
+    :return:
+    """
+    result = bytearray()
+    while value > 0x7f:
+        result.append((value & 0x7f) | 0x80)
+        value >>= 7
+    result.append(value)
+    return bytes(result)
+
+
+def decode_varint(buffer, position: int) -> (int, int):
+    """
+    decodes a varint starting at position
+    :param buffer: bytes or memoryview
+    :param position:
+    :return: the value and the position right after it
+    :raises IndexError: if the buffer ends inside the varint
+    """
+    result = 0
+    shift = 0
+    while True:
+        byte = buffer[position]
+        position += 1
+        result |= (byte & 0x7f) << shift
+        if not byte & 0x80:
+            return result, position
+        shift += 7
+
+
+def iter_delimited(buffer):
+    """
+    iterates over length-delimited records (varint length followed by the record).
+    A truncated record at the end, e.g. from a crash while writing, is left out
+    :param buffer: bytes or memoryview
+    :return: tuples of the record and the position right after it
+    """
+    position = 0
+    while position < len(buffer):
+        try:
+            length, start = decode_varint(buffer, position)
+        except IndexError:
+            return
+        if start + length > len(buffer):
+            return
+        position = start + length
+        yield buffer[start:position], position
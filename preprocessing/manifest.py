@@ -0,0 +1,302 @@
+#!/usr/bin/env python3
+
+import hashlib
+import os
+import sqlite3
+import threading
+
+import settings.constants as c
+import settings.music_info_pb2 as music_info
+from preprocessing.shards import ShardReader, shard_folder
+
+# suffixes of the files derived from a .mxl file. They replace the '.mxl' ending
+# of the source file, e.g. song.mxl -> song.pb -> song_tf_skyline.melody_pb
+PB_ARTIFACT = '.pb'
+TF_SKYLINE_ARTIFACT = '_tf_skyline.melody_pb'
+SKYLINE_SIMPLE_ARTIFACT = '_skyline_simple.melody_pb'
+SKYLINE_ADVANCED_ARTIFACT = '_skyline_advanced.melody_pb'
+
+# the MelodyList of every music_info.MelodyAlgorithm is a derived file of its own
+MELODY_ARTIFACTS = {music_info.SKYLINE_SIMPLE: SKYLINE_SIMPLE_ARTIFACT,
+                    music_info.SKYLINE_ADVANCED: SKYLINE_ADVANCED_ARTIFACT,
+                    music_info.TF_SKYLINE: TF_SKYLINE_ARTIFACT}
+
+# not a derived file, but recorded like one for the source files that are invalid (with the reason in their
+# MusicList entry) under the settings, so that they aren't pending anymore
+INVALID_ARTIFACT = '.invalid'
+
+# recorded instead of a derived file if there is nothing to write for a source file, e.g. no melodies.
+# It counts as the derived file in has_artifact and pending, but done_per_song leaves it out
+EMPTY_SUFFIX = '.empty'
+
+# all kinds of derived files by the names the command line tools use for them
+ARTIFACT_KINDS = {'pb': PB_ARTIFACT, 'tf_skyline': TF_SKYLINE_ARTIFACT, 'skyline_simple': SKYLINE_SIMPLE_ARTIFACT,
+                  'skyline_advanced': SKYLINE_ADVANCED_ARTIFACT}
+
+
+def empty_artifact(kind: str) -> str:
+    """
+    :param kind: one of the *_ARTIFACT suffixes
+    :return: the kind recorded for a derived file of this kind that would be empty
+    """
+    return kind + EMPTY_SUFFIX
+
+
+def file_hash(filename: str) -> str:
+    """
+    calculates the sha1 hash of the content of a file
+    :param filename: name of the (complete) filepath
+    :return: the hex digest of the hash
+    """
+    sha = hashlib.sha1()
+    with open(filename, 'rb') as fp:
+        for block in iter(lambda: fp.read(1 << 20), b''):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+class Manifest:
+    """
+    a persistent index of the corpus, saved as SQLite database. It knows every source file
+    (.mxl) with size, modification time and content hash, and which derived files exist
+    for it, so that the work queues can be filled by a query instead of walking the data folder.
+    All file paths are relative to settings.constants.MXL_DATA_FOLDER, like in the MusicList.
+    There is one derived file of a kind for every source file, whatever the settings, so every artifact
+    records the settings filename it was made with, and only counts as done for these settings. Artifacts
+    that update() finds without knowing their settings have the settings '' and don't count as done until
+    adopt_artifacts gives them their settings. When the content of a source file changes, all of its artifacts
+    are forgotten
+    """
+
+    def __init__(self, location: str = c.MANIFEST_LOCATION, data_folder: str = c.MXL_DATA_FOLDER):
+        self.data_folder = data_folder
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(location, check_same_thread=False)
+
+        with self._lock, self._connection:
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute("CREATE TABLE IF NOT EXISTS sources ("
+                                     "filepath TEXT PRIMARY KEY, song TEXT NOT NULL, "
+                                     "size INTEGER NOT NULL, mtime REAL NOT NULL, hash TEXT NOT NULL)")
+            self._connection.execute("CREATE TABLE IF NOT EXISTS artifacts ("
+                                     "filepath TEXT NOT NULL, kind TEXT NOT NULL, settings TEXT NOT NULL, "
+                                     "PRIMARY KEY (filepath, kind))")
+            self._connection.execute("CREATE INDEX IF NOT EXISTS artifacts_kind ON artifacts (kind, filepath)")
+
+    def relative_path(self, filename: str) -> str:
+        """
+        turns a complete filepath into the relative one used as key in the manifest
+        :param filename:
+        :return:
+        """
+        if os.path.isabs(filename):
+            return os.path.relpath(filename, self.data_folder)
+        return filename
+
+    def source_path(self, filename: str) -> str:
+        """
+        the relative path of the .mxl file a (complete or relative) path belongs to
+        :param filename: path of a source file or of one of its derived files
+        :return:
+        """
+        relative_filename = self.relative_path(filename)
+        for suffix in ARTIFACT_KINDS.values():
+            if relative_filename.endswith(suffix):
+                return relative_filename[:-len(suffix)] + '.mxl'
+        return relative_filename
+
+    def artifact_path(self, filename: str, kind: str) -> str:
+        """
+        :param filename: path of a source file or of one of its derived files
+        :param kind: one of the *_ARTIFACT suffixes
+        :return: the complete filepath of the derived file of this kind, when it is saved next to the source file
+        """
+        return self._full_path(self.source_path(filename), kind)
+
+    def is_empty(self) -> bool:
+        with self._lock:
+            return self._connection.execute("SELECT 1 FROM sources LIMIT 1").fetchone() is None
+
+    def update(self) -> [str]:
+        """
+        walks the data folder and adds all new or changed source files and all derived files found there
+        or in the shards. Unchanged source files (same size and modification time) aren't hashed again.
+        The artifacts of source files with a new content hash are deleted, and their derived files found now
+        are left out, since they were made from the old content
+        :return: the relative paths of the source files whose content changed
+        """
+        with self._lock:
+            known = {filepath: (size, mtime, hash_) for filepath, size, mtime, hash_
+                     in self._connection.execute("SELECT filepath, size, mtime, hash FROM sources")}
+
+        sources = []
+        changed = []
+        artifacts = []
+
+        for root, dirs, files in os.walk(self.data_folder):
+            for file in files:
+                filename = os.path.join(root, file)
+                if file.endswith('.mxl'):
+                    relative_filename = self.relative_path(filename)
+                    stat = os.stat(filename)
+                    old = known.get(relative_filename)
+                    if old is not None and old[:2] == (stat.st_size, stat.st_mtime):
+                        continue
+                    sources.append((relative_filename, os.path.dirname(relative_filename),
+                                    stat.st_size, stat.st_mtime, file_hash(filename)))
+                    if old is not None and old[2] != sources[-1][4]:
+                        changed.append(relative_filename)
+                else:
+                    for kind in ARTIFACT_KINDS.values():
+                        if file.endswith(kind):
+                            artifacts.append((self.source_path(filename), kind, ''))
+                            break
+
+        for kind in ARTIFACT_KINDS.values():
+            shard_reader = ShardReader(shard_folder(kind))
+            artifacts.extend((key, kind, '') for key in shard_reader.keys())
+            shard_reader.close()
+
+        changed_set = set(changed)
+        artifacts = [a for a in artifacts if a[0] not in changed_set]
+
+        with self._lock, self._connection:
+            self._connection.executemany("INSERT OR REPLACE INTO sources VALUES (?, ?, ?, ?, ?)", sources)
+            self._connection.executemany("DELETE FROM artifacts WHERE filepath = ?", [(f,) for f in changed])
+            self._connection.executemany("INSERT OR IGNORE INTO artifacts VALUES (?, ?, ?)", artifacts)
+
+        return changed
+
+    def add_source(self, filename: str):
+        """
+        adds a single new or changed source file without walking the data folder
+        :param filename: name of the (complete) filepath
+        :return:
+        """
+        relative_filename = self.relative_path(filename)
+        full_filename = os.path.join(self.data_folder, relative_filename)
+        stat = os.stat(full_filename)
+        new_hash = file_hash(full_filename)
+
+        with self._lock, self._connection:
+            row = self._connection.execute("SELECT hash FROM sources WHERE filepath = ?",
+                                           (relative_filename,)).fetchone()
+            self._connection.execute("INSERT OR REPLACE INTO sources VALUES (?, ?, ?, ?, ?)",
+                                     (relative_filename, os.path.dirname(relative_filename),
+                                      stat.st_size, stat.st_mtime, new_hash))
+            if row is not None and row[0] != new_hash:
+                self._connection.execute("DELETE FROM artifacts WHERE filepath = ?", (relative_filename,))
+
+    def add_artifact(self, filename: str, kind: str, settings: str = c.settings_filename):
+        """
+        records that a derived file of the given kind was written
+        :param filename: path of the source file or of the derived file
+        :param kind: one of the *_ARTIFACT suffixes
+        :param settings: the settings filename the derived file was made with
+        :return:
+        """
+        with self._lock, self._connection:
+            self._connection.execute("INSERT OR REPLACE INTO artifacts VALUES (?, ?, ?)",
+                                     (self.source_path(filename), kind, settings))
+
+    def add_invalid(self, filenames: [str], settings: str = c.settings_filename):
+        """
+        records that source files are invalid under the settings
+        :param filenames: paths of the source files
+        :param settings:
+        :return:
+        """
+        with self._lock, self._connection:
+            self._connection.executemany("INSERT OR REPLACE INTO artifacts VALUES (?, ?, ?)",
+                                         [(self.source_path(f), INVALID_ARTIFACT, settings) for f in filenames])
+
+    def adopt_artifacts(self, filenames: [str], settings: str = c.settings_filename):
+        """
+        records that the derived files update() found for these source files, without knowing their settings,
+        were made with the settings. E.g. for the files with a valid entry in the MusicList of the settings
+        :param filenames: paths of the source files
+        :param settings:
+        :return:
+        """
+        with self._lock, self._connection:
+            self._connection.executemany("UPDATE artifacts SET settings = ? WHERE filepath = ? AND settings = ''",
+                                         [(settings, self.source_path(f)) for f in filenames])
+
+    def has_artifact(self, filename: str, kind: str, settings: str = c.settings_filename) -> bool:
+        """
+        :param filename: path of the source file or of one of its derived files
+        :param kind: one of the *_ARTIFACT suffixes
+        :param settings:
+        :return: if the derived file of this kind was made with the settings, or recorded as empty
+        """
+        with self._lock:
+            return self._connection.execute("SELECT 1 FROM artifacts WHERE filepath = ? AND kind IN (?, ?) "
+                                            "AND settings = ?",
+                                            (self.source_path(filename), kind, empty_artifact(kind),
+                                             settings)).fetchone() is not None
+
+    def source_hash(self, filename: str):
+        with self._lock:
+            row = self._connection.execute("SELECT hash FROM sources WHERE filepath = ?",
+                                           (self.source_path(filename),)).fetchone()
+        return row[0] if row else None
+
+    def pending(self, kind, requires: str = None, settings: str = c.settings_filename) -> [str]:
+        """
+        all valid source files that don't have a derived file of the given kind for the settings yet
+        (or one recorded as empty)
+        :param kind: the derived file that is missing, or a list of kinds of which at least one is missing
+        :param requires: optionally a kind of derived file that must already exist
+        :param settings:
+        :return: complete filepaths of the files the job works on, i.e. the derived file of kind requires
+                 or the source file itself
+        """
+        kinds = [kind] if isinstance(kind, str) else list(kind)
+        parameters = {'kind{i}'.format(i=i): k for i, k in enumerate(kinds)}
+        parameters.update({'empty{i}'.format(i=i): empty_artifact(k) for i, k in enumerate(kinds)})
+        parameters.update(requires=requires, number=len(kinds), settings=settings, invalid=INVALID_ARTIFACT,
+                          empty=EMPTY_SUFFIX)
+
+        query = "SELECT s.filepath FROM sources s "
+        if requires:
+            query += ("JOIN artifacts r ON r.filepath = s.filepath AND r.kind = :requires "
+                      "AND r.settings = :settings ")
+        query += ("LEFT JOIN artifacts a ON a.filepath = s.filepath AND a.kind IN ({k}) "
+                  "AND a.settings = :settings "
+                  "WHERE NOT EXISTS (SELECT 1 FROM artifacts i WHERE i.filepath = s.filepath AND i.kind = :invalid "
+                  "AND i.settings = :settings) "
+                  "GROUP BY s.filepath HAVING COUNT(DISTINCT REPLACE(a.kind, :empty, '')) < :number "
+                  "ORDER BY s.filepath").format(
+            k=", ".join(':kind{i}, :empty{i}'.format(i=i) for i in range(len(kinds))))
+
+        with self._lock:
+            rows = self._connection.execute(query, parameters).fetchall()
+
+        return [self._full_path(filepath, requires) for filepath, in rows]
+
+    def done_per_song(self, kind: str, settings: str = c.settings_filename) -> [str]:
+        """
+        for every song (directory) one source file that has a derived file of the given kind for the settings
+        :param kind:
+        :param settings:
+        :return: complete filepaths of the derived files
+        """
+        with self._lock:
+            rows = self._connection.execute("SELECT MIN(s.filepath) FROM sources s "
+                                            "JOIN artifacts a ON a.filepath = s.filepath AND a.kind = ? "
+                                            "AND a.settings = ? "
+                                            "GROUP BY s.song ORDER BY s.song", (kind, settings)).fetchall()
+
+        return [self._full_path(filepath, kind) for filepath, in rows]
+
+    def _full_path(self, relative_filename: str, kind: str = None) -> str:
+        full_filename = os.path.join(self.data_folder, relative_filename)
+        if kind:
+            full_filename = full_filename[:-len('.mxl')] + kind
+        return full_filename
+
+
+if __name__ == '__main__':
+    c.make_folders()
+    manifest = Manifest()
+    print("{n} source files changed".format(n=len(manifest.update())))
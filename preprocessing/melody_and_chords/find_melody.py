@@ -1,19 +1,24 @@
-from copy import deepcopy
-from statistics import mean, stdev
+import math
+from fractions import Fraction
+
+import numpy as np
 
 import music_utils.simple_classes as simple
 import settings.constants as c
+import settings.music_info_pb2 as music_info
 
 
 def simple_skyline_algorithm_from_simple(song_or_part_or_parts_list,
                                          split: bool, max_rest: float = 4.0,
-                                         min_melody_length: float = 16.0) -> [(float, simple.NoteList)]:
+                                         min_melody_length: float = 16.0,
+                                         engine: str = None) -> [(float, simple.NoteList)]:
     """
     a simple skyline algorithm, as described in the paper
     :param song_or_part_or_parts_list:
     :param split:
     :param max_rest:
     :param min_melody_length:
+    :param engine: one of SKYLINE_ENGINES, c.SKYLINE_ENGINE if None
     :return:
     """
     if type(song_or_part_or_parts_list) == simple.Part or \
@@ -21,20 +26,21 @@ def simple_skyline_algorithm_from_simple(song_or_part_or_parts_list,
         notes = song_or_part_or_parts_list.notes()
 
     elif type(song_or_part_or_parts_list) == list:
-        notes = simple.NoteList()
+        note_lists = []
         for part_or_song in song_or_part_or_parts_list:
             assert type(part_or_song) == simple.Part or type(part_or_song) == simple.Song or \
                    type(part_or_song) == simple.NoteList
 
             if type(part_or_song) == simple.NoteList:
-                notes.extend(deepcopy(part_or_song))
+                note_lists.append(part_or_song)
             else:
-                notes.extend(part_or_song.notes())
+                note_lists.append(part_or_song.notes())
 
-        notes.sort()
+        # all of them are sorted already
+        notes = simple.NoteList.merge(note_lists)
 
     elif type(song_or_part_or_parts_list) == simple.NoteList:
-        notes = deepcopy(song_or_part_or_parts_list)
+        notes = song_or_part_or_parts_list.copy()
 
     else:
         raise ValueError("Type {t} doesn't fit, must be either simple.Part, simple.Song,"
@@ -42,6 +48,23 @@ def simple_skyline_algorithm_from_simple(song_or_part_or_parts_list,
 
     assert type(notes) == simple.NoteList
 
+    melody = SKYLINE_ENGINES[engine or c.SKYLINE_ENGINE](notes)
+
+    assert is_sequence(melody)
+
+    if not split:
+        return [(0.0, melody)]
+
+    return make_full_sub_melodies(melody, max_rest=max_rest,
+                                  min_melody_length=min_melody_length)
+
+
+def skyline_loop(notes: simple.NoteList) -> simple.NoteList:
+    """
+    the skyline algorithm, one note after the other
+    :param notes: sorted
+    :return: the melody
+    """
     current_note = None
     current_end = -1
 
@@ -70,72 +93,313 @@ def simple_skyline_algorithm_from_simple(song_or_part_or_parts_list,
         elif pitch > current_note.pitch or (note.offset > current_note.offset and
                                             note.part == current_note.part):
             if note.offset - current_note.offset > 0:
-                current_note.length = note.offset - current_note.offset
+                # shortened in the melody, notes stays unchanged (and isn't copied)
                 melody.append(current_note)
+                melody[-1].length = note.offset - current_note.offset
             current_note = note
             current_end = note.end()
 
     if current_note is not None:
         melody.append(current_note)
 
-    assert is_sequence(melody)
+    return melody
 
-    if not split:
-        return [(0.0, melody)]
 
-    return make_full_sub_melodies(melody, max_rest=max_rest,
-                                  min_melody_length=min_melody_length)
+def skyline_arrays(notes: simple.NoteList) -> simple.NoteList:
+    """
+    the same as skyline_loop, on the note columns, see skyline_arrays_batch
+    :param notes: sorted
+    :return: the melody
+    """
+    return skyline_arrays_batch([notes])[0]
+
+
+def skyline_arrays_batch(note_lists: [simple.NoteList]) -> [simple.NoteList]:
+    """
+    skyline_loop on many note lists at once. Of the notes starting at the same offset (an onset), the loop
+    keeps the first note it accepts and then every following one that is higher than the kept one, so it ends
+    with the first highest note from the accepted one on. That note is found for every possible start of all note
+    lists in one segmented reduction. What is left is a pass over the onsets, which only has to find the first note
+    the current melody note lets through (usually the first note of the onset)
+    :param note_lists: each one sorted
+    :return: the melodies, in the order of note_lists
+    """
+    melodies = [None] * len(note_lists)
+
+    # the onsets only work for notes sorted by offset, and the loop keeps zero length notes in a different way
+    batch = []
+    for i, notes in enumerate(note_lists):
+        data = notes.array
+        if len(data) >= 2 ** 24 or not ((data['length'] > 0).all() and (data['offset'] >= 0).all() and
+                                        (data['offset'][1:] >= data['offset'][:-1]).all()):
+            melodies[i] = skyline_loop(notes)
+        else:
+            batch.append(i)
+
+    # the keys of the reduction have to fit into 64 bits
+    chunk = []
+    chunk_size = 0
+    for i in batch + [None]:
+        if i is None or chunk_size + len(note_lists[i]) >= 2 ** 24:
+            if chunk:
+                chunk_melodies = _skyline_segments([note_lists[j].array for j in chunk])
+                for j, melody in zip(chunk, chunk_melodies):
+                    melodies[j] = simple.NoteList.from_array(melody)
+            chunk = []
+            chunk_size = 0
+        if i is not None:
+            chunk.append(i)
+            chunk_size += len(note_lists[i])
+
+    return melodies
+
+
+def _skyline_segments(arrays: [np.ndarray]) -> [np.ndarray]:
+    """
+    the melodies of note arrays that fulfill the conditions of skyline_arrays_batch
+    :param arrays: NOTE_DTYPE arrays, less than 2 ** 24 notes together
+    :return: the melodies as NOTE_DTYPE arrays
+    """
+    data = np.concatenate(arrays)
+    segments = np.repeat(np.arange(len(arrays)), [len(a) for a in arrays])
+
+    # just allow pitches in the specified range, which also removes the rests
+    in_range = (c.music_settings.min_pitch <= data['pitch']) & (data['pitch'] <= c.music_settings.max_pitch)
+    data = data[in_range]
+    segments = segments[in_range]
+    number = len(data)
+    if not number:
+        return [data[:0] for _ in arrays]
+
+    offsets = data['offset']
+    pitches = data['pitch']
+
+    # every note list starts a new onset, even if its first offset is the last one of the note list before
+    is_start = np.ones(number, dtype=bool)
+    is_start[1:] = (offsets[1:] != offsets[:-1]) | (segments[1:] != segments[:-1])
+    starts = np.flatnonzero(is_start)
+    onsets = np.cumsum(is_start) - 1
+
+    # highest pitch, then lowest index from every note to the end of its onset: a running maximum from
+    # the back, where the onset is the most significant part of the key, so that it starts again at every onset
+    index_bits = number.bit_length()
+    pitch_bits = int(pitches.max() - pitches.min()).bit_length()
+    key = ((len(starts) - 1 - onsets) << (pitch_bits + index_bits)) | \
+          ((pitches - pitches.min()) << index_bits) | (number - 1 - np.arange(number))
+    highest = (number - 1 - (np.maximum.accumulate(key[::-1])[::-1] & ((1 << index_bits) - 1))).tolist()
+
+    offset_list = offsets.tolist()
+    length_list = data['length'].tolist()
+    end_list = (offsets + data['length']).tolist()
+    pitch_list = pitches.tolist()
+    part_list = data['part'].tolist()
+    start_list = starts.tolist() + [number]
+
+    # the onsets of every note list
+    onset_bounds = np.searchsorted(segments[starts], np.arange(len(arrays) + 1)).tolist()
+
+    melody_indices = []
+    melody_lengths = []
+    melody_sizes = []
+
+    for first_onset, last_onset in zip(onset_bounds[:-1], onset_bounds[1:]):
+        if first_onset == last_onset:
+            melody_sizes.append(0)
+            continue
+
+        current = -1
+        current_pitch = current_part = current_end = None
+        for onset in range(first_onset, last_onset):
+            start = start_list[onset]
+            end = start_list[onset + 1]
+            offset = offset_list[start]
+
+            if current < 0:
+                first = start
+            else:
+                # no jumps down greater than an octave!
+                lowest = current_pitch - 12
+                first = -1
+                if current_end <= offset:
+                    for i in range(start, end):
+                        if pitch_list[i] >= lowest:
+                            first = i
+                            break
+                    if first >= 0:
+                        melody_lengths.append(length_list[current])
+                else:
+                    for i in range(start, end):
+                        if pitch_list[i] >= lowest and (pitch_list[i] > current_pitch or
+                                                        part_list[i] == current_part):
+                            first = i
+                            break
+                    if first >= 0:
+                        melody_lengths.append(offset - offset_list[current])
+
+                if first < 0:
+                    continue
+                melody_indices.append(current)
+
+            current = highest[first]
+            current_pitch = pitch_list[current]
+            current_part = part_list[current]
+            current_end = end_list[current]
+
+        melody_indices.append(current)
+        melody_lengths.append(length_list[current])
+        melody_sizes.append(len(melody_indices) - sum(melody_sizes))
+
+    melody = data[melody_indices]
+    melody['length'] = melody_lengths
+    return np.split(melody, np.cumsum(melody_sizes)[:-1])
+
+
+def skyline_batch(note_lists: [simple.NoteList], engine: str = None) -> [simple.NoteList]:
+    """
+    the melodies of many note lists with one of the SKYLINE_ENGINES, 'arrays' handles all of them at once
+    :param note_lists: each one sorted
+    :param engine: c.SKYLINE_ENGINE if None
+    :return: the melodies, in the order of note_lists
+    """
+    engine = engine or c.SKYLINE_ENGINE
+    if engine == 'arrays':
+        return skyline_arrays_batch(note_lists)
+
+    return [SKYLINE_ENGINES[engine](notes) for notes in note_lists]
+
+
+SKYLINE_ENGINES = {'loop': skyline_loop, 'arrays': skyline_arrays}
 
 
 def tf_skyline(song: simple.Song, split: bool,
-               max_rest: float = 4.0, max_melody_length: float = 16.0) -> [(float, simple.NoteList)]:
+               max_rest: float = 4.0, max_melody_length: float = 16.0,
+               engine: str = None) -> [(float, simple.NoteList)]:
     """
-    an upgrade to skyline algorithm discarding improbable parts
+    an upgrade to skyline algorithm discarding improbable parts, see tf_skyline_batch
     :param song:
     :param split:
     :param max_rest:
     :param max_melody_length:
+    :param engine: of the skyline algorithm, one of SKYLINE_ENGINES, c.SKYLINE_ENGINE if None
     :return:
     """
-    parts = []
-    average_volumes = []
-    average_pitches = []
-    all_notes = []
+    return tf_skyline_batch([song], split, max_rest, max_melody_length, engine)[0]
+
+
+def tf_skyline_batch(songs: [simple.Song], split: bool,
+                     max_rest: float = 4.0, max_melody_length: float = 16.0,
+                     engine: str = None) -> [[(float, simple.NoteList)]]:
+    """
+    tf_skyline on many songs: runs the skyline algorithm once on every part of every song, keeps the parts of a
+    song with a high average volume or pitch (compared to all the part melodies of the song) and runs it again on
+    the kept parts of every song. Both skyline runs go over all songs at once
+    :param songs:
+    :param split:
+    :param max_rest:
+    :param max_melody_length:
+    :param engine: of the skyline algorithm, one of SKYLINE_ENGINES, c.SKYLINE_ENGINE if None
+    :return: for every song what tf_skyline returns
+    """
+    part_notes = [part.notes() for song in songs for part in song.parts]
+    part_melodies = skyline_batch(part_notes, engine)
+
+    melodies_of_songs = []
+    kept_songs = []
+    start = 0
+    for song in songs:
+        parts = [melody for melody in part_melodies[start:start + len(song.parts)] if len(melody) > 0]
+        start += len(song.parts)
+
+        probable_melody_parts = probable_melody_parts_of(parts, max_melody_length)
+        if probable_melody_parts is None:
+            melodies_of_songs.append(None)
+        else:
+            kept_songs.append(len(melodies_of_songs))
+            melodies_of_songs.append(simple.NoteList.merge(probable_melody_parts))
+
+    melodies = skyline_batch([melodies_of_songs[i] for i in kept_songs], engine)
+
+    for i, melody in zip(kept_songs, melodies):
+        assert is_sequence(melody)
+
+        if not split:
+            melodies_of_songs[i] = [(0.0, melody)]
+        else:
+            melodies_of_songs[i] = make_full_sub_melodies(melody, max_rest=max_rest,
+                                                          min_melody_length=max_melody_length)
+
+    return melodies_of_songs
+
+
+def simple_skyline_batch(songs: [simple.Song], split: bool,
+                          max_rest: float = 4.0, min_melody_length: float = 16.0,
+                          engine: str = None) -> [[(float, simple.NoteList)]]:
+    """
+    simple_skyline_algorithm_from_simple on many songs, with one skyline run over all of them
+    :param songs:
+    :param split:
+    :param max_rest:
+    :param min_melody_length:
+    :param engine: of the skyline algorithm, one of SKYLINE_ENGINES, c.SKYLINE_ENGINE if None
+    :return: for every song what simple_skyline_algorithm_from_simple returns
+    """
+    melodies_of_songs = []
+    for melody in skyline_batch([song.notes() for song in songs], engine):
+        assert is_sequence(melody)
+
+        if not split:
+            melodies_of_songs.append([(0.0, melody)])
+        else:
+            melodies_of_songs.append(make_full_sub_melodies(melody, max_rest=max_rest,
+                                                            min_melody_length=min_melody_length))
 
-    for part in song.parts:
-        temp_part_notes = simple_skyline_algorithm_from_simple(part, split=False)[0][1]
-        if len(temp_part_notes) > 0:
-            parts.append(simple_skyline_algorithm_from_simple(part, split=False)[0][1])
+    return melodies_of_songs
 
-    for i, part in enumerate(parts):
+
+# the melody extractors of the music_info.MelodyAlgorithms, all of them called as extract(songs, split) and
+# returning for every song its melodies with their starts (or None), see tf_skyline.
+# preprocessing.melody_and_chords.make_tf_melody runs the ones in c.MELODY_ALGORITHMS on every song
+MELODY_EXTRACTORS = {music_info.SKYLINE_SIMPLE: simple_skyline_batch,
+                     music_info.TF_SKYLINE: tf_skyline_batch}
+
+
+def probable_melody_parts_of(parts: [simple.NoteList], max_melody_length: float = 16.0) -> [simple.NoteList]:
+    """
+    the parts with an average volume or pitch of at least the mean minus the standard deviation of all their notes
+    :param parts: the skyline melodies of the parts of a song, none of them empty
+    :param max_melody_length:
+    :return: the probable melody parts, None if there are too few notes
+    """
+    for part in parts:
         assert is_sequence(part)
-        part: simple.NoteList
-        average_volumes.append(mean([note.volume for note in part]))
-        average_pitches.append(mean([note.pitch for note in part]))
-        all_notes.extend(part)
+
+    sizes = np.array([len(part) for part in parts], dtype=np.int64)
+    number = int(sizes.sum())
 
     # for calculating variance, at least 2 notes are needed. melody_length//4 is a
     # lower bound for the least smallest amount of notes
-    if len(all_notes) < max(2, int(max_melody_length // 4)):
+    if number < max(2, int(max_melody_length // 4)):
         return None
 
-    probable_melody_parts = []
+    # volumes and pitches are integers, so the sums are exact and the means the same as the ones of statistics.
+    # The variance stays exact as well, only its square root is rounded
+    starts = np.concatenate(([0], np.cumsum(sizes)[:-1]))
+    columns = []
+    for name in ('volume', 'pitch'):
+        values = np.concatenate([part.array[name] for part in parts])
+        part_sums = np.add.reduceat(values, starts).tolist()
 
-    mean_volume = mean([n.volume for n in all_notes])
-    stdev_volume = stdev([n.volume for n in all_notes])
-    mean_pitch = mean([n.pitch for n in all_notes])
-    stdev_pitch = stdev([n.pitch for n in all_notes])
+        total = sum(part_sums)
+        squares = int(np.dot(values, values))
+        variance = Fraction(number * squares - total * total, number * (number - 1))
 
-    for avg_vol, avg_pitch, part in zip(average_volumes, average_pitches, parts):
-        if avg_vol >= mean_volume - stdev_volume:
-            probable_melody_parts.append(part)
-        elif avg_pitch >= mean_pitch - stdev_pitch:
-            probable_melody_parts.append(part)
+        columns.append(([s / size for s, size in zip(part_sums, sizes.tolist())],
+                        total / number - math.sqrt(variance)))
 
-    result = simple_skyline_algorithm_from_simple(probable_melody_parts, split,
-                                                  max_rest, max_melody_length)
+    (average_volumes, lowest_volume), (average_pitches, lowest_pitch) = columns
 
-    return result
+    return [part for avg_vol, avg_pitch, part in zip(average_volumes, average_pitches, parts)
+            if avg_vol >= lowest_volume or avg_pitch >= lowest_pitch]
 
 
 def is_sequence(notes: simple.NoteList):
@@ -144,7 +408,7 @@ def is_sequence(notes: simple.NoteList):
     :param notes:
     :return:
     """
-    return all([first.end() <= second.offset for first, second in zip(notes[:-1], notes[1:])])
+    return not notes.intervals().has_overlaps()
 
 
 def make_full_sub_melodies(melody: simple.NoteList, max_rest: float, min_melody_length: float) \
@@ -177,21 +441,19 @@ def split_melody(melody: simple.NoteList, max_rest: float, min_melody_length: fl
     if not melody:
         return None
 
-    split_indexes = [0]
-    split_indexes.extend([i + 1
-                          for i, (n1, n2)
-                          in enumerate(zip(melody[:-1], melody[1:]))
-                          if n2.offset > n1.end() + max_rest])
-    split_indexes.append(len(melody))
-
-    # splits the melody at breaks that take more than max_rest beats
-    melodies = [simple.NoteList(melody[i1:i2])
-                for i1, i2
-                in zip(split_indexes[:-1], split_indexes[1:])
-                if melody[i1].end() + min_melody_length <= melody[i2 - 1].offset]
+    offsets = melody.offsets
+    ends = melody.ends()
+
+    # splits the melody at breaks that take more than max_rest beats. The melody is sorted and doesn't overlap,
+    # so the positions of the gaps are its indices
+    split_indexes = np.concatenate(([0], melody.intervals().gaps(max_rest)[0], [len(melody)]))
+    firsts = split_indexes[:-1]
+    lasts = split_indexes[1:] - 1
+
     # the melodies should be at least min_melody_length beats long!
+    long_enough = ends[firsts] + min_melody_length <= offsets[lasts]
 
-    return melodies
+    return [melody[i1:i2 + 1] for i1, i2 in zip(firsts[long_enough].tolist(), lasts[long_enough].tolist())]
 
 
 def make_breaks_and_start(melody: simple.NoteList) -> (float, simple.NoteList):
@@ -204,39 +466,40 @@ def make_breaks_and_start(melody: simple.NoteList) -> (float, simple.NoteList):
     start = melody[0].offset
     first_measure_start = (start // 4) * 4
 
-    copied_melody = deepcopy(melody)
-    for note in copied_melody:
-        note.offset -= first_measure_start
-
-    full_list = simple.NoteList()
+    copied_melody = melody.copy()
+    copied_melody.shift(-first_measure_start)
 
-    if copied_melody[0].offset > 0.0:
-        full_list.append(simple.Note(offset=0.0,
-                                     length=copied_melody[0].offset,
-                                     pitch=200,
-                                     volume=0,
-                                     part=copied_melody[0].part))
+    data = copied_melody.array
+    offsets = data['offset']
+    ends = copied_melody.ends()
 
-    full_list.append(copied_melody[0])
+    # a rest from the end of every note to the next one that starts later, and one from 0.0 to the first note
+    gaps = np.flatnonzero(offsets[1:] > ends[:-1])
+    rests = np.zeros(len(gaps), dtype=simple.NOTE_DTYPE)
+    rests['offset'] = ends[gaps]
+    rests['length'] = offsets[gaps + 1] - ends[gaps]
+    rests['pitch'] = 200
+    rests['part'] = data['part'][gaps]
+    positions = gaps + 1
 
-    for note in copied_melody[1:]:
-        if note.offset > full_list[-1].end():
-            full_list.append(simple.Note(offset=full_list[-1].end(),
-                                         length=note.offset - full_list[-1].end(),
-                                         pitch=200,
-                                         volume=0,
-                                         part=full_list[-1].part))
+    if offsets[0] > 0.0:
+        first_rest = np.zeros(1, dtype=simple.NOTE_DTYPE)
+        first_rest['length'] = offsets[0]
+        first_rest['pitch'] = 200
+        first_rest['part'] = data['part'][0]
+        rests = np.concatenate((first_rest, rests))
+        positions = np.concatenate(([0], positions))
 
-        full_list.append(note)
-
-    return first_measure_start, full_list
+    return first_measure_start, simple.NoteList.from_array(np.insert(data, positions, rests))
 
 
 if __name__ == '__main__':
 
     import os
-    from settings.music_info_pb2 import VanillaStreamPB
     from random import shuffle
+    from music_utils.proto_columns import read_vanilla_stream
+    from preprocessing.context import context
+    from preprocessing.manifest import PB_ARTIFACT
 
     file_list = []
 
@@ -247,6 +510,10 @@ if __name__ == '__main__':
                 file_list.append(os.path.join(dirname, filename))
                 pass
 
+    # and the ones in the shards
+    file_list.extend(context.manifest.artifact_path(key, PB_ARTIFACT)
+                     for key in context.shard_reader(PB_ARTIFACT).keys())
+
     shuffle(file_list)
 
     for filename in file_list[0:1]:
@@ -257,10 +524,7 @@ if __name__ == '__main__':
 
         print(filename)
 
-        with open(proto_buffer_path, 'rb') as fp:
-            proto_buffer = VanillaStreamPB()
-            proto_buffer.ParseFromString(fp.read())
-            assert proto_buffer.HasField('info')
+        proto_buffer = read_vanilla_stream(context.read_artifact(proto_buffer_path, PB_ARTIFACT))
 
         simple_song = simple.Song(proto_buffer)
 
@@ -1,6 +1,8 @@
 #!/usr/bin/env python3
 
+import argparse
 import os
+import queue
 import random
 import sys
 import threading
@@ -11,6 +13,9 @@ import music_utils.simple_classes as simple
 import preprocessing.melody_and_chords.find_melody as find_melody
 import settings.constants as c
 import settings.music_info_pb2 as music_info
+from music_utils.proto_columns import make_melody_list, read_vanilla_stream
+from preprocessing.context import context
+from preprocessing.manifest import MELODY_ARTIFACTS, PB_ARTIFACT, empty_artifact
 
 
 class MakeDataThread(threading.Thread):
@@ -18,9 +23,10 @@ class MakeDataThread(threading.Thread):
     This Thread class is designed to make all the melody finding while communicating with other threads
     via a queue specified in constants, that holds all filenames ready to be processed (.pb files)
     """
-    def __init__(self, thread_id=random.randint(100000, 999999)):
+    def __init__(self, thread_id=random.randint(100000, 999999), batch_size: int = 32):
         threading.Thread.__init__(self)
         self.threadID = thread_id
+        self.batch_size = batch_size
         self.exit_flag = 0
 
     def run(self):
@@ -29,117 +35,161 @@ class MakeDataThread(threading.Thread):
     def stop(self):
         self.exit_flag = 1
 
-    def get_job(self) -> str:
-        if not c.proto_buffer_work_queue.empty():
-            file_name = c.proto_buffer_work_queue.get()
-            return file_name
+    def get_jobs(self) -> [str]:
+        """
+        up to batch_size filenames from the queue
+        :return:
+        """
+        file_names = []
+        while len(file_names) < self.batch_size:
+            try:
+                file_names.append(context.proto_buffer_work_queue.get_nowait())
+            except queue.Empty:
+                break
 
-        else:
+        if not file_names:
             time.sleep(1)
-            return ""
-
-    def make_melody_and_write_pb_file(self):
-
-        while not c.proto_buffer_work_queue.empty() and not self.exit_flag:
-            filename = self.get_job()
-
-            if not filename:
-                continue
-
-            no_update = False
+        return file_names
 
-            try:
-
-                new_filename = filename.replace('.pb', '_tf_skyline.melody_pb')
+    def finish(self, skipped: bool):
+        if skipped:
+            context.metrics.count('proto_buffers_skipped')
+        else:
+            context.metrics.finished('proto_buffers')
+
+        context.metrics.report('proto_buffers', context.proto_buffers_to_do -
+                               context.metrics.counters['proto_buffers_skipped'])
+
+    def extract(self, algorithm: int, songs: dict) -> list:
+        """
+        :param algorithm: one of find_melody.MELODY_EXTRACTORS
+        :param songs: simple.Songs by their filenames
+        :return: the melodies of every song, None for the ones that failed
+        """
+        extract = find_melody.MELODY_EXTRACTORS[algorithm]
+        try:
+            with context.metrics.time('melody_extraction'):
+                return extract(list(songs.values()), split=True)
+
+        except:
+            # a song that fails would take the whole batch with it, so they get their melodies one by one
+            melodies_of_songs = []
+            for filename, simple_song in songs.items():
+                try:
+                    melodies_of_songs.append(extract([simple_song], split=True)[0])
+                except:
+                    print("\n\n\n", filename, "\n\n", sys.exc_info()[1], "\n\n", traceback.print_exc())
+                    melodies_of_songs.append(None)
+            return melodies_of_songs
 
-                if os.path.exists(new_filename):
-                    no_update = True
+    def make_melody_and_write_pb_file(self):
+        """
+        reads batch_size songs at once and finds their melodies with every algorithm of context.melody_algorithms
+        they don't have a MelodyList of yet, so every .pb is read only once for all algorithms
+        :return:
+        """
+        while not context.proto_buffer_work_queue.empty() and not self.exit_flag:
+            filenames = self.get_jobs()
+
+            songs = {}
+            missing_algorithms = {}
+            for filename in filenames:
+                algorithms = [a for a in context.melody_algorithms
+                              if not context.manifest.has_artifact(filename, MELODY_ARTIFACTS[a])]
+                if not algorithms:
+                    self.finish(skipped=True)
                     continue
 
-                with open(filename, 'rb') as fp:
-
-                    proto_buffer = music_info.VanillaStreamPB()
-                    proto_buffer.ParseFromString(fp.read())
+                try:
+                    with context.metrics.time('read_proto'):
+                        proto_buffer = read_vanilla_stream(context.read_artifact(filename, PB_ARTIFACT))
 
-                simple_song = simple.Song(proto_buffer=proto_buffer)
+                        songs[filename] = simple.Song(proto_buffer=proto_buffer)
+                        missing_algorithms[filename] = algorithms
 
-                melodies = find_melody.tf_skyline(simple_song, split=True)
+                except:
+                    print("\n\n\n", filename, "\n\n", sys.exc_info()[1], "\n\n", traceback.print_exc())
+                    self.finish(skipped=False)
 
-                if melodies is None or len(melodies) == 0:
+            for algorithm in context.melody_algorithms:
+                songs_of_algorithm = {filename: simple_song for filename, simple_song in songs.items()
+                                      if algorithm in missing_algorithms[filename]}
+                if not songs_of_algorithm:
                     continue
 
-                melody_list = music_info.MelodyList()
-                melody_list.extra_info = "Doesn't save note volumes"
-                melody_list.filepath = os.path.relpath(filename, c.MXL_DATA_FOLDER).replace('.pb', '.mxl')
-                melody_list.algorithm = music_info.TF_SKYLINE
-
-                for i, m in enumerate(melodies):
-                    melody_part = melody_list.melodies.add()
+                melodies_of_songs = self.extract(algorithm, songs_of_algorithm)
 
-                    melody_part.actual_start = m[0]
+                for filename, melodies in zip(songs_of_algorithm, melodies_of_songs):
+                    try:
+                        # songs without melodies (or that failed) aren't pending anymore either
+                        if melodies is None or len(melodies) == 0:
+                            context.manifest.add_artifact(filename, empty_artifact(MELODY_ARTIFACTS[algorithm]))
+                            continue
 
-                    melody_part.offsets.extend([n.offset for n in m[1]])
-                    melody_part.lengths.extend([n.length for n in m[1]])
-                    melody_part.pitches.extend([n.pitch for n in m[1]])
+                        melody_list = make_melody_list(
+                            os.path.relpath(filename, c.MXL_DATA_FOLDER).replace('.pb', '.mxl'),
+                            "Doesn't save note volumes", algorithm,
+                            [(m[0], m[1].offsets, m[1].lengths, m[1].pitches) for m in melodies])
 
-                with open(new_filename, 'xb') as fp:
+                        with context.metrics.time('melody_write'):
+                            context.write_artifact(filename, MELODY_ARTIFACTS[algorithm],
+                                                   melody_list.SerializeToString())
 
-                    fp.write(melody_list.SerializeToString())
+                    except:
+                        print("\n\n\n", filename, "\n\n", sys.exc_info()[1], "\n\n", traceback.print_exc())
 
-            except:
-                print("\n\n\n", filename, "\n\n", sys.exc_info()[1], "\n\n", traceback.print_exc())
-
-            finally:
-                c.melody_lock.acquire()
-
-                if no_update:
-                    c.proto_buffers_to_do -= 1
-                    if c.proto_buffers_done == 0:
-                        c.proto_buffer_start_time = time.time()
-                else:
-                    c.proto_buffers_done += 1
-
-                    current_time = time.time()
-
-                    full_seconds_left = (((current_time - c.proto_buffer_start_time) / (c.proto_buffers_done + 0.001)) *
-                                         (c.proto_buffers_to_do - c.proto_buffers_done))
-
-                    days_left = str(round(full_seconds_left // 86400))
-
-                    hours_left = str(round((full_seconds_left % 86400) // 3600))
-
-                    minutes_left = str(round((full_seconds_left % 3600) // 60))
-
-                    seconds_left = str(round(full_seconds_left % 60))
-
-                    print("\rFinished {do:>5}/{todo}, {p:>7.3f} percent of the files, Time left: {d:>2}d, {h:>2}h, "
-                          "{m:>2}min, {s:>2}s     ".format(
-                        do=str(c.proto_buffers_done), todo=str(c.proto_buffers_to_do),
-                        p=(round(c.proto_buffers_done / c.proto_buffers_to_do, 5)) * 100,
-                        d=days_left, h=hours_left, m=minutes_left, s=seconds_left),
-                        file=sys.stdout, flush=True, end='')
-
-                c.melody_lock.release()
+            for _ in songs:
+                self.finish(skipped=False)
 
 
 if __name__ == "__main__":
-    thread_number = 8
+    algorithm_names = {music_info.MelodyAlgorithm.Name(a).lower(): a for a in find_melody.MELODY_EXTRACTORS}
+
+    parser = argparse.ArgumentParser(description="finds the melodies of all preprocessed files, with tf_skyline "
+                                                 "and the other algorithms of c.MELODY_ALGORITHMS")
+    parser.add_argument('--algorithm', choices=sorted(algorithm_names), action='append',
+                        help="melody algorithm to run, can be given several times to run them in one pass "
+                             "over the songs. Those of c.MELODY_ALGORITHMS if not given")
+    parser.add_argument('--threads', type=int, default=8, help="number of worker threads")
+    parser.add_argument('--batch', type=int, default=32,
+                        help="number of songs a worker thread finds the melodies of at once")
+    parser.add_argument('--metrics', default=None,
+                        help="file the stage timings and counters are written to, as JSON if it ends with .json, "
+                             "otherwise in the Prometheus text format")
+    arguments = parser.parse_args()
+
+    context.metrics.export_file = arguments.metrics
+    if arguments.algorithm:
+        context.melody_algorithms = [algorithm_names[name] for name in arguments.algorithm]
+
+    # c.MELODY_ALGORITHMS might name one that has only a kind of derived file, but no extractor yet
+    unknown_algorithms = [music_info.MelodyAlgorithm.Name(a) for a in context.melody_algorithms
+                          if a not in find_melody.MELODY_EXTRACTORS]
+    if unknown_algorithms:
+        parser.error("no melody extractor for {a} in find_melody.MELODY_EXTRACTORS".format(
+            a=", ".join(unknown_algorithms)))
+
+    thread_number = arguments.threads
     threads = []
 
     for tName in range(thread_number):
-        thread = MakeDataThread(tName + 1)
+        thread = MakeDataThread(tName + 1, arguments.batch)
         threads.append(thread)
 
     print("Starting all {n} Threads\n\n\n".format(n=thread_number), flush=True)
 
-    c.proto_buffer_start_time = time.time()
-
     for t in threads:
         t.start()
 
     for t in threads:
         t.join()
 
+    context.close_shards()
+
     print("\n\n\nExiting all {n} Threads".format(n=thread_number))
 
+    context.metrics.report('proto_buffers', context.proto_buffers_to_do -
+                           context.metrics.counters['proto_buffers_skipped'], force=True)
+    print("\n\n" + context.metrics.summary())
+
     sys.exit(0)
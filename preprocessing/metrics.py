@@ -0,0 +1,280 @@
+import bisect
+import collections
+import contextlib
+import json
+import os
+import sys
+import threading
+import time
+
+# upper bounds in seconds of the latency histogram buckets, the last bucket (+Inf) is implicit
+BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+
+METRIC_PREFIX = 'tensorflow_music'
+
+
+class Histogram:
+    """
+    counts observed durations in fixed buckets, like a Prometheus histogram
+    """
+
+    def __init__(self, buckets: tuple = BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q: float) -> float:
+        """
+        :param q: between 0 and 1
+        :return: the upper bound of the bucket the quantile lies in (the largest bound for the last bucket)
+        """
+        if self.count == 0:
+            return 0.0
+
+        rank = q * self.count
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            if cumulative >= rank:
+                return bound
+        return self.buckets[-1]
+
+    def snapshot(self) -> dict:
+        return {'counts': list(self.counts), 'sum': self.sum, 'count': self.count}
+
+    def merge(self, snapshot: dict):
+        for i, count in enumerate(snapshot['counts']):
+            self.counts[i] += count
+        self.sum += snapshot['sum']
+        self.count += snapshot['count']
+
+
+class Metrics:
+    """
+    counters, latency histograms per pipeline stage (parse, prefilter, key analysis, transpose, proto write,
+    melody extraction...) and the throughput of finished files over a sliding window.
+    Every method only holds an internal lock for a few additions, and the progress line is printed by at most one
+    thread at a time, without the others waiting for it. Stages can be nested, e.g. key_analysis includes transpose.
+    Worker processes send their snapshot to the main process, which merges it
+    """
+
+    def __init__(self, window: float = 60.0, report_interval: float = 1.0, export_interval: float = 30.0):
+        """
+        :param window: seconds over which the throughput is measured
+        :param report_interval: minimal seconds between two progress lines
+        :param export_interval: minimal seconds between two exports to export_file
+        """
+        self.window = window
+        self.report_interval = report_interval
+        self.export_interval = export_interval
+
+        # if set, report writes the metrics there as JSON (.json ending) or in the Prometheus text format
+        self.export_file = None
+
+        self._lock = threading.Lock()
+        self._report_lock = threading.Lock()
+
+        self.start_time = time.time()
+        self.counters = collections.Counter()
+        self.histograms = {}
+        self._finished = collections.defaultdict(collections.deque)
+
+        self._last_report = 0.0
+        self._last_export = 0.0
+
+    def reset(self):
+        with self._lock:
+            self.start_time = time.time()
+            self.counters = collections.Counter()
+            self.histograms = {}
+            self._finished = collections.defaultdict(collections.deque)
+
+    def count(self, name: str, value: int = 1):
+        with self._lock:
+            self.counters[name] += value
+
+    def observe(self, stage: str, seconds: float):
+        with self._lock:
+            histogram = self.histograms.get(stage)
+            if histogram is None:
+                histogram = self.histograms[stage] = Histogram()
+            histogram.observe(seconds)
+
+    @contextlib.contextmanager
+    def time(self, stage: str):
+        """
+        measures the duration of a with block as stage, also if it raises
+        :param stage:
+        :return:
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start)
+
+    def finished(self, name: str):
+        """
+        counts a finished file of a stage (e.g. "mxl_files") as name + "_done" and for the throughput
+        :param name:
+        :return:
+        """
+        now = time.time()
+        with self._lock:
+            self.counters[name + '_done'] += 1
+            finished = self._finished[name]
+            finished.append(now)
+            while finished[0] < now - self.window:
+                finished.popleft()
+
+    def throughput(self, name: str) -> float:
+        """
+        :param name:
+        :return: files per second over the sliding window (or since the start, if it is shorter)
+        """
+        now = time.time()
+        with self._lock:
+            finished = self._finished.get(name, ())
+            while finished and finished[0] < now - self.window:
+                finished.popleft()
+            number = len(finished)
+
+        seconds = min(self.window, now - self.start_time)
+        return number / seconds if seconds > 0 else 0.0
+
+    def throughputs(self) -> dict:
+        """
+        :return: the throughput of every name given to finished
+        """
+        with self._lock:
+            names = list(self._finished)
+        return {name: self.throughput(name) for name in names}
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {'counters': dict(self.counters),
+                    'histograms': {stage: h.snapshot() for stage, h in self.histograms.items()}}
+
+    def merge(self, snapshot: dict):
+        """
+        adds the counters and histograms of another Metrics, e.g. of a worker process
+        :param snapshot: the result of Metrics.snapshot
+        :return:
+        """
+        with self._lock:
+            self.counters.update(snapshot['counters'])
+            for stage, histogram_snapshot in snapshot['histograms'].items():
+                histogram = self.histograms.get(stage)
+                if histogram is None:
+                    histogram = self.histograms[stage] = Histogram()
+                histogram.merge(histogram_snapshot)
+
+    def to_json(self) -> str:
+        snapshot = self.snapshot()
+
+        stages = {}
+        for stage, histogram_snapshot in sorted(snapshot['histograms'].items()):
+            h = Histogram()
+            h.merge(histogram_snapshot)
+            stages[stage] = {
+                'count': h.count, 'sum': h.sum, 'mean': h.sum / h.count if h.count else 0.0,
+                'p50': h.quantile(0.5), 'p90': h.quantile(0.9), 'p99': h.quantile(0.99),
+                'buckets': {str(bound): count for bound, count in zip(h.buckets + ('+Inf',), h.counts)}
+            }
+
+        return json.dumps({
+            'time': time.time(),
+            'uptime': time.time() - self.start_time,
+            'counters': snapshot['counters'],
+            'throughput': self.throughputs(),
+            'stages': stages
+        }, indent=2, sort_keys=True)
+
+    def to_prometheus(self) -> str:
+        snapshot = self.snapshot()
+        lines = []
+
+        lines.append('# TYPE {p}_events_total counter'.format(p=METRIC_PREFIX))
+        for name, value in sorted(snapshot['counters'].items()):
+            lines.append('{p}_events_total{{name="{n}"}} {v}'.format(p=METRIC_PREFIX, n=name, v=value))
+
+        lines.append('# TYPE {p}_throughput gauge'.format(p=METRIC_PREFIX))
+        for name, value in sorted(self.throughputs().items()):
+            lines.append('{p}_throughput{{name="{n}"}} {v}'.format(p=METRIC_PREFIX, n=name, v=value))
+
+        lines.append('# TYPE {p}_stage_seconds histogram'.format(p=METRIC_PREFIX))
+        for stage, h in sorted(snapshot['histograms'].items()):
+            cumulative = 0
+            for bound, count in zip(BUCKETS + ('+Inf',), h['counts']):
+                cumulative += count
+                lines.append('{p}_stage_seconds_bucket{{stage="{s}",le="{b}"}} {v}'.format(
+                    p=METRIC_PREFIX, s=stage, b=bound, v=cumulative))
+            lines.append('{p}_stage_seconds_sum{{stage="{s}"}} {v}'.format(p=METRIC_PREFIX, s=stage, v=h['sum']))
+            lines.append('{p}_stage_seconds_count{{stage="{s}"}} {v}'.format(p=METRIC_PREFIX, s=stage,
+                                                                            v=h['count']))
+
+        return '\n'.join(lines) + '\n'
+
+    def write(self, filename: str):
+        """
+        writes the metrics as JSON if the filename ends with .json, otherwise in the Prometheus text format
+        (e.g. for the textfile collector of the node exporter). The file is replaced at once
+        :param filename:
+        :return:
+        """
+        text = self.to_json() if filename.endswith('.json') else self.to_prometheus()
+
+        temp_filename = "{f}.{pid}.tmp".format(f=filename, pid=os.getpid())
+        with open(temp_filename, 'w') as fp:
+            fp.write(text)
+        os.replace(temp_filename, filename)
+
+    def summary(self) -> str:
+        """
+        :return: a table of all stages, the one that took the most time first
+        """
+        lines = ["{s:<20} {n:>8} {t:>10} {m:>9} {p:>8}".format(s="stage", n="count", t="total (s)",
+                                                               m="mean (s)", p="p90 (s)")]
+        with self._lock:
+            histograms = sorted(self.histograms.items(), key=lambda item: -item[1].sum)
+            for stage, h in histograms:
+                lines.append("{s:<20} {n:>8} {t:>10.2f} {m:>9.4f} {p:>8}".format(
+                    s=stage, n=h.count, t=h.sum, m=h.sum / h.count if h.count else 0.0, p=h.quantile(0.9)))
+        return '\n'.join(lines)
+
+    def report(self, name: str, to_do: int, force: bool = False):
+        """
+        prints a progress line for a stage and exports the metrics, if the last time was long enough ago.
+        If another thread is already doing it, nothing happens
+        :param name: the name given to finished
+        :param to_do: the number of files of this stage
+        :param force: print (and export) anyway, e.g. at the end
+        :return:
+        """
+        now = time.time()
+        if not force and now - self._last_report < self.report_interval:
+            return
+
+        if not self._report_lock.acquire(blocking=force):
+            return
+
+        try:
+            self._last_report = now
+            with self._lock:
+                done = self.counters[name + '_done']
+
+            print("\rFinished {do:>5}/{todo}, {p:>7.3f} percent of the files, {t:>7.2f} files/s     ".format(
+                do=done, todo=to_do, p=done / to_do * 100 if to_do else 100.0, t=self.throughput(name)),
+                file=sys.stdout, flush=True, end='')
+
+            if self.export_file and (force or now - self._last_export >= self.export_interval):
+                self._last_export = now
+                self.write(self.export_file)
+        finally:
+            self._report_lock.release()
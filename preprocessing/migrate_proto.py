@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+import argparse
+import os
+import shutil
+import sys
+
+import settings.constants as c
+from music_utils.proto_columns import convert_melody_list, convert_vanilla_stream
+from preprocessing.manifest import ARTIFACT_KINDS, MELODY_ARTIFACTS, PB_ARTIFACT
+from preprocessing.shards import ShardReader, ShardWriter, shard_folder
+
+CONVERTERS = {kind: convert_melody_list for kind in MELODY_ARTIFACTS.values()}
+CONVERTERS[PB_ARTIFACT] = convert_vanilla_stream
+
+
+def migrate_shards(kind: str, version: int = c.PROTO_VERSION) -> (int, int, int):
+    """
+    writes all current records of the shards of a kind into new shards in the given version and replaces the old
+    shards with them, which also leaves out the records that were replaced by newer ones.
+    Nothing else may write these shards in the meantime
+    :param kind: PB_ARTIFACT or one of MELODY_ARTIFACTS
+    :param version:
+    :return: the number of records and their bytes before and after
+    """
+    folder = shard_folder(kind)
+    if not os.path.isdir(folder):
+        return 0, 0, 0
+
+    new_folder = folder + '.migrating'
+    old_folder = folder + '.old'
+    shutil.rmtree(new_folder, ignore_errors=True)
+
+    records = before = after = 0
+    reader = ShardReader(folder)
+    with ShardWriter(new_folder) as writer:
+        for key, value in reader.scan():
+            converted = CONVERTERS[kind](value, version)
+            writer.append(key, converted)
+            records += 1
+            before += len(value)
+            after += len(converted)
+    reader.close()
+
+    # the records stay in the manifest, they are only in other shards now
+    os.rename(folder, old_folder)
+    os.rename(new_folder, folder)
+    shutil.rmtree(old_folder)
+
+    return records, before, after
+
+
+def migrate_files(kind: str, version: int = c.PROTO_VERSION) -> (int, int, int):
+    """
+    converts the derived files of a kind that lie next to the .mxl files (if c.SHARDS is off or was off)
+    :param kind: PB_ARTIFACT or one of MELODY_ARTIFACTS
+    :param version:
+    :return: the number of files and their bytes before and after
+    """
+    files = before = after = 0
+    for dir_path, _, filenames in os.walk(c.MXL_DATA_FOLDER):
+        for filename in filenames:
+            if not filename.endswith(kind):
+                continue
+            path = os.path.join(dir_path, filename)
+
+            with open(path, 'rb') as fp:
+                value = fp.read()
+            converted = CONVERTERS[kind](value, version)
+
+            temp_path = path + '.migrating'
+            with open(temp_path, 'wb') as fp:
+                fp.write(converted)
+            os.replace(temp_path, path)
+
+            files += 1
+            before += len(value)
+            after += len(converted)
+
+    return files, before, after
+
+
+if __name__ == '__main__':
+    kinds = ARTIFACT_KINDS
+
+    parser = argparse.ArgumentParser(description="converts the existing VanillaStreamPBs and melodies, in the shards "
+                                                 "and next to the .mxl files, to another version of "
+                                                 "music_info.proto. Don't run it while preprocessing")
+    parser.add_argument('--version', type=int, choices=[1, 2], default=c.PROTO_VERSION,
+                        help="version to convert to, 1 to go back")
+    parser.add_argument('--kind', choices=sorted(kinds), action='append',
+                        help="kind of derived files to convert, all if not given")
+    arguments = parser.parse_args()
+
+    for kind_name in arguments.kind or sorted(kinds):
+        for where, migrate in (('shards', migrate_shards), ('files', migrate_files)):
+            number, size_before, size_after = migrate(kinds[kind_name], arguments.version)
+            if number:
+                print("{k} {w}: converted {n} to version {v}, {b} bytes before, {a} bytes after ({r:.2f}x)".format(
+                    k=kind_name, w=where, n=number, v=arguments.version, b=size_before, a=size_after,
+                    r=size_before / max(size_after, 1)))
+
+    sys.exit(0)
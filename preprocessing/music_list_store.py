@@ -0,0 +1,129 @@
+import os
+
+import settings.constants as c
+import settings.music_info_pb2 as music_info
+from preprocessing.helper import encode_varint, iter_delimited
+
+
+class MusicListStore:
+    """
+    saves the MusicList of the current settings as a snapshot (the complete MusicList, like before)
+    plus an append-only journal of length-delimited PieceOfMusic records that were added or changed
+    since the snapshot was written. Adding a piece only appends to the journal, so the cost per file
+    doesn't grow with the corpus. The journal is merged into the snapshot once it gets larger than it.
+    """
+
+    def __init__(self, location: str = c.PROTOCOL_BUFFER_LOCATION):
+        self.location = location
+        self.journal_location = location + '.journal'
+        self.music_list = None
+        self._journal = None
+        self._snapshot_size = 0
+        self._journal_size = 0
+
+    def load(self) -> music_info.MusicList:
+        """
+        loads the snapshot and replays the journal on top of it. A record in the journal replaces
+        an earlier one with the same filepath. If there is no snapshot yet, an empty one is written
+        :return: the MusicList with all recorded pieces
+        """
+        music_list = None
+
+        if os.path.exists(self.location):
+            if os.path.getsize(self.location) == 0:
+                os.remove(self.location)
+            else:
+                with open(self.location, 'rb') as fp:
+                    music_list = music_info.MusicList()
+                    music_list.ParseFromString(fp.read())
+                    music_list.counter = 0
+
+        if not music_list:
+
+            print("create music info file")
+
+            music_list = c.make_music_list()
+
+            with open(self.location, 'xb') as fp:
+                fp.write(music_list.SerializeToString())
+
+        self._snapshot_size = os.path.getsize(self.location)
+
+        if os.path.exists(self.journal_location):
+            with open(self.journal_location, 'rb') as fp:
+                journal = fp.read()
+
+            positions = {piece.filepath: i for i, piece in enumerate(music_list.music_data)}
+            valid_size = 0
+
+            for record, valid_size in iter_delimited(journal):
+                piece = music_info.PieceOfMusic()
+                piece.ParseFromString(record)
+                if piece.filepath in positions:
+                    music_list.music_data[positions[piece.filepath]].CopyFrom(piece)
+                else:
+                    positions[piece.filepath] = len(music_list.music_data)
+                    music_list.music_data.add().CopyFrom(piece)
+
+            # cut off a record that was only partly written
+            if valid_size < len(journal):
+                with open(self.journal_location, 'r+b') as fp:
+                    fp.truncate(valid_size)
+
+            self._journal_size = valid_size
+
+        self._journal = open(self.journal_location, 'ab')
+        self.music_list = music_list
+        return music_list
+
+    def append(self, piece_of_music: music_info.PieceOfMusic):
+        """
+        writes a new or changed piece to the journal, and merges the journal into
+        the snapshot if it got too large
+        :param piece_of_music:
+        :return:
+        """
+        record = piece_of_music.SerializeToString()
+        record = encode_varint(len(record)) + record
+
+        with c.music_info_file_lock:
+            self._journal.write(record)
+            self._journal.flush()
+            self._journal_size += len(record)
+
+            compact = self._journal_size > max(self._snapshot_size, c.MIN_COMPACTION_SIZE)
+
+        if compact:
+            self.compact()
+
+    def compact(self):
+        """
+        writes the complete MusicList as new snapshot and empties the journal.
+        The snapshot is written to a temporary file first, so a crash leaves either the old
+        snapshot with the full journal or the new one, never a half-written snapshot
+        :return:
+        """
+        c.music_info_dict_lock.acquire()
+        try:
+            self.music_list.counter = 0
+            serialized_byte_stream = self.music_list.SerializeToString()
+            # appends for pieces added after serialising have to wait until the journal is emptied
+            c.music_info_file_lock.acquire()
+        finally:
+            c.music_info_dict_lock.release()
+
+        try:
+            temp_location = self.location + '.tmp'
+            with open(temp_location, 'wb') as fp:
+                fp.write(serialized_byte_stream)
+                fp.flush()
+                os.fsync(fp.fileno())
+            os.replace(temp_location, self.location)
+
+            self._journal.truncate(0)
+            self._journal.flush()
+
+            self._snapshot_size = len(serialized_byte_stream)
+            self._journal_size = 0
+        finally:
+            c.music_info_file_lock.release()
@@ -0,0 +1,275 @@
+#!/usr/bin/env python3
+import argparse
+import json
+import math
+import os
+import threading
+import zipfile
+
+import music21 as m21
+import numpy as np
+
+import settings.constants as c
+from music_utils.vanilla_part import VanillaPart
+from music_utils.vanilla_stream import VanillaStream
+from preprocessing.manifest import file_hash
+
+# everything that changes what process_file makes out of a file has to change this version,
+# so that old entries aren't used anymore (they are evicted like any other entry)
+PARSER_VERSION = 'm21-' + m21.VERSION_STR + '-2'
+
+CACHE_SUFFIX = '.npz'
+
+# columns of the notes, saved for all parts one after the other
+NOTE_COLUMNS = ('offsets', 'lengths', 'pitches', 'volumes', 'lyrics')
+# the running sums and counters of VanillaPart.insert_local
+COUNTERS = ('pitch_sum', 'volume_sum', 'note_number', 'total_notes_or_chords', 'total_pitches', 'lyrics_number')
+
+
+class CachedScore:
+    """
+    everything process_data takes from the music21 parse: the time signatures and metronome marks
+    make_file_container puts in the VanillaStream and the parts made by process_file.
+    None of it depends on the settings
+    """
+
+    def __init__(self, elements: list, stream_attributes: dict, part_names: list, part_arrays: list):
+        """
+        :param elements: [class name, offset, ratio string or metronome number] of the time signatures
+                         and metronome marks
+        :param stream_attributes: the time signature and metronome attributes of the VanillaStream
+        :param part_names:
+        :param part_arrays: the result of VanillaPart.note_arrays for every part
+        """
+        self.elements = elements
+        self.stream_attributes = stream_attributes
+        self.part_names = part_names
+        self.part_arrays = part_arrays
+
+    @classmethod
+    def from_stream(cls, m21_stream: VanillaStream):
+        elements = []
+        for elem in m21_stream.getElementsByClass(('TimeSignature', 'MetronomeMark')):
+            if type(elem) == m21.meter.TimeSignature:
+                elements.append(['TimeSignature', float(elem.offset), elem.ratioString])
+            elif type(elem) == m21.tempo.MetronomeMark:
+                elements.append(['MetronomeMark', float(elem.offset), elem.number])
+
+        # these depend on the order the elements were inserted in, so they are kept as they are
+        stream_attributes = {attribute: getattr(m21_stream, attribute)
+                             for attribute in ('time_signature', 'min_metronome', 'max_metronome')}
+
+        part_names = []
+        part_arrays = []
+        for p in m21_stream.parts:
+            p: VanillaPart
+            part_names.append(p.partName)
+            part_arrays.append(p.note_arrays())
+
+        return cls(elements, stream_attributes, part_names, part_arrays)
+
+    def restore_file_container(self, m21_stream: VanillaStream):
+        """
+        does the same as make_file_container did with the original file
+        :param m21_stream:
+        :return:
+        """
+        for class_name, offset, value in self.elements:
+            if class_name == 'TimeSignature':
+                elem = m21.meter.TimeSignature(value)
+            else:
+                elem = m21.tempo.MetronomeMark(number=value)
+            elem.offset = offset
+            m21.stream.Score.insert(m21_stream, elem)
+
+        for attribute, value in self.stream_attributes.items():
+            setattr(m21_stream, attribute, value)
+
+    def restore_parts(self, m21_stream: VanillaStream):
+        """
+        does the same as process_file did with the original file
+        :param m21_stream:
+        :return:
+        """
+        for part_name, arrays in zip(self.part_names, self.part_arrays):
+            m21_stream.insert_part(VanillaPart.from_note_arrays(part_name, arrays))
+
+    def save(self, fp):
+        header = {
+            'elements': self.elements,
+            'stream_attributes': self.stream_attributes,
+            'part_names': self.part_names,
+            'counters': [[arrays[counter] for counter in COUNTERS] for arrays in self.part_arrays]
+        }
+
+        columns = {'header': np.array(json.dumps(header))}
+        for column in NOTE_COLUMNS:
+            columns[column] = np.concatenate([np.zeros(0)] + [arrays[column] for arrays in self.part_arrays])
+            columns[column + '_counts'] = np.array([len(arrays[column]) for arrays in self.part_arrays],
+                                                   dtype=np.int64)
+
+        np.savez(fp, **columns)
+
+    @classmethod
+    def load(cls, fp):
+        with np.load(fp, allow_pickle=False) as data:
+            header = json.loads(str(data['header']))
+
+            part_arrays = [{} for _ in header['part_names']]
+
+            for column in NOTE_COLUMNS:
+                values = data[column]
+                position = 0
+                for arrays, count in zip(part_arrays, data[column + '_counts'].tolist()):
+                    arrays[column] = values[position:position + count]
+                    position += count
+
+        for arrays, counters in zip(part_arrays, header['counters']):
+            for counter, value in zip(COUNTERS, counters):
+                arrays[counter] = value
+
+        return cls(header['elements'], header['stream_attributes'], header['part_names'], part_arrays)
+
+
+class ParseCache:
+    """
+    an on disk cache of CachedScores, keyed by the content hash of the source file (the same sha1 the manifest
+    keeps) and the parser version. Since the entries don't depend on the settings, changing them
+    only redoes the filtering and the key analysis. Every read touches the entry, so when the cache gets
+    larger than its size budget, the entries that weren't used for the longest time are deleted first.
+    """
+
+    def __init__(self, folder: str = c.PARSE_CACHE_FOLDER, size_budget: int = c.PARSE_CACHE_SIZE):
+        self.folder = folder
+        self.size_budget = size_budget
+        self._lock = threading.Lock()
+        self._size = None
+
+    @staticmethod
+    def key(filename: str) -> str:
+        """
+        :param filename: name of the (complete) filepath of the .mxl file
+        :return: the key of the file in the cache
+        """
+        return file_hash(filename)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.folder, key[:2], key + '_' + PARSER_VERSION + CACHE_SUFFIX)
+
+    def load(self, key: str):
+        """
+        :param key:
+        :return: the CachedScore, or None if it isn't cached
+        """
+        path = self._path(key)
+
+        try:
+            with open(path, 'rb') as fp:
+                cached_score = CachedScore.load(fp)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, KeyError, EOFError, zipfile.BadZipFile):
+            # a broken entry, e.g. from a full disk. It is written again
+            self._remove(path)
+            return None
+
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            # evicted by another process in the meantime
+            pass
+
+        return cached_score
+
+    def store(self, key: str, m21_stream: VanillaStream):
+        """
+        saves the time signatures, metronome marks and parts of a VanillaStream, right after process_file
+        :param key:
+        :param m21_stream:
+        :return:
+        """
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        # other threads or processes might write the same entry, so write to a temporary file of our own first
+        temp_path = "{p}.{pid}_{tid}.tmp".format(p=path, pid=os.getpid(), tid=threading.get_ident())
+        with open(temp_path, 'wb') as fp:
+            CachedScore.from_stream(m21_stream).save(fp)
+        size = os.path.getsize(temp_path)
+        os.replace(temp_path, path)
+
+        with self._lock:
+            if self._size is None:
+                self._size = self.size()
+            else:
+                self._size += size
+            evict = self._size > self.size_budget
+
+        if evict:
+            self.evict()
+
+    def entries(self) -> [(float, int, str)]:
+        """
+        :return: modification time, size and path of all entries, the least recently used first
+        """
+        entries = []
+        for root, dirs, files in os.walk(self.folder):
+            for file in files:
+                if not file.endswith(CACHE_SUFFIX):
+                    continue
+                path = os.path.join(root, file)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+        entries.sort()
+        return entries
+
+    def size(self) -> int:
+        return sum(size for _, size, _ in self.entries())
+
+    def evict(self, size_budget: int = None):
+        """
+        deletes the least recently used entries until the cache is at 90 percent of its size budget,
+        so that it isn't done again for the next few entries
+        :param size_budget: optionally a different budget than the one of the cache
+        :return: the number of deleted entries
+        """
+        if size_budget is None:
+            size_budget = self.size_budget
+
+        with self._lock:
+            entries = self.entries()
+            total = sum(size for _, size, _ in entries)
+            target = math.floor(size_budget * 0.9)
+
+            deleted = 0
+            for _, size, path in entries:
+                if total <= target:
+                    break
+                self._remove(path)
+                total -= size
+                deleted += 1
+
+            self._size = total
+
+        return deleted
+
+    @staticmethod
+    def _remove(path: str):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="shows the size of the parse cache and evicts old entries")
+    parser.add_argument('--size', type=int, default=c.PARSE_CACHE_SIZE,
+                        help="size budget in bytes, the least recently used entries above it are deleted")
+    arguments = parser.parse_args()
+
+    parse_cache = ParseCache()
+    print("{n} entries, {s} bytes".format(n=len(parse_cache.entries()), s=parse_cache.size()))
+    print("deleted {n} entries".format(n=parse_cache.evict(arguments.size)))
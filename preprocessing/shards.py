@@ -0,0 +1,401 @@
+#!/usr/bin/env python3
+import argparse
+import os
+import queue
+import struct
+import sys
+import threading
+
+import settings.constants as c
+from preprocessing.helper import decode_varint, encode_varint
+
+# a shard starts with MAGIC, followed by records of a varint key length, the key (the relative filepath
+# of the .mxl file), a varint value length and the value (e.g. a serialized VanillaStreamPB).
+# A finished shard ends with an index of varint key length, key, varint offset and varint length of the value
+# of every record, and a trailer of the offset of this index and MAGIC again
+MAGIC = b'TMSHARD1'
+TRAILER = struct.Struct('<Q8s')
+
+SHARD_SUFFIX = '.shard'
+
+# bytes read at once in sequential scans
+SCAN_BLOCK_SIZE = 16 << 20
+
+
+def shard_folder(kind: str) -> str:
+    """
+    :param kind: one of the *_ARTIFACT suffixes of preprocessing.manifest
+    :return: the folder of the shards with the derived files of this kind
+    """
+    return os.path.join(c.SHARD_FOLDER, kind.lstrip('._'))
+
+
+def _encode_record(key: str, value: bytes) -> bytes:
+    key = key.encode('utf-8')
+    return encode_varint(len(key)) + key + encode_varint(len(value)) + value
+
+
+def _iter_records(buffer, position: int, end: int):
+    """
+    iterates over the records of a shard that are completely in buffer[position:end]
+    :return: tuples of key, position of the value, length of the value and position after the record
+    """
+    while position < end:
+        try:
+            key_length, key_start = decode_varint(buffer, position)
+            value_length, value_start = decode_varint(buffer, key_start + key_length)
+        except IndexError:
+            return
+        if value_start + value_length > end:
+            return
+        key = bytes(buffer[key_start:key_start + key_length]).decode('utf-8')
+        position = value_start + value_length
+        yield key, value_start, value_length, position
+
+
+class ShardWriter:
+    """
+    appends records to shards of a folder from a single writer thread. Any number of threads can call append,
+    which only puts the record into a (bounded) queue. Every run starts a new shard and a shard is finished
+    with its index once it is larger than shard_size, so finished shards are never written again.
+    A shard of a crashed run has no index, but the readers can still scan its complete records
+    """
+
+    def __init__(self, folder: str, shard_size: int = c.SHARD_SIZE, on_written=None, queue_size: int = 256):
+        """
+        :param folder:
+        :param shard_size: bytes after which the next shard is started
+        :param on_written: called with the key from the writer thread, once a record is written and flushed,
+                           e.g. to record it in the manifest
+        :param queue_size: number of records that can wait for the writer before append blocks
+        """
+        self.folder = folder
+        self.shard_size = shard_size
+        self.on_written = on_written
+
+        self._queue = queue.Queue(queue_size)
+        self._error = None
+        self._closed = False
+
+        self._fp = None
+        self._index = []
+
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def append(self, key: str, value: bytes):
+        """
+        :param key: the relative filepath of the .mxl file the value was made from
+        :param value:
+        :return:
+        """
+        if self._closed:
+            raise ValueError("the shard writer is already closed")
+        self._raise_error()
+        self._queue.put((key, value))
+
+    def flush(self):
+        """
+        waits until all records appended so far are written
+        :return:
+        """
+        self._queue.join()
+        self._raise_error()
+
+    def close(self):
+        """
+        writes the remaining records and finishes the current shard
+        :return:
+        """
+        if not self._closed:
+            self._closed = True
+            self._queue.put(None)
+            self._thread.join()
+        self._raise_error()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+        return False
+
+    def _raise_error(self):
+        if self._error is not None:
+            raise self._error
+
+    def _run(self):
+        try:
+            while True:
+                item = self._queue.get()
+                try:
+                    if item is None:
+                        break
+                    if self._error is None:
+                        self._write(*item)
+                except Exception as e:
+                    # given to the next append, flush or close. The records after it are dropped
+                    self._error = e
+                finally:
+                    self._queue.task_done()
+        finally:
+            if self._fp is not None:
+                self._finish_shard()
+
+    def _write(self, key: str, value: bytes):
+        if self._fp is None:
+            self._fp = self._new_shard()
+            self._fp.write(MAGIC)
+            self._index = []
+
+        record = _encode_record(key, value)
+        position = self._fp.tell()
+        self._fp.write(record)
+        self._fp.flush()
+        self._index.append((key, position + len(record) - len(value), len(value)))
+
+        if self.on_written is not None:
+            self.on_written(key)
+
+        if self._fp.tell() >= self.shard_size:
+            self._finish_shard()
+
+    def _new_shard(self):
+        """
+        opens the shard with the next free number. Several writers of the same folder don't take the same one
+        :return:
+        """
+        os.makedirs(self.folder, exist_ok=True)
+        numbers = [int(f[:-len(SHARD_SUFFIX)]) for f in os.listdir(self.folder)
+                   if f.endswith(SHARD_SUFFIX) and f[:-len(SHARD_SUFFIX)].isdigit()]
+        number = max(numbers, default=-1) + 1
+
+        while True:
+            try:
+                return open(os.path.join(self.folder, "{n:05d}{s}".format(n=number, s=SHARD_SUFFIX)), 'xb')
+            except FileExistsError:
+                number += 1
+
+    def _finish_shard(self):
+        index_position = self._fp.tell()
+        index = bytearray()
+        for key, position, length in self._index:
+            key = key.encode('utf-8')
+            index += encode_varint(len(key)) + key + encode_varint(position) + encode_varint(length)
+
+        self._fp.write(bytes(index) + TRAILER.pack(index_position, MAGIC))
+        self._fp.flush()
+        os.fsync(self._fp.fileno())
+        self._fp.close()
+        self._fp = None
+        self._index = []
+
+
+class ShardReader:
+    """
+    random access by key to the records of all shards of a folder, and sequential scans over them.
+    The index of a finished shard is read from its end, the records of a shard that is still written
+    (or was left by a crash) are scanned. If a key is in several shards, the newest shard wins
+    """
+
+    def __init__(self, folder: str):
+        self.folder = folder
+        self._lock = threading.Lock()
+        self._index = {}
+        self._shards = {}
+        # the end of the records of every shard, and which shards are finished
+        self._ends = {}
+        self._finished = set()
+        self.refresh()
+
+    def refresh(self):
+        """
+        adds the records of new shards and of shards that grew since the last time
+        :return:
+        """
+        if not os.path.isdir(self.folder):
+            return
+
+        names = sorted(f for f in os.listdir(self.folder) if f.endswith(SHARD_SUFFIX))
+
+        with self._lock:
+            for name in names:
+                path = os.path.join(self.folder, name)
+                if path in self._finished:
+                    continue
+
+                if path not in self._shards:
+                    fd = os.open(path, os.O_RDONLY)
+                    if os.pread(fd, len(MAGIC), 0) != MAGIC:
+                        # just created, the writer hasn't written the header yet. A later refresh picks it up
+                        os.close(fd)
+                        continue
+                    self._shards[path] = fd
+                    self._ends[path] = len(MAGIC)
+
+                for key, position, length in self._read_index(path):
+                    self._index[key] = (path, position, length)
+
+    def _read_index(self, path: str) -> list:
+        """
+        reads the index of a finished shard, or the records of an unfinished one that weren't read before
+        :param path:
+        :return: key, position and length of the value of the records
+        """
+        fd = self._shards[path]
+        size = os.fstat(fd).st_size
+
+        if size >= len(MAGIC) + TRAILER.size:
+            index_position, magic = TRAILER.unpack(os.pread(fd, TRAILER.size, size - TRAILER.size))
+            if magic == MAGIC and len(MAGIC) <= index_position <= size - TRAILER.size:
+                index = os.pread(fd, size - TRAILER.size - index_position, index_position)
+                entries = []
+                position = 0
+                while position < len(index):
+                    key_length, key_start = decode_varint(index, position)
+                    key = index[key_start:key_start + key_length].decode('utf-8')
+                    value_position, position = decode_varint(index, key_start + key_length)
+                    value_length, position = decode_varint(index, position)
+                    entries.append((key, value_position, value_length))
+
+                self._finished.add(path)
+                self._ends[path] = index_position
+                return entries
+
+        start = self._ends[path]
+        data = os.pread(fd, size - start, start)
+        entries = []
+        end = 0
+        for key, position, length, end in _iter_records(data, 0, len(data)):
+            entries.append((key, start + position, length))
+        self._ends[path] = start + end
+        return entries
+
+    def get(self, key: str, default=None) -> bytes:
+        """
+        :param key: the relative filepath of the .mxl file
+        :param default: returned if there is no record for the key, even after looking for new shards
+        :return: the value
+        """
+        entry = self._index.get(key)
+        if entry is None:
+            self.refresh()
+            entry = self._index.get(key)
+            if entry is None:
+                return default
+
+        path, position, length = entry
+        return os.pread(self._shards[path], length, position)
+
+    def __getitem__(self, key: str) -> bytes:
+        value = self.get(key)
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._index
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    def keys(self) -> [str]:
+        return list(self._index)
+
+    def shards(self) -> [str]:
+        """
+        :return: the paths of all shards, the oldest first
+        """
+        with self._lock:
+            return sorted(self._shards)
+
+    def scan(self):
+        """
+        reads the records of all shards from the start to the end in large blocks,
+        which is much faster than get for every key
+        :return: an iterator of key and value of every current record, in the order they were written
+        """
+        for path in self.shards():
+            fd = self._shards[path]
+            end = self._ends[path]
+            offset = len(MAGIC)
+            buffer = b''
+
+            while offset + len(buffer) < end:
+                buffer += os.pread(fd, min(SCAN_BLOCK_SIZE, end - offset - len(buffer)), offset + len(buffer))
+
+                position = 0
+                for key, value_position, length, position in _iter_records(buffer, 0, len(buffer)):
+                    # records that were replaced by one in a newer shard are left out
+                    if self._index.get(key) == (path, offset + value_position, length):
+                        yield key, buffer[value_position:value_position + length]
+
+                offset += position
+                buffer = buffer[position:]
+
+    def close(self):
+        with self._lock:
+            for fd in self._shards.values():
+                os.close(fd)
+            self._shards = {}
+            self._ends = {}
+            self._finished = set()
+            self._index = {}
+
+
+def pack(kind: str, delete: bool = False) -> int:
+    """
+    moves the derived files of one kind that lie next to the .mxl files into shards
+    :param kind: one of the *_ARTIFACT suffixes of preprocessing.manifest
+    :param delete: delete the files after they are written to the shards
+    :return: the number of packed files
+    """
+    reader = ShardReader(shard_folder(kind))
+    packed = []
+
+    with ShardWriter(shard_folder(kind)) as writer:
+        for dir_path, _, filenames in os.walk(c.MXL_DATA_FOLDER):
+            for filename in sorted(filenames):
+                if not filename.endswith(kind):
+                    continue
+                path = os.path.join(dir_path, filename)
+                key = os.path.relpath(path, c.MXL_DATA_FOLDER)[:-len(kind)] + '.mxl'
+                if key in reader:
+                    continue
+
+                with open(path, 'rb') as fp:
+                    writer.append(key, fp.read())
+                packed.append(path)
+
+    reader.close()
+
+    if delete:
+        for path in packed:
+            os.remove(path)
+
+    return len(packed)
+
+
+if __name__ == '__main__':
+    from preprocessing.manifest import ARTIFACT_KINDS as kinds
+
+    parser = argparse.ArgumentParser(description="shows the shards of the derived files, "
+                                                 "or packs the single files next to the .mxl files into shards")
+    parser.add_argument('--pack', choices=sorted(kinds), action='append', default=[],
+                        help="kind of derived files to pack")
+    parser.add_argument('--delete', action='store_true', help="delete the single files after packing them")
+    arguments = parser.parse_args()
+
+    c.make_folders()
+
+    for kind_name in arguments.pack:
+        print("packed {n} {k} files".format(n=pack(kinds[kind_name], arguments.delete), k=kind_name))
+
+    for kind_name, kind in sorted(kinds.items()):
+        shard_reader = ShardReader(shard_folder(kind))
+        shards = shard_reader.shards()
+        print("{k}: {r} records in {s} shards, {b} bytes".format(
+            k=kind_name, r=len(shard_reader), s=len(shards), b=sum(os.path.getsize(path) for path in shards)))
+        shard_reader.close()
+
+    sys.exit(0)
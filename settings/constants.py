@@ -1,19 +1,16 @@
 #!/usr/bin/env python3
 
 import os
-import queue
 import threading
-import time
 
 import settings.music_info_pb2 as music_info
 from settings.music_info_pb2 import Settings
 
-print("start variable setup")
-start_time = time.time()
+# importing this module is cheap on purpose: nothing here touches the corpus.
+# everything that has to scan the data folder or load the MusicList lives in
+# preprocessing.context and is only done when a pipeline stage asks for it
 
-home_directory = "/home/malte/PycharmProjects/TensorflowMusic"
-
-os.chdir(home_directory)
+home_directory = os.environ.get("TENSORFLOW_MUSIC_HOME", "/home/malte/PycharmProjects/TensorflowMusic")
 
 DATA_FOLDER = os.path.join(home_directory, "data")
 MXL_FOLDER = os.path.join(home_directory, "data/MXL")
@@ -21,17 +18,75 @@ MXL_DATA_FOLDER = os.path.join(home_directory, "data/MXL/lmd_matched_mxl")
 
 MUSIC_INFO_FOLDER = os.path.join(home_directory, "data/music_info_pb")
 
-for folder in [DATA_FOLDER, MXL_FOLDER, MXL_DATA_FOLDER, MUSIC_INFO_FOLDER]:
-    try:
-        os.mkdir(folder)
-    except FileExistsError:
-        pass
+MANIFEST_LOCATION = os.path.join(DATA_FOLDER, "manifest.sqlite")
+
+PARSE_CACHE_FOLDER = os.path.join(home_directory, "data/parse_cache")
+
+SHARD_FOLDER = os.path.join(home_directory, "data/shards")
 
 UPDATE = True
-UPDATE_FREQUENCY = 10
+# the MusicList journal is merged into the snapshot once it is larger than the snapshot and this many bytes
+MIN_COMPACTION_SIZE = 1 << 20
 
 DRAFT = False
 
+# reject files by their time signature and metronome marks before parsing them with music21
+PREFILTER = True
+
+# keep the parsed parts of every file that passed the settings, so that changing the settings doesn't parse
+# these files again. The oldest used entries are deleted once the cache is larger than PARSE_CACHE_SIZE bytes
+PARSE_CACHE = False
+PARSE_CACHE_SIZE = 4 << 30
+
+# how the notes of the MusicXML files are read: 'music21' parses them into a music21 Score, 'arrays' reads them
+# straight into VanillaParts with preprocessing.analyze_and_modify.musicxml_arrays, which is much faster and needs
+# no parse cache. Both find the same notes, but 'arrays' checks the bpm with all metronome marks of a file,
+# while music21 leaves out some of them. Files whose header 'arrays' can't interpret are parsed with music21
+INGESTION_ENGINE = 'music21'
+
+# a file that takes longer than FILE_TIME_LIMIT seconds or makes the worker process grow by more than
+# FILE_MEMORY_LIMIT bytes is given up and marked as TIMEOUT or MEMORY_LIMIT, so it is skipped on later runs.
+# A worker that still hasn't given up a file FILE_KILL_DELAY seconds after its time limit (e.g. because it hangs
+# in C code) is killed
+FILE_TIME_LIMIT = 300
+FILE_MEMORY_LIMIT = 4 << 30
+FILE_KILL_DELAY = 30
+
+# write the VanillaStreamPBs and melodies into a few large shard files (see preprocessing.shards) instead of
+# one small file next to every .mxl file. A new shard is started once one is larger than SHARD_SIZE bytes
+SHARDS = True
+SHARD_SIZE = 256 << 20
+
+# version of the VanillaStreamPBs and MelodyLists that are written (see music_info.proto): 2 keeps the notes
+# as packed integers in quarter beats, 1 as repeated floats. Both are read, preprocessing.migrate_proto
+# converts the existing ones
+PROTO_VERSION = 2
+
+# implementation of the skyline algorithm in preprocessing.melody_and_chords.find_melody: 'arrays' works on the
+# note columns with numpy, 'loop' is the original loop over the notes. Both find the same melodies
+SKYLINE_ENGINE = 'arrays'
+
+# time slots per beat of the piano rolls of music_utils.simple_classes. All notes are on the grid of quarter beats
+# after preprocessing, so 4 keeps every note exactly
+PIANO_ROLL_SLOTS_PER_BEAT = 4
+
+# the music_info.MelodyAlgorithms preprocessing.melody_and_chords.make_tf_melody runs on every song, each one
+# writes its own MelodyLists (see find_melody.MELODY_EXTRACTORS and manifest.MELODY_ARTIFACTS)
+MELODY_ALGORITHMS = [music_info.TF_SKYLINE]
+
+
+def make_folders():
+    """
+    creates all data folders that don't exist yet
+    :return:
+    """
+    for folder in [DATA_FOLDER, MXL_FOLDER, MXL_DATA_FOLDER, MUSIC_INFO_FOLDER, PARSE_CACHE_FOLDER,
+                   SHARD_FOLDER]:
+        try:
+            os.mkdir(folder)
+        except FileExistsError:
+            pass
+
 
 def make_settings() -> Settings:
     settings = Settings()
@@ -65,79 +120,16 @@ music_info_dict_lock = threading.Lock()
 music_info_file_lock = threading.Lock()
 melody_lock = threading.Lock()
 
-music_protocol_buffer = None
-
-for dirpath, _, filenames in os.walk(MUSIC_INFO_FOLDER):
-
-    for filename in filenames:
-
-        if filename == settings_filename:
-            if os.path.getsize(os.path.join(dirpath, filename)) == 0:
-                os.remove(os.path.join(dirpath, filename))
-                break
-            with open(os.path.join(dirpath, filename), 'rb') as fp:
-                music_protocol_buffer = music_info.MusicList()
-                music_protocol_buffer.ParseFromString(fp.read())
-                music_protocol_buffer.counter = 0
-            break
-
-existing_files = {}
-
 PROTOCOL_BUFFER_LOCATION = os.path.join(MUSIC_INFO_FOLDER, settings_filename)
 
-mxl_work_queue = queue.Queue(0)
-mxl_files_done = 0
-
-proto_buffer_work_queue = queue.Queue(0)
-proto_buffers_done = 0
-
-melody_work_queue = queue.Queue(0)
-melodies_done = 0
-
-for root, dirs, files in os.walk(MXL_DATA_FOLDER):
-    for file in files:
-        if file.endswith('.mxl'):
-            mxl_work_queue.put(os.path.join(root, file))
-        elif file.endswith('.pb'):
-            proto_buffer_work_queue.put(os.path.join(root, file))
-        elif file.endswith(('.melody_pb')):
-            melody_work_queue.put(os.path.join(root, file))
-            # take for every song only one version into account!
-            break
-
-mxl_files_to_do = mxl_work_queue.qsize()
-mxl_start_time = time.time()
-
-proto_buffers_to_do = proto_buffer_work_queue.qsize()
-proto_buffer_start_time = mxl_start_time
-
-melodies_to_do = melody_work_queue.qsize()
-melodies_start_time = mxl_start_time
-
 
 def make_music_list():
     ml = music_info.MusicList(settings=music_settings, counter=0)
     return ml
 
 
-if not music_protocol_buffer:
-
-    print("create music info file")
-
-    music_protocol_buffer = make_music_list()
-
-    with open(PROTOCOL_BUFFER_LOCATION, 'xb') as fp:
-        fp.write(music_protocol_buffer.SerializeToString())
-
-else:
-    for f in music_protocol_buffer.music_data:
-        existing_files[f.filepath] = f.valid
-
 ##################################################################
 ################ MODEL CONSTANTS #################################
 ##################################################################
 
 sequence_length = 30
-
-
-print("finished setup in {sec} seconds".format(sec=str(round(time.time() - start_time, 2))))
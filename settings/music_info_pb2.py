@@ -13,13 +13,13 @@ from google.protobuf import symbol_database as _symbol_database
 
 _sym_db = _symbol_database.Default()
 
+
 DESCRIPTOR = _descriptor.FileDescriptor(
     name='music_info.proto',
     package='music_info',
     syntax='proto2',
     serialized_options=None,
-    serialized_pb=_b(
-        '\n\x10music_info.proto\x12\nmusic_info\"\x8e\x01\n\nMelodyList\x12\x10\n\x08\x66ilepath\x18\x01 \x02(\t\x12\x12\n\nextra_info\x18\x02 \x01(\t\x12.\n\talgorithm\x18\x03 \x01(\x0e\x32\x1b.music_info.MelodyAlgorithm\x12*\n\x08melodies\x18\x04 \x03(\x0b\x32\x18.music_info.MelodyPartPB\"W\n\x0cMelodyPartPB\x12\x14\n\x0c\x61\x63tual_start\x18\x01 \x02(\x02\x12\x0f\n\x07offsets\x18\x02 \x03(\x02\x12\x0f\n\x07lengths\x18\x03 \x03(\x02\x12\x0f\n\x07pitches\x18\x04 \x03(\x05\"u\n\x0fVanillaStreamPB\x12\x10\n\x08\x66ilepath\x18\x01 \x02(\t\x12(\n\x05parts\x18\x02 \x03(\x0b\x32\x19.music_info.VanillaPartPB\x12&\n\x04info\x18\x03 \x02(\x0b\x32\x18.music_info.PieceOfMusic\"a\n\rVanillaPartPB\x12\x0c\n\x04name\x18\x01 \x02(\t\x12\x0f\n\x07offsets\x18\x02 \x03(\x02\x12\x0f\n\x07lengths\x18\x03 \x03(\x02\x12\x0f\n\x07pitches\x18\x04 \x03(\x05\x12\x0f\n\x07volumes\x18\x05 \x03(\x05\"\xea\x02\n\x0cPieceOfMusic\x12\x10\n\x08\x66ilepath\x18\x01 \x02(\t\x12\r\n\x05valid\x18\x02 \x02(\x08\x12\x15\n\rmin_metronome\x18\x04 \x01(\x05\x12\x15\n\rmax_metronome\x18\x05 \x01(\x05\x12\x0b\n\x03key\x18\x06 \x01(\t\x12\x17\n\x0fkey_correlation\x18\x07 \x01(\x02\x12,\n\x05parts\x18\x08 \x03(\x0b\x32\x1d.music_info.PieceOfMusic.Part\x12$\n\x05\x65rror\x18\x0c \x01(\x0e\x32\x15.music_info.ErrorEnum\x1a\x90\x01\n\x04Part\x12\x0c\n\x04name\x18\x01 \x02(\t\x12\x15\n\raverage_pitch\x18\x02 \x01(\x02\x12\x16\n\x0e\x61verage_volume\x18\x03 \x01(\x02\x12\x17\n\x0fkey_correlation\x18\x05 \x01(\x02\x12\x17\n\x0fnote_percentage\x18\x06 \x01(\x02\x12\x19\n\x11lyrics_percentage\x18\x07 \x01(\x02\"\xbc\x01\n\x08Settings\x12\x11\n\tmin_pitch\x18\x01 \x02(\x02\x12\x11\n\tmax_pitch\x18\x02 \x02(\x02\x12\x1d\n\x15\x64\x65lete_part_threshold\x18\x03 \x02(\x02\x12\x1f\n\x17\x64\x65lete_stream_threshold\x18\x04 \x02(\x02\x12\x14\n\x0c\x61\x63\x63\x65pted_key\x18\x05 \x02(\t\x12\x0f\n\x07max_bpm\x18\x06 \x02(\x05\x12\x0f\n\x07min_bpm\x18\x07 \x02(\x05\x12\x12\n\nvalid_time\x18\x08 \x02(\t\"r\n\tMusicList\x12&\n\x08settings\x18\x01 \x02(\x0b\x32\x14.music_info.Settings\x12,\n\nmusic_data\x18\x02 \x03(\x0b\x32\x18.music_info.PieceOfMusic\x12\x0f\n\x07\x63ounter\x18\x03 \x02(\x05*\x8d\x01\n\tErrorEnum\x12\x18\n\x14WRONG_TIME_SIGNATURE\x10\x00\x12\r\n\tWRONG_BPM\x10\x01\x12\r\n\tWRONG_KEY\x10\x02\x12\x0f\n\x0bINVALID_KEY\x10\x03\x12\x17\n\x13LOW_CORRELATION_KEY\x10\x04\x12\x0c\n\x08NO_PARTS\x10\x05\x12\x10\n\x0cINVALID_FILE\x10\x06*K\n\x0fMelodyAlgorithm\x12\x12\n\x0eSKYLINE_SIMPLE\x10\x00\x12\x14\n\x10SKYLINE_ADVANCED\x10\x01\x12\x0e\n\nTF_SKYLINE\x10\x02')
+    serialized_pb=_b('\n\x10music_info.proto\x12\nmusic_info\"\xd3\x01\n\nMelodyList\x12\x10\n\x08\x66ilepath\x18\x01 \x02(\t\x12\x12\n\nextra_info\x18\x02 \x01(\t\x12.\n\talgorithm\x18\x03 \x01(\x0e\x32\x1b.music_info.MelodyAlgorithm\x12*\n\x08melodies\x18\x04 \x03(\x0b\x32\x18.music_info.MelodyPartPB\x12\x12\n\x07version\x18\x05 \x01(\x05:\x01\x31\x12/\n\x0bmelodies_v2\x18\x06 \x03(\x0b\x32\x1a.music_info.MelodyPartV2PB\"W\n\x0cMelodyPartPB\x12\x14\n\x0c\x61\x63tual_start\x18\x01 \x02(\x02\x12\x0f\n\x07offsets\x18\x02 \x03(\x02\x12\x0f\n\x07lengths\x18\x03 \x03(\x02\x12\x0f\n\x07pitches\x18\x04 \x03(\x05\"k\n\x0eMelodyPartV2PB\x12\x14\n\x0c\x61\x63tual_start\x18\x01 \x02(\x02\x12\x19\n\roffset_deltas\x18\x02 \x03(\x11\x42\x02\x10\x01\x12\x13\n\x07lengths\x18\x03 \x03(\x05\x42\x02\x10\x01\x12\x13\n\x07pitches\x18\x04 \x03(\x05\x42\x02\x10\x01\"\xb8\x01\n\x0fVanillaStreamPB\x12\x10\n\x08\x66ilepath\x18\x01 \x02(\t\x12(\n\x05parts\x18\x02 \x03(\x0b\x32\x19.music_info.VanillaPartPB\x12&\n\x04info\x18\x03 \x02(\x0b\x32\x18.music_info.PieceOfMusic\x12\x12\n\x07version\x18\x04 \x01(\x05:\x01\x31\x12-\n\x08parts_v2\x18\x05 \x03(\x0b\x32\x1b.music_info.VanillaPartV2PB\"a\n\rVanillaPartPB\x12\x0c\n\x04name\x18\x01 \x02(\t\x12\x0f\n\x07offsets\x18\x02 \x03(\x02\x12\x0f\n\x07lengths\x18\x03 \x03(\x02\x12\x0f\n\x07pitches\x18\x04 \x03(\x05\x12\x0f\n\x07volumes\x18\x05 \x03(\x05\"y\n\x0fVanillaPartV2PB\x12\x0c\n\x04name\x18\x01 \x02(\t\x12\x19\n\roffset_deltas\x18\x02 \x03(\x11\x42\x02\x10\x01\x12\x13\n\x07lengths\x18\x03 \x03(\x05\x42\x02\x10\x01\x12\x13\n\x07pitches\x18\x04 \x03(\x05\x42\x02\x10\x01\x12\x13\n\x07volumes\x18\x05 \x03(\x05\x42\x02\x10\x01\"\xea\x02\n\x0cPieceOfMusic\x12\x10\n\x08\x66ilepath\x18\x01 \x02(\t\x12\r\n\x05valid\x18\x02 \x02(\x08\x12\x15\n\rmin_metronome\x18\x04 \x01(\x05\x12\x15\n\rmax_metronome\x18\x05 \x01(\x05\x12\x0b\n\x03key\x18\x06 \x01(\t\x12\x17\n\x0fkey_correlation\x18\x07 \x01(\x02\x12,\n\x05parts\x18\x08 \x03(\x0b\x32\x1d.music_info.PieceOfMusic.Part\x12$\n\x05\x65rror\x18\x0c \x01(\x0e\x32\x15.music_info.ErrorEnum\x1a\x90\x01\n\x04Part\x12\x0c\n\x04name\x18\x01 \x02(\t\x12\x15\n\raverage_pitch\x18\x02 \x01(\x02\x12\x16\n\x0e\x61verage_volume\x18\x03 \x01(\x02\x12\x17\n\x0fkey_correlation\x18\x05 \x01(\x02\x12\x17\n\x0fnote_percentage\x18\x06 \x01(\x02\x12\x19\n\x11lyrics_percentage\x18\x07 \x01(\x02\"\xbc\x01\n\x08Settings\x12\x11\n\tmin_pitch\x18\x01 \x02(\x02\x12\x11\n\tmax_pitch\x18\x02 \x02(\x02\x12\x1d\n\x15\x64\x65lete_part_threshold\x18\x03 \x02(\x02\x12\x1f\n\x17\x64\x65lete_stream_threshold\x18\x04 \x02(\x02\x12\x14\n\x0c\x61\x63\x63\x65pted_key\x18\x05 \x02(\t\x12\x0f\n\x07max_bpm\x18\x06 \x02(\x05\x12\x0f\n\x07min_bpm\x18\x07 \x02(\x05\x12\x12\n\nvalid_time\x18\x08 \x02(\t\"r\n\tMusicList\x12&\n\x08settings\x18\x01 \x02(\x0b\x32\x14.music_info.Settings\x12,\n\nmusic_data\x18\x02 \x03(\x0b\x32\x18.music_info.PieceOfMusic\x12\x0f\n\x07\x63ounter\x18\x03 \x02(\x05*\xac\x01\n\tErrorEnum\x12\x18\n\x14WRONG_TIME_SIGNATURE\x10\x00\x12\r\n\tWRONG_BPM\x10\x01\x12\r\n\tWRONG_KEY\x10\x02\x12\x0f\n\x0bINVALID_KEY\x10\x03\x12\x17\n\x13LOW_CORRELATION_KEY\x10\x04\x12\x0c\n\x08NO_PARTS\x10\x05\x12\x10\n\x0cINVALID_FILE\x10\x06\x12\x0b\n\x07TIMEOUT\x10\x07\x12\x10\n\x0cMEMORY_LIMIT\x10\x08*K\n\x0fMelodyAlgorithm\x12\x12\n\x0eSKYLINE_SIMPLE\x10\x00\x12\x14\n\x10SKYLINE_ADVANCED\x10\x01\x12\x0e\n\nTF_SKYLINE\x10\x02')
 )
 
 _ERRORENUM = _descriptor.EnumDescriptor(
@@ -56,11 +56,19 @@ _ERRORENUM = _descriptor.EnumDescriptor(
             name='INVALID_FILE', index=6, number=6,
             serialized_options=None,
             type=None),
+        _descriptor.EnumValueDescriptor(
+            name='TIMEOUT', index=7, number=7,
+            serialized_options=None,
+            type=None),
+        _descriptor.EnumValueDescriptor(
+            name='MEMORY_LIMIT', index=8, number=8,
+            serialized_options=None,
+            type=None),
     ],
     containing_type=None,
     serialized_options=None,
-    serialized_start=1157,
-    serialized_end=1298,
+    serialized_start=1526,
+    serialized_end=1698,
 )
 _sym_db.RegisterEnumDescriptor(_ERRORENUM)
 
@@ -86,8 +94,8 @@ _MELODYALGORITHM = _descriptor.EnumDescriptor(
     ],
     containing_type=None,
     serialized_options=None,
-    serialized_start=1300,
-    serialized_end=1375,
+    serialized_start=1700,
+    serialized_end=1775,
 )
 _sym_db.RegisterEnumDescriptor(_MELODYALGORITHM)
 
@@ -99,10 +107,13 @@ INVALID_KEY = 3
 LOW_CORRELATION_KEY = 4
 NO_PARTS = 5
 INVALID_FILE = 6
+TIMEOUT = 7
+MEMORY_LIMIT = 8
 SKYLINE_SIMPLE = 0
 SKYLINE_ADVANCED = 1
 TF_SKYLINE = 2
 
+
 _MELODYLIST = _descriptor.Descriptor(
     name='MelodyList',
     full_name='music_info.MelodyList',
@@ -138,6 +149,20 @@ _MELODYLIST = _descriptor.Descriptor(
             message_type=None, enum_type=None, containing_type=None,
             is_extension=False, extension_scope=None,
             serialized_options=None, file=DESCRIPTOR),
+        _descriptor.FieldDescriptor(
+            name='version', full_name='music_info.MelodyList.version', index=4,
+            number=5, type=5, cpp_type=1, label=1,
+            has_default_value=True, default_value=1,
+            message_type=None, enum_type=None, containing_type=None,
+            is_extension=False, extension_scope=None,
+            serialized_options=None, file=DESCRIPTOR),
+        _descriptor.FieldDescriptor(
+            name='melodies_v2', full_name='music_info.MelodyList.melodies_v2', index=5,
+            number=6, type=11, cpp_type=10, label=3,
+            has_default_value=False, default_value=[],
+            message_type=None, enum_type=None, containing_type=None,
+            is_extension=False, extension_scope=None,
+            serialized_options=None, file=DESCRIPTOR),
     ],
     extensions=[
     ],
@@ -151,9 +176,10 @@ _MELODYLIST = _descriptor.Descriptor(
     oneofs=[
     ],
     serialized_start=33,
-    serialized_end=175,
+    serialized_end=244,
 )
 
+
 _MELODYPARTPB = _descriptor.Descriptor(
     name='MelodyPartPB',
     full_name='music_info.MelodyPartPB',
@@ -201,8 +227,60 @@ _MELODYPARTPB = _descriptor.Descriptor(
     extension_ranges=[],
     oneofs=[
     ],
-    serialized_start=177,
-    serialized_end=264,
+    serialized_start=246,
+    serialized_end=333,
+)
+
+
+_MELODYPARTV2PB = _descriptor.Descriptor(
+    name='MelodyPartV2PB',
+    full_name='music_info.MelodyPartV2PB',
+    filename=None,
+    file=DESCRIPTOR,
+    containing_type=None,
+    fields=[
+        _descriptor.FieldDescriptor(
+            name='actual_start', full_name='music_info.MelodyPartV2PB.actual_start', index=0,
+            number=1, type=2, cpp_type=6, label=2,
+            has_default_value=False, default_value=float(0),
+            message_type=None, enum_type=None, containing_type=None,
+            is_extension=False, extension_scope=None,
+            serialized_options=None, file=DESCRIPTOR),
+        _descriptor.FieldDescriptor(
+            name='offset_deltas', full_name='music_info.MelodyPartV2PB.offset_deltas', index=1,
+            number=2, type=17, cpp_type=1, label=3,
+            has_default_value=False, default_value=[],
+            message_type=None, enum_type=None, containing_type=None,
+            is_extension=False, extension_scope=None,
+            serialized_options=_b('\020\001'), file=DESCRIPTOR),
+        _descriptor.FieldDescriptor(
+            name='lengths', full_name='music_info.MelodyPartV2PB.lengths', index=2,
+            number=3, type=5, cpp_type=1, label=3,
+            has_default_value=False, default_value=[],
+            message_type=None, enum_type=None, containing_type=None,
+            is_extension=False, extension_scope=None,
+            serialized_options=_b('\020\001'), file=DESCRIPTOR),
+        _descriptor.FieldDescriptor(
+            name='pitches', full_name='music_info.MelodyPartV2PB.pitches', index=3,
+            number=4, type=5, cpp_type=1, label=3,
+            has_default_value=False, default_value=[],
+            message_type=None, enum_type=None, containing_type=None,
+            is_extension=False, extension_scope=None,
+            serialized_options=_b('\020\001'), file=DESCRIPTOR),
+    ],
+    extensions=[
+    ],
+    nested_types=[],
+    enum_types=[
+    ],
+    serialized_options=None,
+    is_extendable=False,
+    syntax='proto2',
+    extension_ranges=[],
+    oneofs=[
+    ],
+    serialized_start=335,
+    serialized_end=442,
 )
 
 
@@ -234,6 +312,20 @@ _VANILLASTREAMPB = _descriptor.Descriptor(
             message_type=None, enum_type=None, containing_type=None,
             is_extension=False, extension_scope=None,
             serialized_options=None, file=DESCRIPTOR),
+        _descriptor.FieldDescriptor(
+            name='version', full_name='music_info.VanillaStreamPB.version', index=3,
+            number=4, type=5, cpp_type=1, label=1,
+            has_default_value=True, default_value=1,
+            message_type=None, enum_type=None, containing_type=None,
+            is_extension=False, extension_scope=None,
+            serialized_options=None, file=DESCRIPTOR),
+        _descriptor.FieldDescriptor(
+            name='parts_v2', full_name='music_info.VanillaStreamPB.parts_v2', index=4,
+            number=5, type=11, cpp_type=10, label=3,
+            has_default_value=False, default_value=[],
+            message_type=None, enum_type=None, containing_type=None,
+            is_extension=False, extension_scope=None,
+            serialized_options=None, file=DESCRIPTOR),
     ],
     extensions=[
     ],
@@ -246,10 +338,11 @@ _VANILLASTREAMPB = _descriptor.Descriptor(
     extension_ranges=[],
     oneofs=[
     ],
-    serialized_start=266,
-    serialized_end=383,
+    serialized_start=445,
+    serialized_end=629,
 )
 
+
 _VANILLAPARTPB = _descriptor.Descriptor(
     name='VanillaPartPB',
     full_name='music_info.VanillaPartPB',
@@ -304,8 +397,67 @@ _VANILLAPARTPB = _descriptor.Descriptor(
     extension_ranges=[],
     oneofs=[
     ],
-    serialized_start=385,
-    serialized_end=482,
+    serialized_start=631,
+    serialized_end=728,
+)
+
+
+_VANILLAPARTV2PB = _descriptor.Descriptor(
+    name='VanillaPartV2PB',
+    full_name='music_info.VanillaPartV2PB',
+    filename=None,
+    file=DESCRIPTOR,
+    containing_type=None,
+    fields=[
+        _descriptor.FieldDescriptor(
+            name='name', full_name='music_info.VanillaPartV2PB.name', index=0,
+            number=1, type=9, cpp_type=9, label=2,
+            has_default_value=False, default_value=_b("").decode('utf-8'),
+            message_type=None, enum_type=None, containing_type=None,
+            is_extension=False, extension_scope=None,
+            serialized_options=None, file=DESCRIPTOR),
+        _descriptor.FieldDescriptor(
+            name='offset_deltas', full_name='music_info.VanillaPartV2PB.offset_deltas', index=1,
+            number=2, type=17, cpp_type=1, label=3,
+            has_default_value=False, default_value=[],
+            message_type=None, enum_type=None, containing_type=None,
+            is_extension=False, extension_scope=None,
+            serialized_options=_b('\020\001'), file=DESCRIPTOR),
+        _descriptor.FieldDescriptor(
+            name='lengths', full_name='music_info.VanillaPartV2PB.lengths', index=2,
+            number=3, type=5, cpp_type=1, label=3,
+            has_default_value=False, default_value=[],
+            message_type=None, enum_type=None, containing_type=None,
+            is_extension=False, extension_scope=None,
+            serialized_options=_b('\020\001'), file=DESCRIPTOR),
+        _descriptor.FieldDescriptor(
+            name='pitches', full_name='music_info.VanillaPartV2PB.pitches', index=3,
+            number=4, type=5, cpp_type=1, label=3,
+            has_default_value=False, default_value=[],
+            message_type=None, enum_type=None, containing_type=None,
+            is_extension=False, extension_scope=None,
+            serialized_options=_b('\020\001'), file=DESCRIPTOR),
+        _descriptor.FieldDescriptor(
+            name='volumes', full_name='music_info.VanillaPartV2PB.volumes', index=4,
+            number=5, type=5, cpp_type=1, label=3,
+            has_default_value=False, default_value=[],
+            message_type=None, enum_type=None, containing_type=None,
+            is_extension=False, extension_scope=None,
+            serialized_options=_b('\020\001'), file=DESCRIPTOR),
+    ],
+    extensions=[
+    ],
+    nested_types=[],
+    enum_types=[
+    ],
+    serialized_options=None,
+    is_extendable=False,
+    syntax='proto2',
+    extension_ranges=[],
+    oneofs=[
+    ],
+    serialized_start=730,
+    serialized_end=851,
 )
 
 
@@ -370,8 +522,8 @@ _PIECEOFMUSIC_PART = _descriptor.Descriptor(
     extension_ranges=[],
     oneofs=[
     ],
-    serialized_start=703,
-    serialized_end=847,
+    serialized_start=1072,
+    serialized_end=1216,
 )
 
 _PIECEOFMUSIC = _descriptor.Descriptor(
@@ -449,8 +601,8 @@ _PIECEOFMUSIC = _descriptor.Descriptor(
     extension_ranges=[],
     oneofs=[
     ],
-    serialized_start=485,
-    serialized_end=847,
+    serialized_start=854,
+    serialized_end=1216,
 )
 
 
@@ -529,8 +681,8 @@ _SETTINGS = _descriptor.Descriptor(
     extension_ranges=[],
     oneofs=[
     ],
-    serialized_start=850,
-    serialized_end=1038,
+    serialized_start=1219,
+    serialized_end=1407,
 )
 
 
@@ -574,14 +726,16 @@ _MUSICLIST = _descriptor.Descriptor(
     extension_ranges=[],
     oneofs=[
     ],
-    serialized_start=1040,
-    serialized_end=1154,
+    serialized_start=1409,
+    serialized_end=1523,
 )
 
 _MELODYLIST.fields_by_name['algorithm'].enum_type = _MELODYALGORITHM
 _MELODYLIST.fields_by_name['melodies'].message_type = _MELODYPARTPB
+_MELODYLIST.fields_by_name['melodies_v2'].message_type = _MELODYPARTV2PB
 _VANILLASTREAMPB.fields_by_name['parts'].message_type = _VANILLAPARTPB
 _VANILLASTREAMPB.fields_by_name['info'].message_type = _PIECEOFMUSIC
+_VANILLASTREAMPB.fields_by_name['parts_v2'].message_type = _VANILLAPARTV2PB
 _PIECEOFMUSIC_PART.containing_type = _PIECEOFMUSIC
 _PIECEOFMUSIC.fields_by_name['parts'].message_type = _PIECEOFMUSIC_PART
 _PIECEOFMUSIC.fields_by_name['error'].enum_type = _ERRORENUM
@@ -589,8 +743,10 @@ _MUSICLIST.fields_by_name['settings'].message_type = _SETTINGS
 _MUSICLIST.fields_by_name['music_data'].message_type = _PIECEOFMUSIC
 DESCRIPTOR.message_types_by_name['MelodyList'] = _MELODYLIST
 DESCRIPTOR.message_types_by_name['MelodyPartPB'] = _MELODYPARTPB
+DESCRIPTOR.message_types_by_name['MelodyPartV2PB'] = _MELODYPARTV2PB
 DESCRIPTOR.message_types_by_name['VanillaStreamPB'] = _VANILLASTREAMPB
 DESCRIPTOR.message_types_by_name['VanillaPartPB'] = _VANILLAPARTPB
+DESCRIPTOR.message_types_by_name['VanillaPartV2PB'] = _VANILLAPARTV2PB
 DESCRIPTOR.message_types_by_name['PieceOfMusic'] = _PIECEOFMUSIC
 DESCRIPTOR.message_types_by_name['Settings'] = _SETTINGS
 DESCRIPTOR.message_types_by_name['MusicList'] = _MUSICLIST
@@ -598,61 +754,82 @@ DESCRIPTOR.enum_types_by_name['ErrorEnum'] = _ERRORENUM
 DESCRIPTOR.enum_types_by_name['MelodyAlgorithm'] = _MELODYALGORITHM
 _sym_db.RegisterFileDescriptor(DESCRIPTOR)
 
-MelodyList = _reflection.GeneratedProtocolMessageType('MelodyList', (_message.Message,), dict(
-    DESCRIPTOR=_MELODYLIST,
-    __module__='music_info_pb2'
+MelodyList = _reflection.GeneratedProtocolMessageType('MelodyList', (_message.Message,), {
+    'DESCRIPTOR': _MELODYLIST,
+    '__module__': 'music_info_pb2'
     # @@protoc_insertion_point(class_scope:music_info.MelodyList)
-))
+})
 _sym_db.RegisterMessage(MelodyList)
 
-MelodyPartPB = _reflection.GeneratedProtocolMessageType('MelodyPartPB', (_message.Message,), dict(
-    DESCRIPTOR=_MELODYPARTPB,
-    __module__='music_info_pb2'
+MelodyPartPB = _reflection.GeneratedProtocolMessageType('MelodyPartPB', (_message.Message,), {
+    'DESCRIPTOR': _MELODYPARTPB,
+    '__module__': 'music_info_pb2'
     # @@protoc_insertion_point(class_scope:music_info.MelodyPartPB)
-))
+})
 _sym_db.RegisterMessage(MelodyPartPB)
 
-VanillaStreamPB = _reflection.GeneratedProtocolMessageType('VanillaStreamPB', (_message.Message,), dict(
-    DESCRIPTOR=_VANILLASTREAMPB,
-    __module__='music_info_pb2'
+MelodyPartV2PB = _reflection.GeneratedProtocolMessageType('MelodyPartV2PB', (_message.Message,), {
+    'DESCRIPTOR': _MELODYPARTV2PB,
+    '__module__': 'music_info_pb2'
+    # @@protoc_insertion_point(class_scope:music_info.MelodyPartV2PB)
+})
+_sym_db.RegisterMessage(MelodyPartV2PB)
+
+VanillaStreamPB = _reflection.GeneratedProtocolMessageType('VanillaStreamPB', (_message.Message,), {
+    'DESCRIPTOR': _VANILLASTREAMPB,
+    '__module__': 'music_info_pb2'
     # @@protoc_insertion_point(class_scope:music_info.VanillaStreamPB)
-))
+})
 _sym_db.RegisterMessage(VanillaStreamPB)
 
-VanillaPartPB = _reflection.GeneratedProtocolMessageType('VanillaPartPB', (_message.Message,), dict(
-    DESCRIPTOR=_VANILLAPARTPB,
-    __module__='music_info_pb2'
+VanillaPartPB = _reflection.GeneratedProtocolMessageType('VanillaPartPB', (_message.Message,), {
+    'DESCRIPTOR': _VANILLAPARTPB,
+    '__module__': 'music_info_pb2'
     # @@protoc_insertion_point(class_scope:music_info.VanillaPartPB)
-))
+})
 _sym_db.RegisterMessage(VanillaPartPB)
 
-PieceOfMusic = _reflection.GeneratedProtocolMessageType('PieceOfMusic', (_message.Message,), dict(
+VanillaPartV2PB = _reflection.GeneratedProtocolMessageType('VanillaPartV2PB', (_message.Message,), {
+    'DESCRIPTOR': _VANILLAPARTV2PB,
+    '__module__': 'music_info_pb2'
+    # @@protoc_insertion_point(class_scope:music_info.VanillaPartV2PB)
+})
+_sym_db.RegisterMessage(VanillaPartV2PB)
+
+PieceOfMusic = _reflection.GeneratedProtocolMessageType('PieceOfMusic', (_message.Message,), {
 
-    Part=_reflection.GeneratedProtocolMessageType('Part', (_message.Message,), dict(
-        DESCRIPTOR=_PIECEOFMUSIC_PART,
-        __module__='music_info_pb2'
+    'Part': _reflection.GeneratedProtocolMessageType('Part', (_message.Message,), {
+        'DESCRIPTOR': _PIECEOFMUSIC_PART,
+        '__module__': 'music_info_pb2'
         # @@protoc_insertion_point(class_scope:music_info.PieceOfMusic.Part)
-    ))
-    ,
-    DESCRIPTOR=_PIECEOFMUSIC,
-    __module__='music_info_pb2'
+    }),
+    'DESCRIPTOR': _PIECEOFMUSIC,
+    '__module__': 'music_info_pb2'
     # @@protoc_insertion_point(class_scope:music_info.PieceOfMusic)
-))
+})
 _sym_db.RegisterMessage(PieceOfMusic)
 _sym_db.RegisterMessage(PieceOfMusic.Part)
 
-Settings = _reflection.GeneratedProtocolMessageType('Settings', (_message.Message,), dict(
-    DESCRIPTOR=_SETTINGS,
-    __module__='music_info_pb2'
+Settings = _reflection.GeneratedProtocolMessageType('Settings', (_message.Message,), {
+    'DESCRIPTOR': _SETTINGS,
+    '__module__': 'music_info_pb2'
     # @@protoc_insertion_point(class_scope:music_info.Settings)
-))
+})
 _sym_db.RegisterMessage(Settings)
 
-MusicList = _reflection.GeneratedProtocolMessageType('MusicList', (_message.Message,), dict(
-    DESCRIPTOR=_MUSICLIST,
-    __module__='music_info_pb2'
+MusicList = _reflection.GeneratedProtocolMessageType('MusicList', (_message.Message,), {
+    'DESCRIPTOR': _MUSICLIST,
+    '__module__': 'music_info_pb2'
     # @@protoc_insertion_point(class_scope:music_info.MusicList)
-))
+})
 _sym_db.RegisterMessage(MusicList)
 
+
+_MELODYPARTV2PB.fields_by_name['offset_deltas']._options = None
+_MELODYPARTV2PB.fields_by_name['lengths']._options = None
+_MELODYPARTV2PB.fields_by_name['pitches']._options = None
+_VANILLAPARTV2PB.fields_by_name['offset_deltas']._options = None
+_VANILLAPARTV2PB.fields_by_name['lengths']._options = None
+_VANILLAPARTV2PB.fields_by_name['pitches']._options = None
+_VANILLAPARTV2PB.fields_by_name['volumes']._options = None
 # @@protoc_insertion_point(module_scope)
@@ -0,0 +1,21 @@
+import os
+
+# the sample files that come with the repository
+DATA_FOLDER = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data', 'MXL',
+                           'lmd_matched_mxl')
+
+# a few small .mxl files for the comparisons with music21, which take seconds per file
+SMALL_MXL_FILES = [os.path.join(DATA_FOLDER, 'TRAURYF128F147805D', '76a65b8a309f9469687d2b2c824f21ee.mxl'),
+                   os.path.join(DATA_FOLDER, 'TRAURZS12903CEB55A', 'ea626cd821fe6621f62d75a9993f3511.mxl'),
+                   os.path.join(DATA_FOLDER, 'TRAURZS12903CEB55A', '5f7531cdc3f55b707383080db7e1a2fc.mxl')]
+
+
+def data_files(extension: str) -> [str]:
+    """
+    :param extension: like '.pb'
+    :return: all sample files with this extension
+    """
+    files = []
+    for dir_path, _, filenames in os.walk(DATA_FOLDER):
+        files.extend(os.path.join(dir_path, f) for f in sorted(filenames) if f.endswith(extension))
+    return sorted(files)
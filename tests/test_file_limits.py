@@ -0,0 +1,33 @@
+import time
+
+import pytest
+
+from preprocessing.file_limits import FileLimits
+from preprocessing.helper import FileLimitExceededError
+
+
+def test_time_limit():
+    with pytest.raises(FileLimitExceededError, match="TIMEOUT"):
+        with FileLimits(time_limit=0.1, memory_limit=None, interval=0.05):
+            while True:
+                pass
+
+
+def test_raised_again_if_swallowed():
+    start = time.monotonic()
+    with pytest.raises(FileLimitExceededError):
+        with FileLimits(time_limit=0.1, memory_limit=None, interval=0.05):
+            try:
+                while True:
+                    pass
+            except FileLimitExceededError:
+                pass
+            while time.monotonic() - start < 10:
+                pass
+    assert time.monotonic() - start < 10
+
+
+def test_disarmed_after_exit():
+    with FileLimits(time_limit=0.1, memory_limit=None, interval=0.05):
+        pass
+    time.sleep(0.3)
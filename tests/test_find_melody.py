@@ -0,0 +1,71 @@
+import numpy as np
+import pytest
+
+import music_utils.simple_classes as simple
+import settings.constants as c
+from music_utils.proto_columns import read_vanilla_stream
+from preprocessing.melody_and_chords.find_melody import SKYLINE_ENGINES, skyline_batch, skyline_loop, tf_skyline, \
+    tf_skyline_batch
+from tests import data_files
+
+
+def random_note_list(rng: np.random.Generator, max_notes: int = 300) -> simple.NoteList:
+    """
+    a sorted NoteList of random notes in a few parts, with chords, long notes that overlap the next onsets,
+    jumps of more than an octave, pitches outside of the range and rests
+    :param rng:
+    :param max_notes:
+    :return:
+    """
+    number = int(rng.integers(0, max_notes))
+    grid = rng.choice([1, 2, 3, 4])
+    settings = c.music_settings
+
+    offsets = rng.integers(0, max(1, number // 3), number) / grid
+    lengths = rng.choice([0.25, 0.5, 1.0, 1.5, 2.0, 4.0, 8.0, 1 / 3], number, p=[.2, .2, .2, .1, .1, .1, .05, .05])
+    pitches = rng.integers(int(settings.min_pitch) - 6, int(settings.max_pitch) + 7, number)
+    pitches[rng.random(number) < 0.05] = 200
+    parts = rng.integers(0, rng.integers(1, 5), number)
+
+    notes = simple.NoteList.from_columns(offsets, lengths, pitches, rng.integers(0, 128, number), parts)
+    notes.sort()
+    return notes
+
+
+def melodies(song_melodies) -> list:
+    return [(start, melody.array.tolist()) for start, melody in song_melodies or []]
+
+
+@pytest.mark.parametrize('engine', sorted(SKYLINE_ENGINES))
+@pytest.mark.parametrize('seed', range(3))
+def test_skyline_engines(engine, seed):
+    rng = np.random.default_rng(seed)
+    note_lists = [random_note_list(rng) for _ in range(50)]
+
+    batches = []
+    for start in range(0, len(note_lists), 16):
+        batches.extend(skyline_batch(note_lists[start:start + 16], engine=engine))
+
+    for notes, batch_melody in zip(note_lists, batches):
+        expected = skyline_loop(notes).array
+        for actual in (SKYLINE_ENGINES[engine](notes).array, batch_melody.array):
+            assert len(actual) == len(expected)
+            assert (actual == expected).all()
+
+
+@pytest.fixture(scope='module')
+def songs() -> [simple.Song]:
+    songs = []
+    for filename in data_files('.pb'):
+        with open(filename, 'rb') as fp:
+            songs.append(simple.Song(read_vanilla_stream(fp.read())))
+    return songs
+
+
+@pytest.mark.parametrize('engine', sorted(SKYLINE_ENGINES))
+@pytest.mark.parametrize('split', [False, True])
+def test_tf_skyline_engines(songs, engine, split):
+    expected = [melodies(tf_skyline(song, split=split, engine='loop')) for song in songs]
+
+    assert [melodies(tf_skyline(song, split=split, engine=engine)) for song in songs] == expected
+    assert [melodies(m) for m in tf_skyline_batch(songs, split=split, engine=engine)] == expected
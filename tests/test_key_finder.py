@@ -0,0 +1,72 @@
+import music21 as m21
+import numpy as np
+import pytest
+
+from music_utils.key_finder import find_key, pitch_class_histogram
+from music_utils.vanilla_stream import VanillaStream
+from preprocessing.analyze_and_modify.create_modified_stream import make_file_container, process_file
+from tests import SMALL_MXL_FILES
+
+
+def assert_same_keys(m21_stream: m21.stream.Stream):
+    """
+    checks that find_key finds the same keys as analyze('key') of music21 for a stream and all of its parts
+    :param m21_stream:
+    :return:
+    """
+    for name, s in [('stream', m21_stream)] + [('part ' + str(p.partName), p)
+                                                for p in m21_stream.getElementsByClass('Part')]:
+        try:
+            expected = s.analyze('key')
+        except m21.analysis.discrete.DiscreteAnalysisException:
+            expected = None
+
+        histogram = pitch_class_histogram(s.flat.notes)
+        found = find_key(histogram) if histogram is not None else None
+
+        if expected is None or found is None:
+            assert expected is None and found is None, name
+            continue
+
+        expected_keys = [(k.name, k.correlationCoefficient) for k in [expected] + expected.alternateInterpretations]
+        found_keys = [(k.name, k.correlationCoefficient) for k in [found] + found.alternateInterpretations]
+        assert found_keys == expected_keys, name
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_random_histograms(seed):
+    # random histograms have many more ties and empty pitch classes than real files
+    random_generator = np.random.RandomState(seed)
+    for _ in range(20):
+        stream = m21.stream.Stream()
+        for pitch_class in range(12):
+            length = random_generator.choice([0, 0, 0, 1, 2, 4, random_generator.randint(1, 64)]) * 0.25
+            if length:
+                n = m21.note.Note(pitch_class + 60)
+                n.quarterLength = length
+                stream.append(n)
+
+        assert_same_keys(stream)
+
+
+def test_empty_histogram():
+    assert pitch_class_histogram(m21.stream.Stream().notes) is None
+
+
+@pytest.mark.parametrize('filename', SMALL_MXL_FILES)
+def test_files(filename):
+    m21_stream = VanillaStream(filename)
+    m21_file = m21.converter.parse(filename)
+    make_file_container(m21_file, m21_stream)
+    process_file(m21_file, m21_stream)
+
+    # the notes of the processed parts, as music21 would analyse them
+    m21_score = m21.stream.Score()
+    for p in m21_stream.parts:
+        m21_score.insert(0, p.to_m21())
+
+    assert_same_keys(m21_score)
+
+    # and once more in another key
+    m21_score.transpose(3, inPlace=True)
+    assert_same_keys(m21_score)
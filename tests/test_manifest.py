@@ -0,0 +1,78 @@
+import os
+
+import pytest
+
+from preprocessing.manifest import Manifest, PB_ARTIFACT, SKYLINE_SIMPLE_ARTIFACT, TF_SKYLINE_ARTIFACT, \
+    empty_artifact
+
+
+@pytest.fixture
+def manifest(tmp_path) -> Manifest:
+    data_folder = tmp_path / 'data'
+    (data_folder / 'song').mkdir(parents=True)
+    (data_folder / 'song' / 'a.mxl').write_bytes(b'first version')
+    (data_folder / 'song' / 'b.mxl').write_bytes(b'other file')
+    manifest = Manifest(str(tmp_path / 'manifest.sqlite'), str(data_folder))
+    manifest.update()
+    return manifest
+
+
+def test_changed_source_is_pending_again(manifest):
+    manifest.add_artifact('song/a.mxl', PB_ARTIFACT, 'settings')
+    manifest.add_artifact('song/a.mxl', TF_SKYLINE_ARTIFACT, 'settings')
+    manifest.add_invalid(['song/b.mxl'], 'settings')
+    assert manifest.pending(PB_ARTIFACT, settings='settings') == []
+
+    with open(os.path.join(manifest.data_folder, 'song', 'a.mxl'), 'wb') as fp:
+        fp.write(b'second version')
+    with open(os.path.join(manifest.data_folder, 'song', 'b.mxl'), 'wb') as fp:
+        fp.write(b'another file')
+
+    assert sorted(manifest.update()) == ['song/a.mxl', 'song/b.mxl']
+    assert manifest.pending(PB_ARTIFACT, settings='settings') == \
+        [os.path.join(manifest.data_folder, 'song', f) for f in ('a.mxl', 'b.mxl')]
+    assert not manifest.has_artifact('song/a.mxl', TF_SKYLINE_ARTIFACT, 'settings')
+
+
+def test_touched_source_keeps_its_artifacts(manifest):
+    manifest.add_artifact('song/a.mxl', PB_ARTIFACT, 'settings')
+    os.utime(os.path.join(manifest.data_folder, 'song', 'a.mxl'), (0, 0))
+
+    assert manifest.update() == []
+    assert manifest.has_artifact('song/a.mxl', PB_ARTIFACT, 'settings')
+
+
+def test_found_artifacts_need_their_settings(manifest):
+    with open(os.path.join(manifest.data_folder, 'song', 'a.pb'), 'wb') as fp:
+        fp.write(b'')
+    manifest.update()
+
+    assert not manifest.has_artifact('song/a.mxl', PB_ARTIFACT, 'settings')
+    assert len(manifest.pending(PB_ARTIFACT, settings='settings')) == 2
+
+    manifest.adopt_artifacts(['song/a.mxl'], 'settings')
+    assert manifest.has_artifact('song/a.mxl', PB_ARTIFACT, 'settings')
+    assert not manifest.has_artifact('song/a.mxl', PB_ARTIFACT, 'other settings')
+    assert manifest.pending(PB_ARTIFACT, settings='settings') == \
+        [os.path.join(manifest.data_folder, 'song', 'b.mxl')]
+
+
+def test_artifact_path_only_replaces_the_suffix(manifest):
+    assert manifest.artifact_path('songs.mxl/a.mxl', PB_ARTIFACT) == \
+        os.path.join(manifest.data_folder, 'songs.mxl', 'a.pb')
+    assert manifest.artifact_path('songs.mxl/a.pb', TF_SKYLINE_ARTIFACT) == \
+        os.path.join(manifest.data_folder, 'songs.mxl', 'a_tf_skyline.melody_pb')
+
+
+def test_empty_artifacts_are_done(manifest):
+    for f in ('song/a.mxl', 'song/b.mxl'):
+        manifest.add_artifact(f, PB_ARTIFACT, 'settings')
+    manifest.add_artifact('song/a.mxl', TF_SKYLINE_ARTIFACT, 'settings')
+    manifest.add_artifact('song/b.mxl', empty_artifact(TF_SKYLINE_ARTIFACT), 'settings')
+
+    assert manifest.has_artifact('song/b.mxl', TF_SKYLINE_ARTIFACT, 'settings')
+    assert manifest.pending(TF_SKYLINE_ARTIFACT, requires=PB_ARTIFACT, settings='settings') == []
+    assert len(manifest.pending([TF_SKYLINE_ARTIFACT, SKYLINE_SIMPLE_ARTIFACT], requires=PB_ARTIFACT,
+                                settings='settings')) == 2
+    assert manifest.done_per_song(TF_SKYLINE_ARTIFACT, 'settings') == \
+        [os.path.join(manifest.data_folder, 'song', 'a_tf_skyline.melody_pb')]
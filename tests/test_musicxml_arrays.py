@@ -0,0 +1,134 @@
+import music21 as m21
+import pytest
+
+import settings.music_info_pb2 as music_info
+from music_utils.vanilla_stream import VanillaStream
+from preprocessing.analyze_and_modify.create_modified_stream import make_file_container, \
+    make_file_container_from_header, process_file
+from preprocessing.analyze_and_modify.make_info import make_vanilla_stream_proto_buffer
+from preprocessing.analyze_and_modify.musicxml_arrays import make_vanilla_stream_proto_buffer_from_parts, \
+    read_parts
+from tests import SMALL_MXL_FILES
+
+
+MUSICXML = """<?xml version="1.0" encoding="UTF-8"?>
+<score-partwise version="3.1">
+  <part-list>
+    <score-part id="P1">
+      <part-name>Piano</part-name>
+      <score-instrument id="P1-I1"><instrument-name>Piano</instrument-name></score-instrument>
+      <score-instrument id="P1-I2"><instrument-name>Strings</instrument-name></score-instrument>
+      <midi-instrument id="P1-I1"><midi-channel>1</midi-channel><midi-program>1</midi-program></midi-instrument>
+      <midi-instrument id="P1-I2"><midi-channel>2</midi-channel><midi-program>49</midi-program></midi-instrument>
+    </score-part>
+    {score_part}
+  </part-list>
+  {part_p1}
+  {part_p2}
+</score-partwise>
+"""
+
+PART = """<part id="{id}">
+    <measure number="1">
+      <attributes><divisions>1</divisions><time><beats>4</beats><beat-type>4</beat-type></time></attributes>
+      <note dynamics="80"><pitch><step>C</step><octave>4</octave></pitch><duration>2</duration><type>half</type></note>
+      <note dynamics="80"><pitch><step>E</step><octave>4</octave></pitch><duration>2</duration><type>half</type></note>
+    </measure>
+    <measure number="2">
+      {sound}
+      <note dynamics="80"><pitch><step>G</step><octave>4</octave></pitch><duration>4</duration><type>whole</type></note>
+    </measure>
+  </part>"""
+
+# a drum kit like MuseScore writes it, with an instrument for every drum
+DRUM_KIT = """<score-part id="P2">
+      <part-name>Percussion</part-name>
+      <score-instrument id="P2-I36"><instrument-name>Acoustic Bass Drum</instrument-name></score-instrument>
+      <score-instrument id="P2-I39"><instrument-name>Acoustic Snare</instrument-name></score-instrument>
+      <score-instrument id="P2-I43"><instrument-name>Closed Hi-Hat</instrument-name></score-instrument>
+      <midi-instrument id="P2-I36"><midi-channel>10</midi-channel><midi-unpitched>36</midi-unpitched></midi-instrument>
+      <midi-instrument id="P2-I39"><midi-channel>10</midi-channel><midi-unpitched>39</midi-unpitched></midi-instrument>
+      <midi-instrument id="P2-I43"><midi-channel>10</midi-channel><midi-unpitched>43</midi-unpitched></midi-instrument>
+    </score-part>"""
+
+# a part that switches to a drum instrument later
+SECOND_DRUM_INSTRUMENT = """<score-part id="P2">
+      <score-instrument id="P2-I1"><instrument-name>Guitar</instrument-name></score-instrument>
+      <score-instrument id="P2-I2"><instrument-name>Drum Set</instrument-name></score-instrument>
+      <midi-instrument id="P2-I1"><midi-channel>3</midi-channel><midi-program>25</midi-program></midi-instrument>
+      <midi-instrument id="P2-I2"><midi-channel>10</midi-channel></midi-instrument>
+    </score-part>"""
+
+GUITAR = """<score-part id="P2">
+      <part-name>Guitar</part-name>
+      <score-instrument id="P2-I1"><instrument-name>Guitar</instrument-name></score-instrument>
+      <midi-instrument id="P2-I1"><midi-channel>{channel}</midi-channel><midi-program>25</midi-program></midi-instrument>
+    </score-part>"""
+
+DRUM_CHANGE = '<sound><midi-instrument id="P2-I1"><midi-channel>10</midi-channel></midi-instrument></sound>'
+
+
+def _write_score(tmp_path, score_part: str, sound: str = '') -> str:
+    """
+    :return: the path of a MusicXML file with a piano part (with two instruments) and the part score_part
+    """
+    filename = str(tmp_path / 'score.xml')
+    with open(filename, 'w') as fp:
+        fp.write(MUSICXML.format(score_part=score_part, part_p1=PART.format(id='P1', sound=''),
+                                 part_p2=PART.format(id='P2', sound=sound)))
+    return filename
+
+
+def _assert_same_as_music21(filename):
+    m21_stream = VanillaStream(filename)
+    process_file(m21.converter.parse(filename), m21_stream)
+    expected = make_vanilla_stream_proto_buffer(m21_stream, music_info.PieceOfMusic())
+
+    parts = read_parts(filename)
+    actual = make_vanilla_stream_proto_buffer_from_parts(filename, parts, music_info.PieceOfMusic())
+
+    assert [p.name for p in actual.parts] == [p.name for p in expected.parts]
+
+    for expected_part, actual_part, m21_part, part in zip(expected.parts, actual.parts, m21_stream.parts, parts):
+        for column in ('offsets', 'lengths', 'pitches', 'volumes'):
+            assert list(getattr(actual_part, column)) == list(getattr(expected_part, column)), \
+                (expected_part.name, column)
+
+        for attribute in ('pitch_sum', 'volume_sum', 'note_number', 'total_notes_or_chords', 'total_pitches',
+                          'lyrics_number'):
+            assert getattr(part, '_' + attribute) == getattr(m21_part, '_' + attribute), \
+                (expected_part.name, attribute)
+
+
+@pytest.mark.parametrize('filename', SMALL_MXL_FILES)
+def test_file_container_from_header(filename):
+    expected = VanillaStream(filename)
+    make_file_container(m21.converter.parse(filename), expected)
+
+    actual = VanillaStream(filename)
+    assert make_file_container_from_header(actual)
+
+    assert actual.time_signature == expected.time_signature
+    assert actual.max_metronome == expected.max_metronome
+
+
+@pytest.mark.parametrize('filename', SMALL_MXL_FILES)
+def test_same_as_music21(filename):
+    _assert_same_as_music21(filename)
+
+
+def test_drum_kit_same_as_music21(tmp_path):
+    filename = _write_score(tmp_path, DRUM_KIT)
+
+    _assert_same_as_music21(filename)
+    assert [part.partName for part in read_parts(filename)] == ['Piano']
+
+
+@pytest.mark.parametrize('score_part, sound, names', [
+    (SECOND_DRUM_INSTRUMENT, '', ['Piano']),
+    (GUITAR.format(channel=3), DRUM_CHANGE, ['Piano']),
+    (GUITAR.format(channel=3), '', ['Piano', 'Guitar']),
+    (GUITAR.format(channel='three'), '', ['Piano', 'Guitar'])
+], ids=['second instrument', 'instrument change', 'no drums', 'channel no number'])
+def test_drum_instruments(tmp_path, score_part, sound, names):
+    assert [part.partName for part in read_parts(_write_score(tmp_path, score_part, sound))] == names
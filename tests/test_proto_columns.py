@@ -0,0 +1,81 @@
+from itertools import accumulate
+
+import pytest
+
+import settings.music_info_pb2 as music_info
+from music_utils.proto_columns import MELODY_PART_COLUMNS, VANILLA_PART_COLUMNS, convert_melody_list, \
+    convert_vanilla_stream, read_melody_list, read_vanilla_stream
+from tests import data_files
+
+
+def assert_same_as_protobuf(serialized: bytes, message_type):
+    """
+    reads a VanillaStreamPB or MelodyList with the protobuf library and with proto_columns and compares them
+    :param serialized:
+    :param message_type: music_info.VanillaStreamPB or music_info.MelodyList
+    :return:
+    """
+    expected = message_type()
+    expected.ParseFromString(serialized)
+
+    if message_type == music_info.VanillaStreamPB:
+        actual = read_vanilla_stream(serialized)
+        expected_parts = expected.parts_v2 if expected.version == 2 else expected.parts
+        actual_parts = actual.parts
+        columns = [name for name, _ in VANILLA_PART_COLUMNS.values()]
+        attributes = ['filepath', 'info', 'version']
+        part_attributes = ['name']
+    else:
+        actual = read_melody_list(serialized)
+        expected_parts = expected.melodies_v2 if expected.version == 2 else expected.melodies
+        actual_parts = actual.melodies
+        columns = [name for name, _ in MELODY_PART_COLUMNS.values()]
+        attributes = ['filepath', 'extra_info', 'algorithm', 'version']
+        part_attributes = ['actual_start']
+
+    for attribute in attributes:
+        assert getattr(actual, attribute) == getattr(expected, attribute), attribute
+
+    assert len(actual_parts) == len(expected_parts)
+
+    for e, a in zip(expected_parts, actual_parts):
+        for attribute in part_attributes:
+            assert getattr(a, attribute) == getattr(e, attribute), attribute
+        expected_columns = {column: list(getattr(e, column)) for column in columns if column != 'offsets'}
+        if expected.version == 2:
+            expected_columns['offsets'] = [offset / 4 for offset in accumulate(e.offset_deltas)]
+            expected_columns['lengths'] = [length / 4 for length in e.lengths]
+        else:
+            expected_columns['offsets'] = list(e.offsets)
+
+        for column in columns:
+            assert getattr(a, column).tolist() == expected_columns[column], column
+
+
+def read_file(filename: str) -> bytes:
+    with open(filename, 'rb') as fp:
+        return fp.read()
+
+
+@pytest.mark.parametrize('filename', data_files('.pb'))
+def test_vanilla_streams(filename):
+    serialized = read_file(filename)
+    assert_same_as_protobuf(serialized, music_info.VanillaStreamPB)
+
+    # the sample files are of version 1, and are kept exactly in version 2
+    converted = convert_vanilla_stream(serialized, version=2)
+    assert_same_as_protobuf(converted, music_info.VanillaStreamPB)
+    assert read_vanilla_stream(converted).version == 2
+    assert convert_vanilla_stream(converted, version=1) == serialized
+
+
+@pytest.mark.parametrize('filename', data_files('.melody_pb'))
+def test_melody_lists(filename):
+    serialized = read_file(filename)
+    assert_same_as_protobuf(serialized, music_info.MelodyList)
+
+    converted = convert_melody_list(serialized, version=2)
+    assert_same_as_protobuf(converted, music_info.MelodyList)
+    assert read_melody_list(converted).version == 2
+    assert convert_melody_list(converted, version=1) == serialized
+
@@ -0,0 +1,87 @@
+from fractions import Fraction
+
+import numpy as np
+import pytest
+
+from music_utils.vanilla_part import VanillaPart
+
+
+def random_events(random_generator: np.random.RandomState, number: int) -> list:
+    """
+    random notes and chords on the grids music21 makes: floats for powers of two, Fractions for tuplets,
+    with lengths around the limits of 0.2, 0.25 and 4 beats, and some not on any grid
+    :param random_generator:
+    :param number:
+    :return: tuples of start, end, volume, lyrics, pitches and if it is a chord
+    """
+    def random_value(grid: int):
+        value = Fraction(int(random_generator.randint(0, 400 * grid)), grid)
+        if grid & (grid - 1) == 0:
+            return float(value)
+        return value
+
+    events = []
+    for _ in range(number):
+        start = random_value(int(random_generator.choice([1, 2, 4, 8, 16, 32, 3, 5, 6, 12])))
+        length = random_generator.choice([0, Fraction(1, 5), 0.2, 0.1875, 0.125, 0.25, Fraction(1, 3),
+                                          Fraction(2, 5), 0.5, 1.0, 3.875, 4.0, 4.125, 6.0, 0.2000001,
+                                          random_generator.uniform(0, 5)])
+        size = int(random_generator.choice([0, 1, 1, 1, 2, 3, 4]))
+        pitches = [float(random_generator.choice([-4, 0, 36, 60, 60.5, 61, 72, 127, 128, 130]))
+                   for _ in range(size)]
+        volume = int(random_generator.randint(1, 128))
+        lyrics = bool(random_generator.randint(0, 2))
+        events.append((start, start + length, volume, lyrics, pitches, size != 1))
+
+    return events
+
+
+def assert_same_notes(expected: VanillaPart, actual: VanillaPart):
+    actual_arrays = actual.note_arrays()
+    for name, e in expected.note_arrays().items():
+        a = actual_arrays[name]
+        if isinstance(e, np.ndarray):
+            assert e.dtype == a.dtype, name
+            assert e.tolist() == a.tolist(), name
+        else:
+            assert type(e) == type(a), name
+            assert e == a, name
+    assert expected._sorted == actual._sorted
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_create_notes_is_create_note(seed):
+    events = random_events(np.random.RandomState(seed), 300)
+    starts = [e[0] for e in events for _ in e[4]]
+    ends = [e[1] for e in events for _ in e[4]]
+    pitches = [p for e in events for p in e[4]]
+
+    keep, offsets, lengths, kept_pitches, _ = VanillaPart.create_notes(starts, ends, pitches)
+
+    expected = [VanillaPart.create_note(start, end, pitch) for start, end, pitch in zip(starts, ends, pitches)]
+    assert keep.tolist() == [span is not None for span in expected]
+    assert list(zip(offsets.tolist(), lengths.tolist(), kept_pitches.tolist())) == \
+        [(span[0], span[1], pitch) for span, pitch in zip(expected, pitches) if span is not None]
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_insert_events_is_insert_pitches(seed):
+    events = random_events(np.random.RandomState(seed), 300)
+
+    expected = VanillaPart()
+    for start, end, volume, lyrics, pitches, chord in events:
+        expected.insert_pitches(start, end, volume, lyrics, pitches, chord)
+
+    actual = VanillaPart()
+    starts, ends, volumes, lyrics, pitches, chords = zip(*events)
+    actual.insert_events(list(starts), list(ends), list(volumes), list(lyrics),
+                         [p for event_pitches in pitches for p in event_pitches],
+                         [len(event_pitches) for event_pitches in pitches], list(chords))
+
+    assert_same_notes(expected, actual)
+
+
+def test_insert_no_events():
+    part = VanillaPart()
+    part.insert_events([], [], [], [], [], [], [])
+    assert_same_notes(VanillaPart(), part)